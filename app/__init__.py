@@ -0,0 +1,61 @@
+"""
+Module Documentation: app
+
+Application factory for the Bookstore API.
+
+create_app only wires configuration, the SQLAlchemy extension, routes and CLI commands. It does no database
+work, so every worker process starts fast. Tables and sample data are created explicitly with:
+
+    flask --app main init-db
+    flask --app main seed-db
+
+"""
+from flask import Flask
+
+
+def create_app(config_path=None, overrides=None):
+    """
+    Create and configure a Flask application.
+
+    Parameters:
+    - config_path (str): The path of config.ini (default is AppConfig's './config/config.ini').
+    - overrides (dict): Flask config values applied on top of config.ini.
+
+    Returns:
+    - Flask: The configured application.
+    """
+
+    from app.models import db
+    from app.routes import main_app
+    from app.commands import register_commands
+    from app.response_cache import response_cache
+    from app.replica import read_replica
+    from app.exports import export_jobs
+    from app.serialization import JSONProvider
+    from app.request_log import request_log
+    from app.profiler import request_profiler
+    from config.Config import AppConfig
+
+    app = Flask(__name__)
+    # orjson encoding of every JSON response (stdlib json without orjson)
+    app.json = JSONProvider(app)
+
+    config = AppConfig(path=config_path) if config_path else AppConfig()
+    config.configure_app(app, db, overrides)
+    response_cache.init_app(app)
+    read_replica.init_app(app)
+    export_jobs.init_app(app)
+    request_log.init_app(app)
+    request_profiler.init_app(app)
+
+    pool_settings = app.config['DATABASE_POOL']
+    if pool_settings.get('pgbouncer'):
+        from app.engine import install_statement_timeout
+
+        with app.app_context():
+            install_statement_timeout(db.engine, pool_settings)
+
+    app.register_blueprint(main_app)
+    register_commands(app)
+
+    return app
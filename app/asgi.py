@@ -0,0 +1,448 @@
+"""
+Module Documentation: asgi.py
+
+This module provides an ASGI version of the Bookstore API for async servers such as uvicorn.
+
+Handlers are coroutines on SQLAlchemy's asyncio extension (asyncpg for PostgreSQL, aiosqlite for SQLite),
+so a worker keeps serving other requests while it waits for the database. The statements, fee calculation
+and response envelope are the ones of the sync services (bookController, historyController, fees, utilities);
+only the session calls are awaited here. The Flask app built by create_app provides the configuration and
+the token authentication.
+
+Served routes: /books, /book/<id>, /author/<author>, /publisher/<publisher>, /date/<date>, /rent/<book_id>,
+/rent/batch, /return/<book_id>, /return/batch, /rentals and /revenue. Rents and returns accept an Idempotency-Key
+header like the Flask routes (see idempotency.py). NDJSON streaming and the admin routes are only served by the
+Flask app.
+
+Usage:
+    uvicorn asgi:app --workers 4
+
+Functions:
+- async_database_url: Switch a database URL to the async driver of its dialect.
+- token_required: Async counterpart of utilities.token_required.
+- idempotent: Async counterpart of idempotency.idempotent.
+- create_asgi_app: Build the ASGI application.
+
+Classes:
+- FastJSONResponse: JSON response encoded by serialization.dumps (orjson when installed).
+- AsyncBookstore: The async route handlers.
+
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from functools import wraps
+
+import jwt
+from sqlalchemy import insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from app import create_app
+from app.controllers.bookController import (AVAILABLE_BOOKS, BOOK_FIELDS, batch_results, books_page, books_query,
+                                            new_rentals, take_copies)
+from app.controllers.historyController import (REVENUE_GROUPS, close_rental, daily_revenue_upsert, restock,
+                                               rentals_query, revenue_breakdown, revenue_breakdown_query,
+                                               total_revenue_query)
+from app.engine import engine_options, install_statement_timeout
+from app.fees import DEFAULT_TIERS, batch_rental_fees, rental_fee
+from app.idempotency import (MAX_KEY_LENGTH, claim_state, claim_statement, fingerprint, release_statement,
+                             replay_error, store_statement, takeover_statement)
+from app.models import Book, IdempotencyKey, RentedHistory
+from app.response_cache import response_cache
+from app.serialization import dumps, rows_to_dicts
+from app.utilities import (authenticate, encode_cursor, get_batch, get_page_args, get_return_batch,
+                           is_date_args_valid, response_body, to_date, MAX_BATCH_SIZE)
+
+# Async driver of every supported dialect
+ASYNC_DRIVERS = {
+    'postgresql': 'asyncpg',
+    'sqlite': 'aiosqlite',
+}
+
+FORBIDDEN = "Oops you do not have the permission to access this resource."
+
+
+def async_database_url(url: str):
+    """
+    Switch a database URL to the async driver of its dialect, e.g. postgresql+psycopg2 to postgresql+asyncpg.
+
+    Parameters:
+    - url (str): The database URL of config.ini.
+
+    Returns:
+    - URL: The URL for create_async_engine.
+
+    Raises:
+    - ValueError: If the dialect has no supported async driver.
+    """
+
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver for {url.get_backend_name()}")
+    return url.set(drivername=f'{url.get_backend_name()}+{driver}')
+
+
+class FastJSONResponse(JSONResponse):
+    # Same encoder as the Flask app's JSONProvider
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def json_response(response_content, status_code=None, next_cursor=None):
+    # Same envelope as send_response
+    return FastJSONResponse(response_body(response_content, status_code, next_cursor), status_code=status_code or 200)
+
+
+def token_required(handler):
+    # Async counterpart of utilities.token_required, the handler receives the user first
+    @wraps(handler)
+    async def decorated(self, request):
+        token = request.headers.get('x-access-token')
+        if not token:
+            return FastJSONResponse({'message': 'Token is missing !!'}, status_code=401)
+
+        try:
+            # Tokens without the role claim, or of users whose role changed, query the database:
+            # a worker thread keeps the event loop serving other requests meanwhile
+            user = await asyncio.to_thread(self.authenticate, token)
+        except jwt.ExpiredSignatureError:
+            return FastJSONResponse({'message': 'Token has expired'}, status_code=401)
+        except jwt.InvalidTokenError:
+            return FastJSONResponse({'message': 'Invalid token'}, status_code=401)
+        return await handler(self, user, request)
+
+    return decorated
+
+
+async def claim_key(session, key: str, user_id: int, request_fingerprint: str):
+    """
+    Claim an idempotency key for the current request, like idempotency._claim.
+
+    Returns:
+    - IdempotencyKey or None: The existing row if the key was used before, None if the claim succeeded.
+    """
+
+    while True:
+        try:
+            await session.execute(claim_statement(key, user_id, request_fingerprint))
+            await session.commit()
+            return None
+        except IntegrityError:
+            await session.rollback()
+
+        stored = await session.get(IdempotencyKey, (key, user_id), populate_existing=True)
+        state = claim_state(stored, request_fingerprint, datetime.now())
+        if state == 'expired':
+            await session.execute(release_statement(key, user_id))
+            await session.commit()
+        elif state == 'abandoned':
+            taken = await session.execute(takeover_statement(stored, datetime.now()))
+            await session.commit()
+            if taken.rowcount == 1:
+                return None
+        elif state == 'used':
+            return stored
+
+
+def idempotent(handler):
+    # Async counterpart of idempotency.idempotent, applied below token_required
+    @wraps(handler)
+    async def decorated(self, user, request):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return await handler(self, user, request)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return json_response(f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters", 400)
+
+        # Same fingerprint as the Flask routes, so both apps can serve retries of the same key
+        path = f'{request.url.path}?{request.url.query}' if request.url.query else request.url.path
+        request_fingerprint = fingerprint(request.method, path, await request.body())
+        async with self.sessions() as session:
+            stored = await claim_key(session, key, user['id'], request_fingerprint)
+        if stored is not None:
+            error = replay_error(stored, request_fingerprint)
+            if error:
+                return json_response(*error)
+            return Response(stored.response, status_code=stored.status_code, media_type='application/json',
+                            headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = await handler(self, user, request)
+        except Exception:
+            async with self.sessions() as session, session.begin():
+                await session.execute(release_statement(key, user['id']))
+            raise
+
+        # Server errors are not stored, so the request can be retried with the same key
+        async with self.sessions() as session, session.begin():
+            if response.status_code >= 500:
+                await session.execute(release_statement(key, user['id']))
+            else:
+                await session.execute(store_statement(key, user['id'], response.status_code, response.body.decode()))
+        return response
+
+    return decorated
+
+
+class AsyncBookstore:
+
+    def __init__(self, flask_app, engine):
+        """
+        Parameters:
+        - flask_app: The Flask app of create_app, for the configuration and authentication.
+        - engine: The AsyncEngine of the database.
+        """
+        self.flask_app = flask_app
+        self.engine = engine
+        self.sessions = async_sessionmaker(engine, expire_on_commit=False)
+        self.tiers = flask_app.config.get('PRICING_TIERS', DEFAULT_TIERS)
+
+    def authenticate(self, token: str):
+        # utilities.authenticate in an app context, run in a worker thread
+        with self.flask_app.app_context():
+            return authenticate(token)
+
+    def routes(self):
+        return [
+            Route('/books', self.get_all_books, methods=['GET']),
+            Route('/book/{id}', self.get_book_by_id, methods=['GET']),
+            Route('/author/{author}', self.get_books_by_author, methods=['GET']),
+            Route('/publisher/{publisher}', self.get_books_by_publisher, methods=['GET']),
+            Route('/date/{date}', self.get_books_by_date, methods=['GET']),
+            Route('/rent/batch', self.rent_books, methods=['POST']),
+            Route('/rent/{book_id}', self.rent_book, methods=['POST']),
+            Route('/return/batch', self.return_books, methods=['PUT']),
+            Route('/return/{book_id}', self.return_book, methods=['PUT']),
+            Route('/rentals', self.get_rentals, methods=['GET']),
+            Route('/revenue', self.get_total_revenue, methods=['GET']),
+        ]
+
+    # Catalog
+
+    async def list_books(self, request, filters: dict):
+        try:
+            after, limit = get_page_args(request.query_params)
+        except ValueError as e:
+            return json_response(str(e), 400)
+
+        # Fetch one extra row to know if there is a next page
+        async with self.sessions() as session:
+            rows = (await session.execute(books_query(filters, after, limit + 1))).all()
+
+        data, next_isbn = books_page(rows, limit)
+        return json_response(data, next_cursor=encode_cursor(next_isbn) if next_isbn else None)
+
+    async def get_all_books(self, request):
+        return await self.list_books(request, AVAILABLE_BOOKS)
+
+    async def get_books_by_author(self, request):
+        return await self.list_books(request, {'author': request.path_params['author']})
+
+    async def get_books_by_publisher(self, request):
+        return await self.list_books(request, {'publisher': request.path_params['publisher']})
+
+    async def get_books_by_date(self, request):
+        return await self.list_books(request, {'year_of_publication': request.path_params['date']})
+
+    async def get_book_by_id(self, request):
+        async with self.sessions() as session:
+            result = await session.execute(select(*BOOK_FIELDS).where(Book.isbn == request.path_params['id']))
+            book = rows_to_dicts(result)
+
+        return json_response(book[0] if book else None)
+
+    # Rentals
+
+    @token_required
+    @idempotent
+    async def rent_book(self, user, request):
+        async with self.sessions() as session, session.begin():
+            book = (await session.execute(take_copies([request.path_params['book_id']]))).first()
+            if not book:
+                return json_response("Book not available for rent", 400)
+
+            await session.execute(insert(RentedHistory), new_rentals(user['id'], [book.isbn], date.today()))
+
+        response_cache.invalidate(*response_cache.book_tags(book))
+        return json_response("Book rented successfully", 200)
+
+    @token_required
+    @idempotent
+    async def rent_books(self, user, request):
+        try:
+            book_ids = get_batch(await request.json())
+        except ValueError:
+            book_ids = None
+        if book_ids is None or not all(isinstance(book_id, str) for book_id in book_ids):
+            return json_response(f"Please provide a list of at most {MAX_BATCH_SIZE} ISBNs as 'isbns'", 400)
+
+        async with self.sessions() as session, session.begin():
+            rented = (await session.execute(take_copies(list(dict.fromkeys(book_ids))))).all()
+            if rented:
+                await session.execute(insert(RentedHistory),
+                                      new_rentals(user['id'], [book.isbn for book in rented], date.today()))
+
+        response_cache.invalidate(*{tag for book in rented for tag in response_cache.book_tags(book)})
+
+        return json_response(batch_results(book_ids, {book.isbn for book in rented}))
+
+    @token_required
+    @idempotent
+    async def return_book(self, user, request):
+        if not user['isAdmin']:
+            return json_response(FORBIDDEN, 403)
+
+        book_id = request.path_params['book_id']
+        user_id = request.query_params.get('user')
+        if user_id is not None and not user_id.isdigit():
+            return json_response("Please provide a valid user", 400)
+
+        end_date = date.today()
+
+        async with self.sessions() as session, session.begin():
+            rental, book = await self.close_rental(session, book_id, int(user_id) if user_id else None, end_date)
+            if rental is None:
+                return json_response("Book not found or not currently rented", 400)
+
+            fee = rental_fee(rental.start_date, end_date, self.tiers)
+            await session.execute(update(RentedHistory).where(RentedHistory.id == rental.id).values(total_cost=fee))
+            await session.execute(daily_revenue_upsert(self.engine.dialect.name, end_date, fee))
+
+        if book:
+            response_cache.invalidate(*response_cache.book_tags(book))
+        return json_response(fee, 200)
+
+    @staticmethod
+    async def close_rental(session, book_id: str, user_id: int, end_date: date):
+        # The closed rental and the restocked book, like HistoryService.close_rental, or (None, None)
+        close, any_open = close_rental(book_id, user_id, end_date)
+
+        # A request losing the race for a rental tries the next open one
+        while True:
+            rental = (await session.execute(close)).first()
+            if rental is not None:
+                break
+            if not (await session.execute(any_open)).scalar():
+                return None, None
+
+        return rental, (await session.execute(restock(book_id))).first()
+
+    @token_required
+    @idempotent
+    async def return_books(self, user, request):
+        if not user['isAdmin']:
+            return json_response(FORBIDDEN, 403)
+
+        try:
+            items = get_return_batch(await request.json())
+        except ValueError:
+            items = None
+        if items is None:
+            return json_response(f"Please provide a list of at most {MAX_BATCH_SIZE} ISBNs as 'isbns'", 400)
+
+        end_date = date.today()
+        async with self.sessions() as session, session.begin():
+            closed = [await self.close_rental(session, item['isbn'], item.get('user'), end_date) for item in items]
+            rentals = [rental for rental, _ in closed if rental is not None]
+
+            # One fee computation and one rollup upsert for the whole batch
+            fees = batch_rental_fees([rental.start_date for rental in rentals], [end_date] * len(rentals),
+                                     self.tiers).tolist()
+            if rentals:
+                await session.execute(update(RentedHistory), [{'id': rental.id, 'total_cost': fee}
+                                                              for rental, fee in zip(rentals, fees)])
+                await session.execute(daily_revenue_upsert(self.engine.dialect.name, end_date, sum(fees),
+                                                           len(rentals)))
+
+        response_cache.invalidate(*{tag for _, book in closed if book for tag in response_cache.book_tags(book)})
+
+        fees = iter(fees)
+        return json_response([
+            {'isbn': item['isbn'], 'status': 'returned', 'fee': next(fees)} if rental is not None
+            else {'isbn': item['isbn'], 'status': 'error', 'message': "Book not found or not currently rented"}
+            for item, (rental, _) in zip(items, closed)
+        ])
+
+    # Reports
+
+    async def report_period(self, user, request):
+        # The validated (start, end) of a report, or the error response
+        valid_dates = is_date_args_valid(request.query_params)
+        if not valid_dates:
+            return None, json_response("Please provide valid dates", 400)
+
+        if not user['isAdmin']:
+            return None, json_response(FORBIDDEN, 403)
+
+        try:
+            return tuple(to_date(value) for value in valid_dates), None
+        except ValueError:
+            return None, json_response("Please provide valid dates", 400)
+
+    @token_required
+    async def get_rentals(self, user, request):
+        period, error = await self.report_period(user, request)
+        if error:
+            return error
+
+        async with self.sessions() as session:
+            data = rows_to_dicts(await session.execute(rentals_query(*period)))
+
+        return json_response(data)
+
+    @token_required
+    async def get_total_revenue(self, user, request):
+        period, error = await self.report_period(user, request)
+        if error:
+            return error
+
+        group_by = request.query_params.get('group_by')
+        if group_by and group_by not in REVENUE_GROUPS:
+            return json_response(f"group_by must be one of: {', '.join(REVENUE_GROUPS)}", 400)
+
+        async with self.sessions() as session:
+            if not group_by:
+                data = (await session.execute(total_revenue_query(*period))).scalar()
+            else:
+                query = revenue_breakdown_query(self.engine.dialect.name, *period, group_by)
+                data = revenue_breakdown(await session.execute(query), group_by)
+
+        return json_response(data)
+
+
+def create_asgi_app(config_path: str = None, overrides: dict = None):
+    """
+    Build the ASGI application.
+
+    Parameters:
+    - config_path (str): The path of config.ini (default is AppConfig's).
+    - overrides (dict): Settings overriding config.ini, as for create_app.
+
+    Returns:
+    - Starlette: The application.
+    """
+
+    flask_app = create_app(config_path, overrides)
+    url = async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+    pool_settings = flask_app.config['DATABASE_POOL']
+    engine = create_async_engine(url, **engine_options(url, pool_settings, is_async=True))
+    install_statement_timeout(engine.sync_engine, pool_settings)
+
+    bookstore = AsyncBookstore(flask_app, engine)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    app = Starlette(routes=bookstore.routes(), lifespan=lifespan)
+    app.state.bookstore = bookstore
+    return app
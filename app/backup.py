@@ -0,0 +1,306 @@
+"""
+Module Documentation: backup.py
+
+This module backs up and restores the bookstore tables.
+
+A backup reads every table inside one REPEATABLE READ, read-only transaction, so all files describe the same
+snapshot of the database. On PostgreSQL with psycopg2 the rows are streamed with COPY ... TO STDOUT, other
+databases (SQLite) stream them from a server-side cursor in the same CSV format. Files are compressed with gzip,
+zstd (requires the 'zstandard' package) or not at all.
+
+Every backup is a folder of '<table>.csv[.gz|.zst]' files with a manifest.json, written last. An incremental
+backup only contains the rows whose updated_at is at or after the watermark (the database time of the previous
+backup's snapshot) minus WATERMARK_OVERLAP; daily_revenue is small and always copied in full. Deleted rows are
+not tracked. Restoring upserts the last full backup and the incremental backups after it, in order.
+
+Functions:
+- snapshot: A connection reading one consistent snapshot of the database.
+- list_backups: The manifests of the backups in a folder, oldest first.
+- run_backup: Write a full or incremental backup.
+- restore_backup: Restore the latest backup chain of a folder.
+
+"""
+import csv
+import gzip
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, func, select, text
+
+from app.models import Book, DailyRevenue, RentedHistory, User
+
+BACKUP_DIR = 'backups'
+
+# Tables in foreign key order, restored in the same order
+BACKUP_TABLES = (User.__table__, Book.__table__, RentedHistory.__table__, DailyRevenue.__table__)
+
+COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+# NULL marker of the CSV files, an empty field is an empty string
+NULL = '\\N'
+
+# Rows written by transactions still open when the previous snapshot was taken carry an updated_at before
+# the watermark, incremental backups read them again (restoring a row twice is harmless)
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+# Rows read and upserted at a time when restoring
+RESTORE_CHUNK_SIZE = 5000
+
+MANIFEST = 'manifest.json'
+
+
+@contextmanager
+def snapshot(engine):
+    """
+    A connection reading one consistent snapshot of the database, rolled back at the end.
+
+    Parameters:
+    - engine: The (primary) engine.
+
+    Yields:
+    - Connection: The connection of the snapshot transaction.
+    """
+
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            connection = connection.execution_options(isolation_level='REPEATABLE READ', postgresql_readonly=True)
+            with connection.begin():
+                yield connection
+            return
+
+        # SQLite reads outside transactions by default, an explicit one holds a single snapshot
+        connection.exec_driver_sql('BEGIN')
+        try:
+            yield connection
+        finally:
+            connection.rollback()
+
+
+def open_file(path: str, mode: str, compression: str):
+    # Text file handle of a backup file ('wt' or 'rt')
+    if compression == 'gzip':
+        return gzip.open(path, mode, encoding='utf-8', newline='')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires the 'zstandard' package.")
+        return zstandard.open(path, mode, encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def _to_csv(value):
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return value
+
+
+def _from_csv(column, value: str):
+    # Convert a field back to the column type, the inverse of _to_csv and of PostgreSQL's COPY output
+    if value == NULL:
+        return None
+    if isinstance(column.type, Boolean):
+        return value in ('t', 'true', 'True', '1')
+    if isinstance(column.type, Integer):
+        return int(value)
+    if isinstance(column.type, Float):
+        return float(value)
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Date):
+        return date.fromisoformat(value)
+    return value
+
+
+def _dump_table(connection, query, path: str, compression: str):
+    # Stream the rows of a query to a CSV file, returns the number of rows
+    with open_file(path, 'wt', compression) as file:
+        if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+            cursor = connection.connection.cursor()
+            compiled = query.compile(dialect=connection.dialect)
+            statement = cursor.mogrify(str(compiled), compiled.params).decode()
+            cursor.copy_expert(f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER, NULL '{NULL}')", file)
+            return cursor.rowcount
+
+        result = connection.execution_options(yield_per=RESTORE_CHUNK_SIZE).execute(query)
+        writer = csv.writer(file)
+        writer.writerow(result.keys())
+        count = 0
+        for row in result:
+            writer.writerow([_to_csv(value) for value in row])
+            count += 1
+        return count
+
+
+def list_backups(directory: str = BACKUP_DIR):
+    """
+    The manifests of the complete backups in a folder, oldest first.
+
+    Parameters:
+    - directory (str): The backup folder.
+
+    Returns:
+    - list: The manifest dictionaries, with the folder of every backup as 'path'.
+    """
+
+    if not os.path.isdir(directory):
+        return []
+
+    manifests = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as file:
+                manifests.append(dict(json.load(file), path=os.path.join(directory, name)))
+    return manifests
+
+
+def run_backup(db, directory: str = BACKUP_DIR, incremental: bool = False, compression: str = 'gzip',
+               overlap: timedelta = WATERMARK_OVERLAP):
+    """
+    Write a backup of the bookstore tables.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+    - directory (str): The backup folder.
+    - incremental (bool): Only back up the rows changed since the previous backup. Without a previous backup
+      a full backup is written.
+    - compression (str): 'gzip', 'zstd' or 'none'.
+    - overlap (timedelta): How far before the previous watermark an incremental backup starts.
+
+    Returns:
+    - dict: The manifest: mode, watermark, and the rows, bytes and file of every table.
+
+    Raises:
+    - ValueError: If the compression is not supported.
+    """
+
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"compression must be one of: {', '.join(COMPRESSIONS)}")
+
+    previous = list_backups(directory)
+    since = None
+    if incremental and previous:
+        since = datetime.fromisoformat(previous[-1]['watermark']) - overlap
+
+    mode = 'incremental' if since else 'full'
+    folder = os.path.join(directory, f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{mode}")
+    os.makedirs(folder)
+
+    started = time.perf_counter()
+    tables = {}
+    with snapshot(db.engine) as connection:
+        # The database clock of the snapshot, updated_at uses the same clock
+        watermark = connection.execute(select(func.now())).scalar()
+
+        for table in BACKUP_TABLES:
+            query = select(table)
+            if since is not None and 'updated_at' in table.c:
+                query = query.where(table.c.updated_at >= since)
+
+            filename = f'{table.name}.csv{COMPRESSIONS[compression]}'
+            path = os.path.join(folder, filename)
+            rows = _dump_table(connection, query, path, compression)
+            tables[table.name] = {'file': filename, 'rows': rows, 'bytes': os.path.getsize(path)}
+
+    manifest = {
+        'mode': mode,
+        'since': since.isoformat() if since else None,
+        'watermark': watermark.isoformat(),
+        'compression': compression,
+        'tables': tables,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(folder, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+    logging.info(f"{mode.capitalize()} backup '{folder}' written in {manifest['seconds']}s: " +
+                 ', '.join(f"{name} {stats['rows']} rows / {stats['bytes']} bytes" for name, stats in tables.items()))
+    return dict(manifest, path=folder)
+
+
+def _upsert_statement(dialect_name: str, table):
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        raise ValueError(f"Restoring is not supported on {dialect_name}")
+
+    statement = dialect_insert(table)
+    keys = [column.name for column in table.primary_key]
+    return statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={column.name: statement.excluded[column.name] for column in table.columns if column.name not in keys},
+    )
+
+
+def _restore_table(connection, table, path: str, compression: str):
+    statement = _upsert_statement(connection.dialect.name, table)
+    count = 0
+    with open_file(path, 'rt', compression) as file:
+        reader = csv.DictReader(file)
+        while True:
+            rows = [{name: _from_csv(table.c[name], value) for name, value in row.items()}
+                    for row in islice(reader, RESTORE_CHUNK_SIZE)]
+            if not rows:
+                return count
+            connection.execute(statement, rows)
+            count += len(rows)
+
+
+def restore_backup(db, directory: str = BACKUP_DIR, until: str = None):
+    """
+    Restore the last full backup of a folder and the incremental backups after it, upserting every row.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+    - directory (str): The backup folder.
+    - until (str): The folder name of the last backup to apply (default is None for the latest one).
+
+    Returns:
+    - dict: The applied backups and the number of restored rows per table.
+
+    Raises:
+    - ValueError: If there is no full backup to start from.
+    """
+
+    backups = list_backups(directory)
+    if until is not None:
+        names = [os.path.basename(backup['path']) for backup in backups]
+        if until not in names:
+            raise ValueError(f"Backup not found: {until}")
+        backups = backups[:names.index(until) + 1]
+
+    fulls = [index for index, backup in enumerate(backups) if backup['mode'] == 'full']
+    if not fulls:
+        raise ValueError(f"No full backup in '{directory}'")
+    chain = backups[fulls[-1]:]
+
+    started = time.perf_counter()
+    restored = {table.name: 0 for table in BACKUP_TABLES}
+    with db.engine.begin() as connection:
+        for backup in chain:
+            for table in BACKUP_TABLES:
+                stats = backup['tables'][table.name]
+                path = os.path.join(backup['path'], stats['file'])
+                restored[table.name] += _restore_table(connection, table, path, backup['compression'])
+
+        if connection.dialect.name == 'postgresql':
+            # Ids were restored explicitly, move the sequences past them
+            for table in (User.__table__, RentedHistory.__table__):
+                connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                                        f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"))
+
+    seconds = time.perf_counter() - started
+    logging.info(f"Restored {len(chain)} backups in {seconds:.2f}s: " +
+                 ', '.join(f'{name} {rows} rows' for name, rows in restored.items()))
+    return {'backups': [os.path.basename(backup['path']) for backup in chain], 'rows': restored,
+            'seconds': round(seconds, 3)}
@@ -0,0 +1,149 @@
+"""
+Module Documentation: commands.py
+
+This module defines Flask CLI commands for maintaining the Bookstore database outside the app startup.
+
+Commands:
+- import-books: Bulk load a catalog CSV file into the books table.
+- init-db: Create the database tables.
+- seed-db: Create the database tables and import the sample data once.
+- migrate-db: Upgrade an existing database (typed history dates, book copies, missing indexes, revenue rollup).
+- rebuild-revenue: Recompute the daily revenue rollup from the rental history.
+- backup-db: Write a full or incremental backup of the tables.
+- restore-db: Restore the latest backup chain.
+- generate-data: Generate a synthetic catalog, users and rental history, into the database or CSV files.
+
+"""
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app.models import db, User
+from app.loader import bulk_load_books, DEFAULT_CHUNK_SIZE
+from app.utilities import seed_database
+from app.migrations import migrate_database, rebuild_daily_revenue
+from app.backup import COMPRESSIONS, restore_backup, run_backup
+from app.fees import DEFAULT_TIERS
+from app.synthetic import load_dataset, write_dataset
+
+
+@click.command('import-books')
+@click.option('--path', default='./data/Books.csv', show_default=True, help='Catalog CSV file to import.')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Rows per batch.')
+@click.option('--copy/--no-copy', 'use_copy', default=None, help='Force or disable PostgreSQL COPY.')
+@with_appcontext
+def import_books_command(path, chunk_size, use_copy):
+    """Bulk load a catalog CSV file into the books table, upserting on ISBN."""
+
+    def progress(stats):
+        click.echo(f"{stats['rows']} books imported - {stats['rows_per_second']:.0f} rows/s")
+
+    stats = bulk_load_books(db, path, chunk_size, progress=progress, use_copy=use_copy)
+    click.echo(f"Done: {stats['rows']} books in {stats['seconds']:.2f}s")
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database tables."""
+    db.create_all()
+    click.echo('Database tables created')
+
+
+@click.command('seed-db')
+@with_appcontext
+def seed_db_command():
+    """Create the database tables and import the sample data, unless already seeded."""
+    if seed_database(db):
+        click.echo('Database seeded')
+    else:
+        click.echo('Database already seeded')
+
+
+@click.command('migrate-db')
+@with_appcontext
+def migrate_db_command():
+    """Upgrade an existing database to the current models."""
+    changes = migrate_database(db)
+    click.echo(f"History dates migrated: {changes['history_dates']}")
+    click.echo(f"Book copies columns added: {changes['book_copies']}")
+    click.echo(f"updated_at added to: {', '.join(changes['updated_at']) or 'none'}")
+    click.echo(f"Indexes created: {', '.join(changes['indexes']) or 'none'}")
+    click.echo(f"Revenue rollup days backfilled: {changes['daily_revenue']}")
+
+
+@click.command('rebuild-revenue')
+@with_appcontext
+def rebuild_revenue_command():
+    """Recompute the daily revenue rollup from the rental history."""
+    days = rebuild_daily_revenue(db)
+    click.echo(f"Revenue rollup rebuilt: {days} days")
+
+
+@click.command('backup-db')
+@click.option('--dir', 'directory', default=None, help='Backup folder (default is the [Backup] setting).')
+@click.option('--incremental/--full', default=False, show_default=True,
+              help='Only back up the rows changed since the previous backup.')
+@click.option('--compression', type=click.Choice(list(COMPRESSIONS)), default=None,
+              help='Compression of the files (default is the [Backup] setting).')
+@with_appcontext
+def backup_db_command(directory, incremental, compression):
+    """Back up the tables from one consistent snapshot."""
+    manifest = run_backup(db, directory or current_app.config['BACKUP_DIR'], incremental,
+                          compression or current_app.config['BACKUP_COMPRESSION'])
+    for name, stats in manifest['tables'].items():
+        click.echo(f"{name}: {stats['rows']} rows, {stats['bytes']} bytes")
+    click.echo(f"{manifest['mode'].capitalize()} backup written to {manifest['path']} in {manifest['seconds']}s")
+
+
+@click.command('restore-db')
+@click.option('--dir', 'directory', default=None, help='Backup folder (default is the [Backup] setting).')
+@click.option('--until', default=None, help='Name of the last backup to apply (default is the latest one).')
+@with_appcontext
+def restore_db_command(directory, until):
+    """Restore the last full backup and the incremental backups after it."""
+    db.create_all()
+    result = restore_backup(db, directory or current_app.config['BACKUP_DIR'], until)
+    click.echo(f"Applied: {', '.join(result['backups'])}")
+    for name, rows in result['rows'].items():
+        click.echo(f"{name}: {rows} rows restored")
+
+
+@click.command('generate-data')
+@click.option('--books', default=100000, show_default=True, help='Number of books.')
+@click.option('--users', default=10000, show_default=True, help='Number of users.')
+@click.option('--rentals', default=1000000, show_default=True, help='Number of rentals.')
+@click.option('--seed', default=0, show_default=True, help='Seed of the generators.')
+@click.option('--csv', 'directory', default=None, help='Write CSV files to this folder instead of the database.')
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Rows per batch.')
+@with_appcontext
+def generate_data_command(books, users, rentals, seed, directory, chunk_size):
+    """Generate a synthetic catalog, users and rental history with Zipfian popularity."""
+    # Fees of the generated rentals with the configured pricing, like the returns of the app
+    tiers = current_app.config.get('PRICING_TIERS', DEFAULT_TIERS)
+    if directory:
+        for name, written in write_dataset(directory, books, users, rentals, seed, tiers).items():
+            click.echo(f"{name}: {written['rows']} rows written to {written['path']}")
+        return
+
+    db.create_all()
+    if db.session.query(User.id).first() is not None:
+        raise click.ClickException('The database already has users: generate into an empty database.')
+
+    def progress(stats):
+        click.echo(f"{stats['rows']} books loaded - {stats['rows_per_second']:.0f} rows/s")
+
+    loaded = load_dataset(db, books, users, rentals, seed, chunk_size, progress=progress, tiers=tiers)
+    click.echo(f"Done: {loaded['books']} books, {loaded['users']} users, {loaded['rentals']} rentals, "
+               f"{loaded['revenue_days']} revenue days")
+
+
+def register_commands(app):
+    app.cli.add_command(import_books_command)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(rebuild_revenue_command)
+    app.cli.add_command(backup_db_command)
+    app.cli.add_command(restore_db_command)
+    app.cli.add_command(generate_data_command)
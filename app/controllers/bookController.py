@@ -1,26 +1,133 @@
-from app.models import Book, RentedHistory
-from app.utilities import to_dict, send_response
-from datetime import datetime
+from app.models import db, Book, RentedHistory
+from app.utilities import send_response, DEFAULT_PAGE_SIZE
+from app.serialization import rows_to_dicts, stream_dicts
+from app.response_cache import response_cache
+from datetime import date
+from sqlalchemy import insert, select, true, update
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 
+# Columns exposed by the API - same as to_dict(book)
+BOOK_FIELDS = [column for column in Book.__table__.columns if column.key not in ('rented_now', 'updated_at')]
+
+# Filter of the available books listing. A literal true, unlike a bound parameter, always matches the WHERE of the
+# partial ix_books_available_isbn index
+AVAILABLE_BOOKS = {'isAvailable': true()}
+
+# Rows fetched per round trip from the server-side cursor when streaming
+STREAM_BATCH_SIZE = 1000
+
+# Book columns the response cache tags are built from (see response_cache.book_tags)
+BOOK_TAG_FIELDS = (Book.isbn, Book.author, Book.publisher, Book.year_of_publication)
+
+
+# Statements shared by the sync services below and the async app (app/asgi.py)
+
+def books_query(filters: dict, after: str = None, limit: int = None):
+    """
+    Build the query of the books matching the filters, ordered by ISBN (keyset pagination).
+
+    Parameters:
+    - filters (dict): Column values to filter on, e.g. {'author': 'Amy Tan'}.
+    - after (str): Only books with an ISBN greater than this one are returned (default is None).
+    - limit (int): The maximum number of books (default is None for all of them).
+
+    Returns:
+    - Select: The query, projecting BOOK_FIELDS.
+    """
+
+    query = select(*BOOK_FIELDS).filter_by(**filters).order_by(Book.isbn)
+    if after:
+        query = query.where(Book.isbn > after)
+    if limit:
+        query = query.limit(limit)
+    return query
+
+
+def books_page(rows: list, limit: int):
+    # Split the limit + 1 rows of a page query into the page and the ISBN to continue after
+    next_isbn = rows[limit - 1].isbn if len(rows) > limit else None
+    return rows_to_dicts(rows[:limit]), next_isbn
+
+
+def take_copies(book_ids: list):
+    """
+    Build the statement taking one available copy of each book, in a single conditional decrement,
+    so concurrent requests never rent more copies than there are.
+
+    Parameters:
+    - book_ids (list): The unique identifiers of the books.
+
+    Returns:
+    - Update: The statement, returning BOOK_TAG_FIELDS of every book a copy was taken of.
+    """
+
+    return (update(Book)
+            .where(Book.isbn.in_(book_ids), Book.available_copies > 0)
+            .values(available_copies=Book.available_copies - 1, isAvailable=Book.available_copies > 1)
+            .returning(*BOOK_TAG_FIELDS))
+
+
+def batch_results(book_ids: list, rented_ids: set):
+    # One result per book of a batch rent, in order
+    results = []
+    seen = set()
+    for book_id in book_ids:
+        if book_id in seen:
+            results.append({'isbn': book_id, 'status': 'error', 'message': "Book is already in the batch"})
+        elif book_id in rented_ids:
+            results.append({'isbn': book_id, 'status': 'rented'})
+        else:
+            results.append({'isbn': book_id, 'status': 'error', 'message': "Book not available for rent"})
+        seen.add(book_id)
+    return results
+
+
+def new_rentals(user_id: int, book_ids: list, start_date: date):
+    # Rows of the history table for rentals starting today
+    return [{'total_cost': 0, 'start_date': start_date, 'end_date': None, 'isbn': book_id, 'user': user_id}
+            for book_id in book_ids]
+
 
 class BookService:
 
-    def get_all_books(self):
+    def get_books_page(self, filters: dict, after: str = None, limit: int = DEFAULT_PAGE_SIZE):
         """
-        Retrieve information about all available books.
+        Retrieve one page of books matching the filters, ordered by ISBN (keyset pagination).
+
+        Parameters:
+        - filters (dict): Column values to filter on, e.g. {'author': 'Amy Tan'}.
+        - after (str): The ISBN of the last book of the previous page (default is None for the first page).
+        - limit (int): The maximum number of books on the page.
 
         Returns:
-        - list: A list of dictionaries containing information about available books.
+        - tuple: A list of book dictionaries and the ISBN to continue after, or None on the last page.
+        """
+
+        # Fetch one extra row to know if there is a next page
+        rows = db.session.execute(books_query(filters, after, limit + 1)).all()
+        return books_page(rows, limit)
 
+    def stream_books(self, filters: dict, after: str = None, limit: int = None):
         """
-        try:
-            data = Book.query.filter_by(isAvailable=True).all()
-            data = [to_dict(book) for book in data]
-            return data
-        except SQLAlchemyError as e:
-            logging.warning(f"Error querying the database: {e}")
+        Stream books matching the filters, ordered by ISBN, from a server-side cursor.
+
+        Rows are fetched in batches of STREAM_BATCH_SIZE as plain column rows, so memory usage
+        does not grow with the size of the result.
+
+        Parameters:
+        - filters (dict): Column values to filter on, e.g. {'author': 'Amy Tan'}.
+        - after (str): Only books with an ISBN greater than this one are returned (default is None).
+        - limit (int): The maximum number of books (default is None for all of them).
+
+        Yields:
+        - dict: Information about a single book.
+        """
+
+        query = books_query(filters, after, limit)
+
+        result = db.session.execute(query.execution_options(yield_per=STREAM_BATCH_SIZE))
+        yield from stream_dicts(result)
 
     def get_book_by_identifier(self, identifier: str, value):
         """
@@ -35,13 +142,13 @@ class BookService:
           or a list of dictionaries containing information about multiple books if identifier is another attribute.
         """
 
+        # Plain column rows, no ORM instances are built
         if identifier.lower() == 'isbn':
-            book = Book.query.get(value)
-            data = to_dict(book) if book else None
-        else:
-            data = Book.query.filter_by(**{identifier: value}).all()
-            data = [to_dict(book) for book in data] if data else None
-        return data
+            data = rows_to_dicts(db.session.execute(select(*BOOK_FIELDS).where(Book.isbn == value)))
+            return data[0] if data else None
+
+        data = rows_to_dicts(db.session.execute(select(*BOOK_FIELDS).filter_by(**{identifier: value})))
+        return data or None
 
     def rent_book(self, db, user_id, book_id: str):
 
@@ -59,27 +166,101 @@ class BookService:
 
         try:
 
-            book = Book.query.get(book_id)
+            # Take a copy with a single conditional decrement, so concurrent requests never rent more copies
+            # than there are
+            book = db.session.execute(take_copies([book_id])).first()
 
             # Check if book exists and if it is available for rent
-            if not book or not book.isAvailable:
+            if not book:
+                db.session.rollback()
                 return send_response("Book not available for rent", 400)
 
-            book.isAvailable = False
-
-            # Create new timestamp
-            date = datetime.now()
-
-            # Format as "YYYY-MM-DD"
-            formatted_date = date.strftime('%Y-%m-%d')
-
-            # Create new instance on History table
-            new_rented_book = RentedHistory(0, formatted_date, None, book.isbn, user_id)
+            # Create new instance on History table, rented from today
+            new_rented_book = RentedHistory(0, date.today(), None, book.isbn, user_id)
 
             # Add the instance to the session
             db.session.add(new_rented_book)
+            stale_tags = response_cache.book_tags(book)
             db.session.commit()
 
+            # Cached lookups showing this book are stale now
+            response_cache.invalidate(*stale_tags)
+
             return send_response("Book rented successfully", 200)
         except SQLAlchemyError as e:
             logging.warning(f"Error querying the database: {e}")
+            db.session.rollback()
+            return send_response("Could not rent the book, please try again", 500)
+
+    def rent_books(self, db, user_id, book_ids: list):
+
+        """
+        Rent many books for a user in one transaction.
+
+        Every available book gets one copy taken with a single UPDATE and the rentals are written with
+        one bulk INSERT into history.
+
+        Parameters:
+        - db: The database session to interact with.
+        - user_id (int): The unique identifier of the user renting the books.
+        - book_ids (list): The unique identifiers of the books to be rented.
+
+        Returns:
+        - dict: A response with one result per book, in order.
+        """
+
+        unique_ids = list(dict.fromkeys(book_ids))
+
+        try:
+            rented = db.session.execute(take_copies(unique_ids)).all()
+
+            # One bulk INSERT for the rentals of the batch
+            if rented:
+                db.session.execute(insert(RentedHistory),
+                                   new_rentals(user_id, [book.isbn for book in rented], date.today()))
+
+            stale_tags = {tag for book in rented for tag in response_cache.book_tags(book)}
+            db.session.commit()
+            response_cache.invalidate(*stale_tags)
+        except SQLAlchemyError as e:
+            logging.warning(f"Error querying the database: {e}")
+            db.session.rollback()
+            return send_response("Could not rent the books, please try again", 500)
+
+        return send_response(batch_results(book_ids, {book.isbn for book in rented}))
+
+    def set_copies(self, db, book_id: str, copies: int):
+
+        """
+        Change the number of copies of a book in stock.
+
+        Parameters:
+        - db: The database session to interact with.
+        - book_id (str): The unique identifier of the book.
+        - copies (int): The new number of copies, at least the number of copies rented out.
+
+        Returns:
+        - dict: A response message indicating the result.
+        """
+
+        if copies < 0:
+            return send_response("The number of copies can not be negative", 400)
+
+        # Copies rented out stay rented out, only the available ones change
+        rented_out = Book.copies - Book.available_copies
+        book = db.session.execute(
+            update(Book)
+            .where(Book.isbn == book_id, rented_out <= copies)
+            .values(copies=copies, available_copies=copies - rented_out, isAvailable=copies - rented_out > 0)
+            .returning(*BOOK_TAG_FIELDS, Book.copies, Book.available_copies)
+        ).first()
+
+        if not book:
+            db.session.rollback()
+            return send_response("Book not found or more copies are rented out", 400)
+
+        stale_tags = response_cache.book_tags(book)
+        db.session.commit()
+        response_cache.invalidate(*stale_tags)
+
+        return send_response({'isbn': book.isbn, 'copies': book.copies, 'available_copies': book.available_copies})
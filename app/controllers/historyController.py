@@ -1,83 +1,338 @@
-from app.models import RentedHistory
-from app.utilities import to_dict, send_response
-import pandas as pd
-from datetime import datetime
-from sqlalchemy import or_
+from app.models import db, Book, DailyRevenue, RentedHistory
+from app.utilities import send_response, to_date
+from app.controllers.bookController import BOOK_FIELDS, BOOK_TAG_FIELDS, STREAM_BATCH_SIZE
+from app.fees import DEFAULT_TIERS, rental_fee, batch_rental_fees
+from app.response_cache import response_cache
+from app.replica import read_replica
+from app.serialization import rows_to_dicts, stream_dicts
+from datetime import date
+from flask import current_app, has_app_context
+from sqlalchemy import Date, cast, func, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+import logging
+
+# Breakdowns of /revenue. Every group counts the fees of the rentals returned in the period: time buckets are
+# read from the daily_revenue rollup, author and publisher group the returned rentals.
+REVENUE_GROUPS = ('day', 'week', 'month', 'author', 'publisher')
+
+# Columns of the /rentals CSV export
+RENTAL_FIELDS = [field.key for field in BOOK_FIELDS]
+
+# Columns of the Parquet and Arrow exports of /rentals, partitioned by the start date of the rentals
+DATED_RENTAL_COLUMNS = [*BOOK_FIELDS, RentedHistory.start_date]
+
+
+def rented_in_period(start, end):
+    """
+    Build the filter conditions matching rentals started within a period and not returned after it.
+
+    Parameters:
+    - start (str or date): The start date of the period, strings in the format '%Y-%m-%d'.
+    - end (str or date): The end date of the period, strings in the format '%Y-%m-%d'.
+
+    Returns:
+    - tuple: SQLAlchemy filter conditions on RentedHistory.
+    """
+
+    start, end = to_date(start), to_date(end)
+
+    return (
+        RentedHistory.start_date >= start,
+        RentedHistory.start_date <= end,
+        or_(
+            RentedHistory.end_date <= end,
+            RentedHistory.end_date.is_(None),
+        ),
+    )
+
+
+
+def close_rental(book_id: str, user_id: int = None, end_date: date = None):
+    """
+    Build the statements closing an open rental of a book.
+
+    The rental is closed with a conditional update, so concurrent requests never close the same rental twice.
+    When the update closes nothing while an open rental still exists, a concurrent request won the race and
+    the update should be run again for the next open rental.
+
+    Parameters:
+    - book_id (str): The unique identifier of the book.
+    - user_id (int): The user returning the book (default is None for the longest open rental of the book).
+    - end_date (date): The return day.
+
+    Returns:
+    - tuple: The update, returning the id and start_date of the closed rental, and a query telling
+      if an open rental is left.
+    """
+
+    open_rentals = select(RentedHistory.id).where(RentedHistory.isbn == book_id, RentedHistory.end_date.is_(None))
+    if user_id is not None:
+        open_rentals = open_rentals.where(RentedHistory.user == user_id)
+
+    close = (update(RentedHistory)
+             .where(RentedHistory.id == open_rentals.order_by(RentedHistory.id).limit(1).scalar_subquery(),
+                    RentedHistory.end_date.is_(None))
+             .values(end_date=end_date)
+             .returning(RentedHistory.id, RentedHistory.start_date))
+    return close, select(open_rentals.exists())
+
+
+def restock(book_id: str):
+    # Put a returned copy back in stock
+    return (update(Book)
+            .where(Book.isbn == book_id, Book.available_copies < Book.copies)
+            .values(available_copies=Book.available_copies + 1, isAvailable=True)
+            .returning(*BOOK_TAG_FIELDS))
+
+
+def rentals_query(start, end, dated: bool = False):
+    # One joined query projecting the book columns - one row per rental started in the period.
+    # Dated rows add the start date of the rental and are ordered by it, for the partitioned exports.
+    if dated:
+        return (select(*DATED_RENTAL_COLUMNS)
+                .join(RentedHistory, RentedHistory.isbn == Book.isbn)
+                .where(*rented_in_period(start, end))
+                .order_by(RentedHistory.start_date, RentedHistory.id))
+
+    return (select(*BOOK_FIELDS)
+            .join(RentedHistory, RentedHistory.isbn == Book.isbn)
+            .where(*rented_in_period(start, end))
+            .order_by(RentedHistory.id))
+
+
+def returned_in_period(start, end):
+    # Conditions matching the rentals returned within a period, the ones the daily_revenue rollup counts
+    return (RentedHistory.end_date >= to_date(start), RentedHistory.end_date <= to_date(end))
+
+
+def total_revenue_query(start, end):
+    # Fees of the rentals returned in the period, from the daily_revenue rollup like the time buckets
+    return (select(func.coalesce(func.sum(DailyRevenue.revenue), 0))
+            .where(DailyRevenue.day >= to_date(start), DailyRevenue.day <= to_date(end)))
+
+
+def daily_revenue_upsert(dialect_name: str, day: date, fee: float, rentals: int = 1):
+    """
+    Build the statement adding fees to the daily_revenue rollup of a day.
+
+    Parameters:
+    - dialect_name (str): The name of the database dialect.
+    - day (date): The return day of the rentals.
+    - fee (float): The sum of the rental fees.
+    - rentals (int): The number of rentals (default is 1).
+
+    Returns:
+    - Insert or None: An INSERT ... ON CONFLICT DO UPDATE, or None for databases without upserts.
+    """
+
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+
+    statement = dialect_insert(DailyRevenue).values(day=day, revenue=fee, rentals=rentals)
+    return statement.on_conflict_do_update(
+        index_elements=[DailyRevenue.day],
+        set_={'revenue': DailyRevenue.revenue + statement.excluded.revenue,
+              'rentals': DailyRevenue.rentals + statement.excluded.rentals},
+    )
+
+
+def date_bucket(dialect_name: str, column, unit: str):
+    # First day of the day/week/month bucket of a date column
+    if unit == 'day':
+        return column
+    if dialect_name == 'postgresql':
+        return cast(func.date_trunc(unit, column), Date)
+    if unit == 'week':
+        return func.date(column, 'weekday 0', '-6 days')
+    return func.date(column, 'start of month')
+
+
+def revenue_breakdown_query(dialect_name: str, start, end, group_by: str):
+    # Revenue of a period by group, see HistoryService.calculate_revenue_breakdown
+    if group_by in ('author', 'publisher'):
+        key = getattr(Book, group_by)
+        return (select(key.label('key'),
+                       func.coalesce(func.sum(RentedHistory.total_cost), 0).label('revenue'),
+                       func.count(RentedHistory.id).label('rentals'))
+                .join(RentedHistory, RentedHistory.isbn == Book.isbn)
+                .where(*returned_in_period(start, end))
+                .group_by(key)
+                .order_by(key))
+
+    key = date_bucket(dialect_name, DailyRevenue.day, group_by).label('key')
+    return (select(key,
+                   func.sum(DailyRevenue.revenue).label('revenue'),
+                   func.sum(DailyRevenue.rentals).label('rentals'))
+            .where(DailyRevenue.day >= to_date(start), DailyRevenue.day <= to_date(end))
+            .group_by(key)
+            .order_by(key))
+
+
+def revenue_breakdown(rows, group_by: str):
+    # Dictionaries of the rows of revenue_breakdown_query, dates as 'YYYY-MM-DD'
+    return [{group_by: str(row.key)[:10] if group_by in ('day', 'week', 'month') else row.key,
+             'revenue': row.revenue,
+             'rentals': row.rentals}
+            for row in rows]
 
 
 class HistoryService:
 
-    def calculate_rental_fee(self, start: str, end: str):
+    def pricing_tiers(self):
+        # Pricing table configured on the app ([Pricing] section of config.ini)
+        if has_app_context():
+            return current_app.config.get('PRICING_TIERS', DEFAULT_TIERS)
+        return DEFAULT_TIERS
+
+    def calculate_rental_fee(self, start, end):
 
         """
         Calculate the rental fee based on the given start and end dates.
 
         Parameters:
-        - start (str): The start date of the rental in the format '%Y-%m-%d'.
-        - end (str): The end date of the rental in the format '%Y-%m-%d'.
+        - start (str or date): The start date of the rental, strings in the format '%Y-%m-%d'.
+        - end (str or date): The end date of the rental, strings in the format '%Y-%m-%d'.
 
         Returns:
         - float: The calculated rental fee.
         """
 
-        dt0 = pd.to_datetime(start, format='%Y-%m-%d')
-        dt1 = pd.to_datetime(end, format='%Y-%m-%d')
-        days = (dt1 - dt0).days
+        return rental_fee(start, end, self.pricing_tiers())
 
-        if days <= 3:
-            return days * 1
-        return 3 * 1 + (days - 3) * 0.5
+    def calculate_rental_fees(self, starts, ends):
 
-    def return_book(self, db, book_id: str):
         """
-        Return a rented book and update related records in the database.
+        Calculate the rental fees of many rentals at once.
+
+        Parameters:
+        - starts (sequence): The start dates of the rentals (dates or strings in the format '%Y-%m-%d').
+        - ends (sequence): The end dates of the rentals, in the same order.
+
+        Returns:
+        - list: The calculated rental fees, one per rental.
+        """
+
+        return batch_rental_fees(starts, ends, self.pricing_tiers()).tolist()
+
+    def close_rental(self, db, book_id: str, user_id: int = None, end_date: date = None):
+        """
+        Close an open rental of a book and put the copy back in stock, without committing.
 
         Parameters:
         - db: The database session to interact with.
         - book_id (str): The unique identifier of the book to be returned.
+        - user_id (int): The user returning the book (default is None for the longest open rental of the book).
+        - end_date (date): The return day (default is None for today).
 
         Returns:
-        - dict: A response message indicating the result of the book return process.
+        - RentedHistory or None: The closed rental, or None if the book is not rented.
+        """
+
+        close, any_open = close_rental(book_id, user_id, end_date or date.today())
 
+        # A request losing the race for a rental tries the next open one
+        while True:
+            rental = db.session.execute(close).first()
+            if rental is not None:
+                break
+            if not db.session.execute(any_open).scalar():
+                return None
+
+        db.session.execute(restock(book_id))
+
+        return db.session.get(RentedHistory, rental.id)
+
+    def return_book(self, db, book_id: str, user_id: int = None):
         """
+        Return a rented copy of a book and update related records in the database.
 
-        # 1. Find book on history table based on isbn and user-id
-        rentedBook = RentedHistory.query.filter(
-            RentedHistory.isbn == book_id,
-            RentedHistory.end_date.is_(None),
-        ).first()
+        Parameters:
+        - db: The database session to interact with.
+        - book_id (str): The unique identifier of the book to be returned.
+        - user_id (int): The user returning the book (default is None for the longest open rental of the book).
 
-        if not rentedBook:
-            return send_response("Book not found or not currently rented", 400)
+        Returns:
+        - dict: A response message indicating the result of the book return process.
 
-        # 2. Change Availability on Book table to True using foreign key
-        book = rentedBook.book
-        book.isAvailable = True
+        """
 
-        # 3. Update end_date for current book
-        date = datetime.now()
-        end_date = date.strftime('%Y-%m-%d')
+        # 1. Close an open rental of the book and put the copy back in stock
+        rentedBook = self.close_rental(db, book_id, user_id)
 
-        rentedBook.end_date = end_date
+        if rentedBook is None:
+            db.session.rollback()
+            return send_response("Book not found or not currently rented", 400)
 
-        # 4. Calculate rental fee based on rented days
-        rental_fee = self.calculate_rental_fee(rentedBook.start_date, end_date)
+        # 2. Calculate rental fee based on rented days
+        rental_fee = self.calculate_rental_fee(rentedBook.start_date, rentedBook.end_date)
 
-        # 5. Update total_cost on the instance
+        # 3. Update total_cost on the instance
         rentedBook.total_cost = rental_fee
 
+        # 4. Add the fee to the revenue rollup of the day, in the same transaction
+        self.add_to_daily_revenue(db, rentedBook.end_date, rental_fee)
+
+        stale_tags = response_cache.book_tags(rentedBook.book)
         db.session.commit()
 
+        # Cached lookups showing this book are stale now
+        response_cache.invalidate(*stale_tags)
+
         return send_response(rental_fee, 200)
 
-    def get_all_rented_books_for_period(self, start: str, end: str, return_type: str):
+    def return_books(self, db, items: list):
+        """
+        Return many rented books in one transaction.
+
+        Parameters:
+        - db: The database session to interact with.
+        - items (list): The books to return, as {'isbn': str, 'user': int or None} dictionaries.
+
+        Returns:
+        - dict: A response with one result per item, in order: the rental fee, or an error message.
+        """
+
+        end_date = date.today()
+
+        try:
+            rentals = [self.close_rental(db, item['isbn'], item.get('user'), end_date) for item in items]
+            closed = [rental for rental in rentals if rental is not None]
+
+            # One fee computation for the whole batch
+            fees = self.calculate_rental_fees([rental.start_date for rental in closed], [end_date] * len(closed))
+            for rental, fee in zip(closed, fees):
+                rental.total_cost = fee
+
+            if closed:
+                self.add_to_daily_revenue(db, end_date, sum(fees), len(closed))
+
+            stale_tags = {tag for rental in closed for tag in response_cache.book_tags(rental.book)}
+            db.session.commit()
+            response_cache.invalidate(*stale_tags)
+        except SQLAlchemyError as e:
+            logging.warning(f"Error querying the database: {e}")
+            db.session.rollback()
+            return send_response("Could not return the books, please try again", 500)
+
+        return send_response([
+            {'isbn': item['isbn'], 'status': 'returned', 'fee': rental.total_cost} if rental is not None
+            else {'isbn': item['isbn'], 'status': 'error', 'message': "Book not found or not currently rented"}
+            for item, rental in zip(items, rentals)
+        ])
+
+    @read_replica.reads
+    def get_all_rented_books_for_period(self, start, end, return_type: str):
 
         """
         Retrieve all rented books within a specified period.
 
         Parameters:
-        - start (str): The start date of the period in the format '%Y-%m-%d'.
-        - end (str): The end date of the period in the format '%Y-%m-%d'.
+        - start (str or date): The start date of the period, strings in the format '%Y-%m-%d'.
+        - end (str or date): The end date of the period, strings in the format '%Y-%m-%d'.
         - return_type (str): The desired return type, either "list" or the default SQLAlchemy query result.
 
         Returns:
@@ -86,40 +341,94 @@ class HistoryService:
 
         """
 
-        rented_books = RentedHistory.query.filter(
-            RentedHistory.start_date >= start,
-            RentedHistory.start_date <= end,
-            or_(
-                RentedHistory.end_date <= end,
-                RentedHistory.end_date.is_(None),
-            ),
-        ).all()
-
         if return_type.lower() == "list":
-            data = []
-            for instance in rented_books:
-                book = instance.book
-                data.append(to_dict(book))
-            return data
-        return rented_books
+            return rows_to_dicts(db.session.execute(rentals_query(start, end)))
+
+        return RentedHistory.query.filter(*rented_in_period(start, end)).all()
+
+    @read_replica.reads
+    def stream_rented_books(self, start, end, dated: bool = False):
+
+        """
+        Stream the rented books of a period from a server-side cursor, in batches of STREAM_BATCH_SIZE rows.
+
+        Parameters:
+        - start (str or date): The start date of the period, strings in the format '%Y-%m-%d'.
+        - end (str or date): The end date of the period, strings in the format '%Y-%m-%d'.
+        - dated (bool): Add the start date of every rental and order the rows by it (default is False).
+
+        Yields:
+        - dict: Information about the book of a single rental.
+
+        """
+
+        result = db.session.execute(rentals_query(start, end, dated).execution_options(yield_per=STREAM_BATCH_SIZE))
+        yield from stream_dicts(result)
+
+    @read_replica.reads
+    def calculate_total_rental_fee(self, start_date, end_date):
 
-    def calculate_total_rental_fee(self, start_date: str, end_date: str):
+        """
+        Calculate the total rental fee of the books returned within a specific period, from the daily_revenue
+        rollup (fees count on their return day, like the breakdowns of calculate_revenue_breakdown).
+
+        Parameters:
+        - start_date (str or date): The start date of the period, strings in the format '%Y-%m-%d'.
+        - end_date (str or date): The end date of the period, strings in the format '%Y-%m-%d'.
+
+        Returns:
+        - float: The total rental fee of the books returned within the specified period.
+
+        """
+
+        return db.session.execute(total_revenue_query(start_date, end_date)).scalar()
+
+    def add_to_daily_revenue(self, db, day: date, fee: float, rentals: int = 1):
+        """
+        Add the fees of closed rentals to the daily_revenue rollup of their return day.
 
+        Parameters:
+        - db: The database session to interact with.
+        - day (date): The return day of the rentals.
+        - fee (float): The sum of the rental fees.
+        - rentals (int): The number of rentals (default is 1).
         """
-        Calculate the total rental fee for all books rented within a specific period.
+
+        statement = daily_revenue_upsert(db.session.get_bind().dialect.name, day, fee, rentals)
+        if statement is None:
+            rollup = db.session.get(DailyRevenue, day) or DailyRevenue(day, 0, 0)
+            rollup.revenue += fee
+            rollup.rentals += rentals
+            db.session.add(rollup)
+            return
+
+        db.session.execute(statement)
+
+    @read_replica.reads
+    def calculate_revenue_breakdown(self, start_date, end_date, group_by: str):
+
+        """
+        Calculate the revenue of a period grouped by day, week, month, author or publisher.
+
+        Time buckets come from the daily_revenue rollup, so they count the fees by return day and
+        the cost of a report depends on the number of days, not on the number of rentals.
+        Author and publisher breakdowns group the rentals returned in the period, so every breakdown
+        adds up to calculate_total_rental_fee.
 
         Parameters:
-        - start_date (str): The start date of the period in the format '%Y-%m-%d'.
-        - end_date (str): The end date of the period in the format '%Y-%m-%d'.
+        - start_date (str or date): The start date of the period, strings in the format '%Y-%m-%d'.
+        - end_date (str or date): The end date of the period, strings in the format '%Y-%m-%d'.
+        - group_by (str): One of REVENUE_GROUPS.
 
         Returns:
-        - float: The total rental fee for all rented books within the specified period.
+        - list: A list of dictionaries with the group key, the revenue and the number of rentals.
 
+        Raises:
+        - ValueError: If group_by is not one of REVENUE_GROUPS.
         """
 
-        # 1.Find all books that have been rented on a specific period
-        rented_books = self.get_all_rented_books_for_period(start_date, end_date, 'instances')
+        if group_by not in REVENUE_GROUPS:
+            raise ValueError(f"Invalid group: {group_by}")
 
-        # 2. Calculate total revenue for this specific range
-        total = sum(book.total_cost for book in rented_books)
-        return total
+        query = revenue_breakdown_query(db.session.get_bind().dialect.name, start_date, end_date, group_by)
+        return revenue_breakdown(db.session.execute(query), group_by)
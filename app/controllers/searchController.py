@@ -0,0 +1,295 @@
+from app.models import db, Book, BOOK_SEARCH_DOCUMENT
+from app.controllers.bookController import BOOK_FIELDS
+from app.replica import RoutingSession
+from app.serialization import rows_to_dicts, stream_dicts
+from flask import current_app, has_app_context
+from sqlalchemy import cast, event, func, literal, or_, select, String
+from sqlalchemy.orm import object_session
+from sqlalchemy.dialects.postgresql import REGCONFIG
+import math
+import re
+import threading
+
+# Filters accepted by /search, mapped to book columns
+SEARCH_FILTERS = {
+    'author': 'author',
+    'publisher': 'publisher',
+    'year': 'year_of_publication',
+    'available': 'isAvailable',
+}
+
+# Minimum trigram similarity of the in-memory typo tolerant fallback (pg_trgm's default similarity threshold)
+SIMILARITY_THRESHOLD = 0.3
+
+SEARCHED_FIELDS = ('title', 'author', 'publisher')
+
+# Fields changed by rentals, read from the database by the in-memory index instead of being indexed
+STOCK_FIELDS = (Book.isbn, Book.isAvailable, Book.copies, Book.available_copies)
+
+# ISBNs per query when reading the stock fields
+STOCK_BATCH_SIZE = 500
+
+
+def tokenize(text: str):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def trigrams(word: str):
+    # Trigrams of a word the way pg_trgm splits them, padded with two spaces in front and one at the end
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(left: set, right: set):
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+class PostgresSearchEngine:
+
+    def search(self, query: str, filters: dict, offset: int, limit: int):
+        """
+        Search books with the tsvector GIN index, falling back to trigram similarity when nothing matches.
+
+        Parameters:
+        - query (str): The search text, in websearch syntax ("quoted phrases", -excluded words).
+        - filters (dict): Book column values the results must match.
+        - offset (int): The number of results to skip.
+        - limit (int): The maximum number of results.
+
+        Returns:
+        - list: Book dictionaries with a 'score', best match first.
+        """
+
+        ts_query = func.websearch_to_tsquery(cast(literal('simple', String), REGCONFIG), query)
+        rank = func.ts_rank(BOOK_SEARCH_DOCUMENT, ts_query)
+
+        match = BOOK_SEARCH_DOCUMENT.op('@@')(ts_query)
+        results = self._run(match, rank, filters, offset, limit)
+        # The mode does not depend on the page: later pages of a fallback result are fallback pages too
+        if results or (offset and self._exists(match, filters)):
+            return results
+
+        # Typo tolerant fallback - '<%' (word similarity above pg_trgm.word_similarity_threshold) uses the trigram indexes
+        score = func.greatest(*(func.word_similarity(query, getattr(Book, field)) for field in SEARCHED_FIELDS))
+        condition = or_(*(literal(query).op('<%')(getattr(Book, field)) for field in SEARCHED_FIELDS))
+        return self._run(condition, score, filters, offset, limit)
+
+    @staticmethod
+    def _exists(condition, filters: dict):
+        return db.session.execute(select(select(Book.isbn).where(condition).filter_by(**filters).exists())).scalar()
+
+    @staticmethod
+    def _run(condition, score, filters: dict, offset: int, limit: int):
+        statement = (select(*BOOK_FIELDS, score.label('score'))
+                     .where(condition)
+                     .filter_by(**filters)
+                     .order_by(score.desc(), Book.isbn)
+                     .offset(offset)
+                     .limit(limit))
+        return rows_to_dicts(db.session.execute(statement))
+
+
+class InMemorySearchEngine:
+    """
+    Inverted index over title/author/publisher with the interface of PostgresSearchEngine.
+
+    Used with databases without full text search (SQLite in tests and local development).
+    All query words must match (like websearch_to_tsquery); results are ranked by TF-IDF.
+    When nothing matches, books are ranked by the trigram similarity of the query words to their closest word
+    in the book instead, close to pg_trgm's word_similarity.
+
+    The index is changed by the after_commit listener below while other request threads search it, so every
+    access holds the lock.
+    """
+
+    def __init__(self, books=(), stock=None):
+        """
+        Parameters:
+        - books (iterable): The book dictionaries to index.
+        - stock (callable): Reads the current stock fields of a list of ISBNs, {isbn: {field: value}}.
+          Without it the indexed values are used.
+        """
+        self.stock = stock
+        self.lock = threading.RLock()
+        self.documents = {}
+        self.postings = {}
+        self.words = {}
+        self.trigrams = {}
+        for book in books:
+            self.add(book)
+
+    def add(self, book: dict):
+        isbn = book['isbn']
+        words = tokenize(' '.join(str(book.get(field) or '') for field in SEARCHED_FIELDS))
+
+        with self.lock:
+            self.remove(isbn)
+            self.documents[isbn] = dict(book)
+            self.words[isbn] = set(words)
+            self.trigrams[isbn] = [trigrams(word) for word in self.words[isbn]]
+            for word in words:
+                postings = self.postings.setdefault(word, {})
+                postings[isbn] = postings.get(isbn, 0) + 1
+
+    def remove(self, isbn: str):
+        with self.lock:
+            if self.documents.pop(isbn, None) is None:
+                return
+            for word in self.words.pop(isbn):
+                del self.postings[word][isbn]
+                if not self.postings[word]:
+                    del self.postings[word]
+            del self.trigrams[isbn]
+
+    def search(self, query: str, filters: dict, offset: int, limit: int):
+        # Exact matches, or similar books when no book contains every word. The mode does not depend on the page,
+        # later pages of a fallback result are fallback pages too. The stock is read outside the lock.
+        with self.lock:
+            scores = self._match(tokenize(query))
+            if not scores:
+                scores = self._similar([trigrams(word) for word in tokenize(query)])
+            books = {isbn: self.documents[isbn] for isbn in scores}
+
+        stock = self.stock(list(scores)) if self.stock and scores else {}
+        books = {isbn: dict(book, **stock.get(isbn, {})) for isbn, book in books.items()}
+
+        ranked = sorted(
+            ((score, isbn) for isbn, score in scores.items() if self._accepts(books[isbn], filters)),
+            key=lambda item: (-item[0], item[1]),
+        )
+        return [dict(books[isbn], score=score) for score, isbn in ranked[offset:offset + limit]]
+
+    def _match(self, words: list):
+        if not words or any(word not in self.postings for word in words):
+            return {}
+
+        total = len(self.documents)
+        scores = None
+        for word in words:
+            postings = self.postings[word]
+            idf = math.log(total / len(postings)) + 1
+            word_scores = {isbn: count * idf for isbn, count in postings.items()}
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = {isbn: scores[isbn] + word_scores[isbn] for isbn in scores.keys() & word_scores.keys()}
+        return scores
+
+    def _similar(self, query_trigrams: list):
+        scores = {}
+        if not query_trigrams:
+            return scores
+
+        for isbn, word_trigrams in self.trigrams.items():
+            score = sum(max((similarity(grams, query) for grams in word_trigrams), default=0.0)
+                        for query in query_trigrams) / len(query_trigrams)
+            if score >= SIMILARITY_THRESHOLD:
+                scores[isbn] = score
+        return scores
+
+    @staticmethod
+    def _accepts(book: dict, filters: dict):
+        return all(str(book.get(column)) == str(value) for column, value in filters.items())
+
+
+class SearchService:
+
+    def get_engine(self):
+        """
+        Return the search engine of the current app: PostgreSQL full text search, or an in-memory index
+        built from the books table on first use for other databases. SEARCH_ENGINE in the app config
+        ('postgres' or 'memory') overrides the choice.
+        """
+
+        engine = current_app.extensions.get('search_engine')
+        if engine is None:
+            kind = current_app.config.get('SEARCH_ENGINE')
+            if kind is None:
+                kind = 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+
+            if kind == 'postgres':
+                engine = PostgresSearchEngine()
+            else:
+                books = stream_dicts(db.session.execute(select(*BOOK_FIELDS)))
+                engine = InMemorySearchEngine(books, stock=self.read_stock)
+            current_app.extensions['search_engine'] = engine
+        return engine
+
+    @staticmethod
+    def read_stock(isbns: list):
+        # Current availability of the books, rentals change it with UPDATE statements
+        stock = {}
+        for start in range(0, len(isbns), STOCK_BATCH_SIZE):
+            statement = select(*STOCK_FIELDS).where(Book.isbn.in_(isbns[start:start + STOCK_BATCH_SIZE]))
+            stock.update((row['isbn'], dict(row)) for row in db.session.execute(statement).mappings())
+        return stock
+
+    def search(self, query: str, filters: dict, offset: int, limit: int):
+        """
+        Search books by title, author and publisher.
+
+        Parameters:
+        - query (str): The search text.
+        - filters (dict): Field filters by SEARCH_FILTERS name, e.g. {'author': 'Amy Tan', 'available': 'true'}.
+        - offset (int): The number of results to skip.
+        - limit (int): The maximum number of results.
+
+        Returns:
+        - tuple: A list of book dictionaries with a 'score', best match first,
+          and the offset of the next page, or None on the last page.
+
+        Raises:
+        - ValueError: If a filter value is not valid.
+        """
+
+        columns = {}
+        for name, value in filters.items():
+            column = SEARCH_FILTERS[name]
+            if column == 'isAvailable':
+                if value.lower() not in ('true', 'false'):
+                    raise ValueError(f"Invalid filter: {name}={value}")
+                value = value.lower() == 'true'
+            elif column == 'year_of_publication':
+                if not value.isdigit():
+                    raise ValueError(f"Invalid filter: {name}={value}")
+                value = int(value)
+            columns[column] = value
+
+        # Fetch one extra row to know if there is a next page
+        results = self.get_engine().search(query, columns, offset, limit + 1)
+
+        next_offset = offset + limit if len(results) > limit else None
+        return results[:limit], next_offset
+
+
+def _indexed_engine():
+    engine = current_app.extensions.get('search_engine') if has_app_context() else None
+    return engine if isinstance(engine, InMemorySearchEngine) else None
+
+
+@event.listens_for(Book, 'after_update')
+def _book_updated(mapper, connection, target):
+    # Catalog changes made through the ORM (title, author, ...) are indexed once committed. Stock fields changed
+    # by rentals with UPDATE statements skip ORM events, the index reads them with read_stock instead.
+    session = object_session(target)
+    if session is not None and _indexed_engine():
+        session.info.setdefault('search_updates', {})[target.isbn] = {
+            field.key: getattr(target, field.key) for field in BOOK_FIELDS}
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _index_committed(session):
+    updates = session.info.pop('search_updates', None)
+    engine = _indexed_engine() if updates else None
+    if engine:
+        with engine.lock:
+            for isbn, book in updates.items():
+                if isbn in engine.documents:
+                    engine.add(book)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _index_rolled_back(session):
+    session.info.pop('search_updates', None)
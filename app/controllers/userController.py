@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta
 import jwt
 from flask import jsonify, make_response
-from app.models import RentedHistory, User
-from app.utilities import to_dict, send_response
-from config.Config import AppConfig
+from sqlalchemy import select
+from app.models import db, Book, RentedHistory, User
+from app.controllers.bookController import BOOK_FIELDS
+from app.serialization import rows_to_dicts
+from app.utilities import to_dict, send_response, get_secret_key, TOKEN_LIFETIME
 
 
 class UserService:
@@ -31,16 +33,14 @@ class UserService:
 
         data = to_dict(user)
 
-        # 2. Find all rentals for this specific user on history table
-        rented_books = RentedHistory.query.filter_by(user=user_id, end_date=None)
+        # 2. Find the books of all open rentals of this user in one joined query
+        query = (select(*BOOK_FIELDS)
+                 .join(RentedHistory, RentedHistory.isbn == Book.isbn)
+                 .where(RentedHistory.user == user_id, RentedHistory.end_date.is_(None))
+                 .order_by(RentedHistory.id))
 
-        rented_books_info = []
-        # 3. For each rental get book info based on foreign key isbn
-        for rented_instance in rented_books:
-            rented_books_info.append(to_dict(rented_instance.book))
-
-        # 4. Format return data with rented books
-        data['rented_books'] = rented_books_info
+        # 3. Format return data with rented books
+        data['rented_books'] = rows_to_dicts(db.session.execute(query))
 
         return send_response(data)
 
@@ -112,7 +112,7 @@ class UserService:
             return send_response("Invalid credentials", 401)
 
             # 5. OK ready to login and create new JWT for user
-        token = self.generate_token(user.id)
+        token = self.generate_token(user.id, user.isAdmin)
 
         if token: 
             response = jsonify({
@@ -122,28 +122,31 @@ class UserService:
         })
             return make_response(response, 200)
 
-    def generate_token(self, user_id: int, mode = None):
+    def generate_token(self, user_id: int, is_admin: bool = None, mode = None):
 
         """
         Generate a JWT token for the specified user_id.
 
         Parameters:
         - user_id (int): The unique identifier of the user for whom the token is generated.
+        - is_admin (bool): The role of the user, embedded as the isAdmin claim (default is None for no claim).
 
         Returns:
         - response: A json response with JWT token and user data.
 
         """
 
-        if mode == 'test':
-            config = AppConfig(path = '../config/config.ini') 
-        else: 
-            config = AppConfig()
+        secret_key = get_secret_key('../config/config.ini' if mode == 'test' else None)
 
-        
-        token = jwt.encode({
+        expiration = datetime.utcnow() + timedelta(seconds=TOKEN_LIFETIME)
+        payload = {
             "user_id": user_id,
-            "expiration": str(datetime.utcnow() + timedelta(seconds=120))
-        }, config.get_secret_key(), algorithm='HS256')
+            "expiration": str(expiration),
+            "exp": expiration,
+        }
+        if is_admin is not None:
+            payload["isAdmin"] = bool(is_admin)
+
+        token = jwt.encode(payload, secret_key, algorithm='HS256')
 
         return token
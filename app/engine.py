@@ -0,0 +1,196 @@
+"""
+Module Documentation: engine.py
+
+This module builds the SQLAlchemy engine settings from the [Database] section of config.ini and measures
+the connection pool.
+
+Settings (all optional):
+- pool_size, max_overflow: Connections kept open, and extra connections opened under load.
+- pool_timeout: Seconds a request waits for a connection before failing.
+- pool_recycle: Seconds after which a connection is replaced (below the server or proxy idle timeout).
+- pool_pre_ping: Test connections before using them, so dropped connections are replaced transparently.
+- statement_timeout: Milliseconds after which PostgreSQL cancels a statement.
+- pgbouncer: The database is reached through PgBouncer in transaction pooling mode. Prepared statements are
+  not cached (they do not survive a change of server connection) and the statement timeout is set per
+  transaction instead of per connection.
+
+Functions:
+- read_pool_settings: Read the pool settings of a config section.
+- engine_options: Build the create_engine keyword arguments of a database URL.
+- install_statement_timeout: Set the statement timeout per transaction (PgBouncer mode).
+- pool_stats: The checkouts, wait time and overflow of an engine's pool.
+
+Classes:
+- TimedQueuePool: QueuePool counting checkouts and the time spent waiting for a connection.
+
+"""
+import threading
+import time
+import uuid
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+POOL_OPTIONS = {
+    'pool_size': int,
+    'max_overflow': int,
+    'pool_timeout': int,
+    'pool_recycle': int,
+}
+
+
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.max_overflow_seen = 0
+        self._stats_lock = threading.Lock()
+
+    def connect(self):
+        # Time from asking for a connection to getting one: queueing, new connections and pre-ping
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+                self.wait_seconds += time.perf_counter() - started
+            raise
+
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.max_overflow_seen = max(self.max_overflow_seen, self.overflow())
+        return connection
+
+
+def read_pool_settings(section):
+    """
+    Read the pool settings of a config section.
+
+    Parameters:
+    - section: The [Database] section of config.ini (a configparser section or a dict of strings).
+
+    Returns:
+    - dict: The settings given, converted to numbers and booleans.
+    """
+
+    settings = {}
+    for name, convert in POOL_OPTIONS.items():
+        if section.get(name):
+            settings[name] = convert(section.get(name))
+    if section.get('statement_timeout'):
+        settings['statement_timeout'] = int(section.get('statement_timeout'))
+    for name in ('pool_pre_ping', 'pgbouncer'):
+        if section.get(name):
+            settings[name] = section.get(name).strip().lower() in ('1', 'true', 'yes', 'on')
+    return settings
+
+
+def engine_options(url, settings: dict, is_async: bool = False):
+    """
+    Build the create_engine keyword arguments of a database URL.
+
+    Parameters:
+    - url (str or URL): The database URL.
+    - settings (dict): The pool settings, see read_pool_settings.
+    - is_async (bool): The options are for create_async_engine (default is False).
+
+    Returns:
+    - dict: The engine options, e.g. for SQLALCHEMY_ENGINE_OPTIONS.
+    """
+
+    url = make_url(url)
+    backend, driver = url.get_backend_name(), url.get_driver_name()
+    options = {}
+    connect_args = {}
+
+    # In-memory SQLite lives in a single connection, it has no pool to tune
+    if backend != 'sqlite' or url.database not in (None, '', ':memory:'):
+        options.update({name: settings[name] for name in POOL_OPTIONS if name in settings})
+        if not is_async:
+            options['poolclass'] = TimedQueuePool
+
+    if 'pool_pre_ping' in settings:
+        options['pool_pre_ping'] = settings['pool_pre_ping']
+
+    if backend == 'postgresql':
+        pgbouncer = settings.get('pgbouncer', False)
+
+        if pgbouncer and (driver == 'asyncpg' or is_async):
+            connect_args.update({
+                'statement_cache_size': 0,
+                'prepared_statement_cache_size': 0,
+                'prepared_statement_name_func': lambda: f'__asyncpg_{uuid.uuid4()}__',
+            })
+        elif pgbouncer and driver == 'psycopg':
+            connect_args['prepare_threshold'] = None
+
+        timeout = settings.get('statement_timeout')
+        if timeout and not pgbouncer:
+            if driver == 'asyncpg' or is_async:
+                connect_args['server_settings'] = {'statement_timeout': str(timeout)}
+            else:
+                connect_args['options'] = f'-c statement_timeout={timeout}'
+
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def install_statement_timeout(engine, settings: dict):
+    """
+    Set the statement timeout at the start of every transaction, for PostgreSQL behind PgBouncer.
+
+    PgBouncer hands every transaction a different server connection, so a timeout set when connecting
+    would apply to the wrong client. SET LOCAL only lasts until the end of the transaction.
+
+    Parameters:
+    - engine: The (sync) engine.
+    - settings (dict): The pool settings, see read_pool_settings.
+    """
+
+    timeout = settings.get('statement_timeout')
+    if not timeout or not settings.get('pgbouncer') or engine.dialect.name != 'postgresql':
+        return
+
+    @event.listens_for(engine, 'begin')
+    def _set_statement_timeout(connection):
+        connection.exec_driver_sql(f'SET LOCAL statement_timeout = {int(timeout)}')
+
+
+def pool_stats(engine):
+    """
+    The state of an engine's connection pool.
+
+    Parameters:
+    - engine: The engine.
+
+    Returns:
+    - dict: The pool size, connections checked out and in overflow, and for a TimedQueuePool the number of
+      checkouts, timeouts and the time spent waiting for a connection.
+    """
+
+    pool = engine.pool
+    stats = {
+        'size': pool.size() if hasattr(pool, 'size') else 0,
+        'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else 0,
+        'overflow': max(pool.overflow(), 0) if hasattr(pool, 'overflow') else 0,
+    }
+
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'wait_seconds': pool.wait_seconds,
+            'max_wait_seconds': pool.max_wait_seconds,
+            'max_overflow': pool.max_overflow_seen,
+        })
+    return stats
@@ -0,0 +1,509 @@
+"""
+Module Documentation: exports.py
+
+This module writes the exports of the /rentals and /revenue reports, in background jobs or streamed to the client.
+
+Rows are written one at a time with the csv module as they are fetched from a server-side cursor, so memory use
+does not grow with the size of a report. Export files are written to the output folder, one per report, query
+(e.g. the date range) and day.
+
+Exports can also be written as Parquet or Arrow IPC files (requires the 'pyarrow' package): rows are gathered in
+record batches of RECORD_BATCH_ROWS and written batch by batch, optionally partitioned by a date column into
+'<column>=<YYYY-MM-DD>' folders that pyarrow.dataset reads back with hive partitioning.
+
+Functions:
+- csv_chunks: Encode rows as CSV text, in chunks for a streamed response.
+- write_csv: Write rows to a CSV file.
+- arrow_schema: The Arrow schema of SQLAlchemy columns.
+- record_batches: Gather rows into Arrow record batches.
+- write_columnar: Write rows to a Parquet or Arrow file, or a folder of them partitioned by date.
+- export_file: Write the daily export file of a report, in any of the EXPORT_FORMATS.
+
+Classes:
+- ExportJobs: Export jobs run by a thread pool in the background, with their status. The status is also written
+  to a file in the export folder, so every worker process serves the jobs of the others.
+
+"""
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric
+
+from app.replica import read_replica
+
+EXPORT_DIR = 'output'
+
+# Rows per chunk of a streamed CSV response
+CSV_CHUNK_ROWS = 1000
+
+# Finished jobs kept for the job status endpoint
+MAX_FINISHED_JOBS = 1000
+
+# Folder of the job status files, inside the export folder
+JOBS_DIR = '.jobs'
+
+# File extension and media type of every export format
+EXPORT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+# Rows per record batch of the Parquet and Arrow exports (one Parquet row group each)
+RECORD_BATCH_ROWS = 10000
+
+# Compression of the Parquet exports
+PARQUET_COMPRESSION = 'zstd'
+
+
+def csv_chunks(rows, fieldnames: list = None, chunk_rows: int = CSV_CHUNK_ROWS):
+    """
+    Encode rows as CSV text, in chunks for a streamed response.
+
+    Parameters:
+    - rows (iterable): The rows, as dictionaries.
+    - fieldnames (list): The columns (default is the keys of the first row).
+    - chunk_rows (int): The number of rows per chunk.
+
+    Yields:
+    - str: The header line, then chunks of rows.
+    """
+
+    buffer = io.StringIO()
+    writer = None
+    if fieldnames:
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+        writer.writeheader()
+
+    for count, row in enumerate(rows, 1):
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_csv(rows, path: str, fieldnames: list = None):
+    """
+    Write rows to a CSV file. The file only appears once it is complete.
+
+    Parameters:
+    - rows (iterable): The rows, as dictionaries.
+    - path (str): The path of the CSV file.
+    - fieldnames (list): The columns (default is the keys of the first row).
+
+    Returns:
+    - int: The number of rows written.
+    """
+
+    written = [0]
+
+    def counted():
+        for row in rows:
+            written[0] += 1
+            yield row
+
+    partial = f'{path}.{uuid.uuid4().hex}.part'
+    try:
+        with open(partial, 'w', newline='') as file:
+            for chunk in csv_chunks(counted(), fieldnames):
+                file.write(chunk)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return written[0]
+
+
+def columnar_available():
+    # Whether the Parquet and Arrow formats can be written
+    try:
+        import pyarrow
+    except ImportError:
+        return False
+    return True
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet and Arrow exports require the 'pyarrow' package.")
+    return pyarrow
+
+
+def arrow_schema(columns):
+    """
+    The Arrow schema of SQLAlchemy columns.
+
+    Parameters:
+    - columns (list): The SQLAlchemy columns (or labeled expressions) of the rows.
+
+    Returns:
+    - pyarrow.Schema: One field per column, named by its key.
+    """
+
+    pa = _pyarrow()
+
+    fields = []
+    for column in columns:
+        if isinstance(column.type, Boolean):
+            type_ = pa.bool_()
+        elif isinstance(column.type, Integer):
+            type_ = pa.int64()
+        elif isinstance(column.type, (Float, Numeric)):
+            type_ = pa.float64()
+        elif isinstance(column.type, DateTime):
+            type_ = pa.timestamp('us')
+        elif isinstance(column.type, Date):
+            type_ = pa.date32()
+        else:
+            type_ = pa.string()
+        fields.append(pa.field(column.key, type_))
+    return pa.schema(fields)
+
+
+def record_batches(rows, schema=None, batch_rows: int = RECORD_BATCH_ROWS):
+    """
+    Gather rows into Arrow record batches.
+
+    Parameters:
+    - rows (iterable): The rows, as dictionaries.
+    - schema (pyarrow.Schema): The schema of the batches (default is the one inferred from the first batch).
+    - batch_rows (int): The number of rows per batch.
+
+    Yields:
+    - pyarrow.RecordBatch: The rows, batch_rows at a time.
+    """
+
+    pa = _pyarrow()
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_rows))
+        if not chunk:
+            return
+        batch = pa.RecordBatch.from_pylist(chunk, schema=schema)
+        schema = batch.schema
+        yield batch
+
+
+class _BatchWriter:
+    # Parquet or Arrow IPC file written one record batch at a time
+
+    def __init__(self, path: str, fmt: str, schema):
+        pa = _pyarrow()
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, schema, compression=PARQUET_COMPRESSION)
+        else:
+            self.writer = pa.ipc.new_file(path, schema)
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+
+
+def _partitions(rows, partition_by: str, batch_rows: int):
+    # Split rows into runs of the same partition value, which is removed from the rows
+    run, value = [], None
+    for row in rows:
+        row = dict(row)
+        key = row.pop(partition_by)
+        key = key.isoformat() if hasattr(key, 'isoformat') else str(key)
+        if run and key != value:
+            yield value, run
+            run = []
+        value = key
+        run.append(row)
+        if len(run) >= batch_rows:
+            yield value, run
+            run = []
+    if run:
+        yield value, run
+
+
+def write_columnar(rows, path: str, fmt: str, schema=None, partition_by: str = None,
+                   batch_rows: int = RECORD_BATCH_ROWS):
+    """
+    Write rows to a Parquet or Arrow IPC file, written record batch by record batch. The file only appears
+    once it is complete.
+
+    With partition_by the path is a folder with one '<partition_by>=<value>/part-<n><ext>' file per value of the
+    column, the column itself is not stored in the files. Rows should be ordered by the column: a value seen
+    again after another one gets a new part file.
+
+    Parameters:
+    - rows (iterable): The rows, as dictionaries.
+    - path (str): The path of the file or partitioned folder.
+    - fmt (str): 'parquet' or 'arrow'.
+    - schema (pyarrow.Schema): The schema of the rows (default is the one inferred from the first rows).
+    - partition_by (str): The date column to partition the rows by (default is None for a single file).
+    - batch_rows (int): The number of rows per record batch.
+
+    Returns:
+    - int: The number of rows written.
+    """
+
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(COLUMNAR_FORMATS)}")
+
+    pa = _pyarrow()
+    extension = EXPORT_FORMATS[fmt][0]
+    partial = f'{path}.{uuid.uuid4().hex}.part'
+    count = 0
+    writer = None
+    try:
+        if partition_by is None:
+            for batch in record_batches(rows, schema, batch_rows):
+                if writer is None:
+                    writer = _BatchWriter(partial, fmt, batch.schema)
+                writer.write(batch)
+                count += batch.num_rows
+            if writer is None:
+                # No rows, an empty file with the schema
+                writer = _BatchWriter(partial, fmt, schema or pa.schema([]))
+            writer.close()
+            writer = None
+        else:
+            if schema is not None and partition_by in schema.names:
+                schema = schema.remove(schema.get_field_index(partition_by))
+            os.makedirs(partial)
+            parts, current = {}, None
+            for value, run in _partitions(rows, partition_by, batch_rows):
+                if value != current:
+                    if writer is not None:
+                        writer.close()
+                    folder = os.path.join(partial, f'{partition_by}={value}')
+                    os.makedirs(folder, exist_ok=True)
+                    parts[value] = parts.get(value, -1) + 1
+                    current, writer = value, None
+
+                for batch in record_batches(run, schema, batch_rows):
+                    schema = batch.schema
+                    if writer is None:
+                        writer = _BatchWriter(os.path.join(folder, f'part-{parts[value]}{extension}'), fmt, schema)
+                    writer.write(batch)
+                    count += batch.num_rows
+            if writer is not None:
+                writer.close()
+                writer = None
+        os.replace(partial, path)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        if os.path.isdir(partial):
+            shutil.rmtree(partial)
+        elif os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return count
+
+
+def export_file(rows, filename: str, directory: str = EXPORT_DIR, fmt: str = 'csv', fieldnames: list = None,
+                columns: list = None, partition_by: str = None, key: str = None):
+    """
+    Write the export file of a report for today, '<directory>/<filename>-<YYYY-MM-DD>[-<key>].<csv|parquet|arrow>'.
+    A report is exported once a day per query and format; if today's file exists it is kept and the rows are not
+    read.
+
+    Parameters:
+    - rows (iterable): The rows, as dictionaries. A generator is only consumed when the file is written.
+    - filename (str): The name of the report, e.g. 'Rentals'.
+    - directory (str): The export folder (default is EXPORT_DIR).
+    - fmt (str): One of EXPORT_FORMATS (default is 'csv').
+    - fieldnames (list): The CSV columns (default is the keys of the first row).
+    - columns (list): The SQLAlchemy columns of the rows, the schema of Parquet and Arrow files (default is None
+      for a schema inferred from the rows).
+    - partition_by (str): The date column Parquet and Arrow exports are partitioned by (default is None).
+    - key (str): Identifies the query of the report, e.g. '2023-01-01_2023-01-31' for its date range (default is
+      None): exports of other queries get their own file.
+
+    Returns:
+    - tuple: The path of the file (or partitioned folder) and the number of rows written, or None if the file
+      already existed.
+    """
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    name = f"{filename}-{datetime.now().strftime('%Y-%m-%d')}" + (f"-{key}" if key else '')
+    path = os.path.join(directory, f"{name}{EXPORT_FORMATS[fmt][0]}")
+    if os.path.exists(path):
+        logging.warning(f"Backup already exists for '{os.path.basename(path)}'. No action taken.")
+        return path, None
+
+    os.makedirs(directory, exist_ok=True)
+    if fmt == 'csv':
+        count = write_csv(rows, path, fieldnames)
+    else:
+        schema = arrow_schema(columns) if columns else None
+        count = write_columnar(rows, path, fmt, schema, partition_by)
+    logging.info(f"New {fmt} export '{os.path.basename(path)}' created with {count} rows.")
+    return path, count
+
+
+class ExportJobs:
+
+    def __init__(self, max_workers: int = 2, directory: str = EXPORT_DIR):
+        """
+        Parameters:
+        - max_workers (int): The number of exports written at the same time.
+        - directory (str): The export folder.
+        """
+        self.max_workers = max_workers
+        self.directory = directory
+        self.jobs = OrderedDict()
+        self.futures = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Settings of the optional [Exports] section of config.ini, see AppConfig.configure_app
+        self.max_workers = app.config.get('EXPORT_WORKERS', self.max_workers)
+        self.directory = app.config.get('EXPORT_DIR', self.directory)
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='export')
+            return self._executor
+
+    def submit(self, filename: str, rows, fieldnames: list = None, fmt: str = 'csv', columns: list = None,
+               partition_by: str = None, key: str = None):
+        """
+        Queue the export of a report, see export_file. Must be called within an application context.
+
+        Parameters:
+        - filename (str): The name of the report, e.g. 'Rentals'.
+        - rows (callable): Returns the rows of the report. It runs in the background job, in a new application
+          context with its own database session, and reads from the read replica when one is configured.
+        - fieldnames (list): The CSV columns (default is the keys of the first row).
+        - fmt (str): One of EXPORT_FORMATS (default is 'csv').
+        - columns (list): The SQLAlchemy columns of the rows, the schema of Parquet and Arrow files.
+        - partition_by (str): The date column Parquet and Arrow exports are partitioned by.
+        - key (str): Identifies the query of the report, e.g. its date range.
+
+        Returns:
+        - dict: The status of the job.
+        """
+
+        app = current_app._get_current_object()
+        job = {'id': uuid.uuid4().hex, 'report': filename, 'format': fmt, 'status': 'queued', 'rows': None,
+               'file': None, 'error': None, 'created_at': datetime.now().isoformat(), 'finished_at': None}
+
+        queued = dict(job)
+        options = {'fieldnames': fieldnames, 'columns': columns, 'partition_by': partition_by, 'key': key}
+        executor = self.executor
+        self._save(job)
+        with self._lock:
+            self.jobs[job['id']] = job
+            self._forget_finished()
+            future = executor.submit(self._run, app, job, filename, rows, options)
+            self.futures[job['id']] = future
+        # Finished jobs only keep their status
+        future.add_done_callback(lambda _: self.futures.pop(job['id'], None))
+        return queued
+
+    def _run(self, app, job, filename, rows, options):
+        job['status'] = 'running'
+        self._save(job)
+        try:
+            with app.app_context():
+                export = read_replica.reads(
+                    lambda: export_file(rows(), filename, self.directory, job['format'], **options))
+                job['file'], job['rows'] = export()
+            job['status'] = 'done' if job['rows'] is not None else 'skipped'
+        except Exception as e:
+            logging.error(f"Export {job['id']} of {filename} failed: {e}")
+            job['status'], job['error'] = 'failed', str(e)
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+            self._save(job)
+
+    def _status_path(self, job_id: str):
+        return os.path.join(self.directory, JOBS_DIR, f'{job_id}.json')
+
+    def _save(self, job: dict):
+        # Write the status file of a job, replaced at once so readers never see a partial file
+        path = self._status_path(job['id'])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f'{path}.{uuid.uuid4().hex}.part'
+        with open(partial, 'w') as file:
+            json.dump(job, file)
+        os.replace(partial, path)
+
+    def _forget_finished(self):
+        # Drop the oldest finished jobs beyond MAX_FINISHED_JOBS, with their status files
+        finished = [job_id for job_id, job in self.jobs.items() if job['finished_at'] is not None]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
+            if os.path.exists(self._status_path(job_id)):
+                os.remove(self._status_path(job_id))
+
+    def get(self, job_id: str):
+        """
+        The status of a job, of this process or, from its status file, of another worker process.
+
+        Parameters:
+        - job_id (str): The id of the job.
+
+        Returns:
+        - dict: The status of the job, or None for an unknown job.
+        """
+
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return dict(job)
+
+        # Ids are uuid4 hex strings, anything else is not a file name of the jobs folder
+        if len(job_id) != 32 or any(char not in '0123456789abcdef' for char in job_id):
+            return None
+        try:
+            with open(self._status_path(job_id)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def wait(self, job_id: str, timeout: float = None):
+        """
+        Wait until a job finished.
+
+        Parameters:
+        - job_id (str): The id of the job.
+        - timeout (float): The maximum number of seconds to wait (default is None for no limit).
+
+        Returns:
+        - dict: The status of the job, or None for an unknown job.
+        """
+
+        future = self.futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+        return self.get(job_id)
+
+
+export_jobs = ExportJobs()
@@ -0,0 +1,103 @@
+"""
+Module Documentation: fees.py
+
+This module computes rental fees from a tiered pricing table.
+
+A pricing table is a sequence of (up_to_days, price_per_day) tiers in increasing order. Days of a rental
+are charged at the price of the tier they fall in; the last tier has up_to_days None and covers the
+remaining days. The default table charges 1.0 per day for the first 3 days and 0.5 per day after that.
+
+Functions:
+- parse_tiers: Parse a pricing table from its config.ini notation.
+- rental_fee: Calculate the fee of a single rental (pure Python).
+- batch_rental_fees: Calculate the fees of many rentals at once with NumPy.
+
+"""
+from datetime import date
+
+DEFAULT_TIERS = ((3, 1.0), (None, 0.5))
+
+
+def parse_tiers(value: str):
+    """
+    Parse a pricing table written as comma separated 'up_to_days:price' pairs, '*' for the last tier.
+
+    Example: '3:1.0, 7:0.75, *:0.5'
+
+    Parameters:
+    - value (str): The pricing table.
+
+    Returns:
+    - tuple: The (up_to_days, price_per_day) tiers.
+
+    Raises:
+    - ValueError: If the table is malformed, not in increasing order or does not end with a '*' tier.
+    """
+
+    tiers = []
+    for tier in value.split(','):
+        up_to, _, price = tier.partition(':')
+        up_to = up_to.strip()
+        tiers.append((None if up_to == '*' else int(up_to), float(price)))
+
+    bounds = [up_to for up_to, _ in tiers[:-1]]
+    if not tiers or tiers[-1][0] is not None or None in bounds or bounds != sorted(set(bounds)):
+        raise ValueError(f"Invalid pricing tiers: {value}")
+    return tuple(tiers)
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def rental_fee(start, end, tiers=DEFAULT_TIERS):
+    """
+    Calculate the fee of a single rental.
+
+    Parameters:
+    - start (str or date): The start date of the rental, strings in the format '%Y-%m-%d'.
+    - end (str or date): The end date of the rental, strings in the format '%Y-%m-%d'.
+    - tiers (tuple): The pricing table (default is DEFAULT_TIERS).
+
+    Returns:
+    - float: The rental fee.
+    """
+
+    days = (_as_date(end) - _as_date(start)).days
+
+    fee = 0.0
+    lower = 0
+    for up_to, price in tiers:
+        if days <= lower:
+            break
+        fee += ((days if up_to is None else min(days, up_to)) - lower) * price
+        lower = up_to
+    return fee
+
+
+def batch_rental_fees(starts, ends, tiers=DEFAULT_TIERS):
+    """
+    Calculate the fees of many rentals at once.
+
+    Parameters:
+    - starts (sequence): Start dates of the rentals - dates, 'YYYY-MM-DD' strings or a datetime64 array.
+    - ends (sequence): End dates of the rentals, in the same order and format.
+    - tiers (tuple): The pricing table (default is DEFAULT_TIERS).
+
+    Returns:
+    - numpy.ndarray: The rental fees as float64, one per rental.
+    """
+
+    import numpy as np
+
+    days = (np.asarray(ends, dtype='datetime64[D]') - np.asarray(starts, dtype='datetime64[D]')).astype(np.int64)
+
+    fees = np.zeros(days.shape, dtype=np.float64)
+    lower = 0
+    for up_to, price in tiers:
+        upper = days if up_to is None else np.minimum(days, up_to)
+        fees += np.clip(upper - lower, 0, None) * price
+        if up_to is None:
+            break
+        lower = up_to
+    return fees
@@ -0,0 +1,210 @@
+"""
+Module Documentation: idempotency.py
+
+This module makes the rent and return routes safe to retry with an Idempotency-Key header.
+
+The first request with a key claims it by inserting a row into idempotency_keys (the primary key makes
+concurrent claims fail), runs the route and stores its response. Retries with the same key get the stored
+response back instead of renting or returning the book again. A claim whose request never stored a response is
+held for IDEMPOTENCY_LEASE, then a retry takes it over and runs the route. The key is bound to its request: the
+method, the path with its query string and a hash of the body (e.g. the ISBNs of a batch); reusing it for another
+request is a 422.
+
+The statements and decisions are shared with the async app (asgi.py), only the session calls differ.
+
+Functions:
+- fingerprint: The request an idempotency key is bound to.
+- claim_statement, takeover_statement, store_statement, release_statement: The statements on idempotency_keys.
+- claim_state: What to do with the row of a key that could not be claimed.
+- replay_error: The error of a retry that cannot be replayed.
+- idempotent: Route decorator replaying the stored response of a repeated Idempotency-Key.
+
+"""
+import hashlib
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Response, make_response, request
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, IdempotencyKey
+from app.utilities import send_response
+
+# Keys older than this are forgotten and can be used again
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+
+# A claim without a stored response is taken over by a retry after this long: the request that claimed it
+# died (worker killed, timeout) without storing or releasing it. Two worker timeouts of 30 seconds.
+IDEMPOTENCY_LEASE = timedelta(seconds=60)
+
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(method: str, path: str, body: bytes):
+    """
+    The request an idempotency key is bound to, retries must send the same one.
+
+    Parameters:
+    - method (str): The HTTP method.
+    - path (str): The path with its query string, e.g. '/return/074322678X?user=1'.
+    - body (bytes): The request body.
+
+    Returns:
+    - str: 'METHOD /path?query sha256-of-the-body'.
+    """
+
+    return f'{method} {path} {hashlib.sha256(body).hexdigest()}'
+
+
+def _key(key: str, user_id: int):
+    return IdempotencyKey.key == key, IdempotencyKey.user == user_id
+
+
+def claim_statement(key: str, user_id: int, request_fingerprint: str):
+    # Fails with an IntegrityError when the key was claimed before
+    return insert(IdempotencyKey).values(key=key, user=user_id, request=request_fingerprint,
+                                         created_at=datetime.now())
+
+
+def takeover_statement(stored: IdempotencyKey, now: datetime):
+    # Of concurrent retries, only the one whose update still sees the abandoned claim takes it over
+    return (update(IdempotencyKey)
+            .where(*_key(stored.key, stored.user), IdempotencyKey.status_code.is_(None),
+                   IdempotencyKey.created_at == stored.created_at)
+            .values(created_at=now))
+
+
+def store_statement(key: str, user_id: int, status_code: int, body: str):
+    return update(IdempotencyKey).where(*_key(key, user_id)).values(status_code=status_code, response=body)
+
+
+def release_statement(key: str, user_id: int):
+    return delete(IdempotencyKey).where(*_key(key, user_id))
+
+
+def claim_state(stored: IdempotencyKey, request_fingerprint: str, now: datetime):
+    """
+    What to do with the row of a key that could not be claimed.
+
+    Parameters:
+    - stored (IdempotencyKey): The row of the key, or None.
+    - request_fingerprint (str): The fingerprint of the current request.
+    - now (datetime): The current time.
+
+    Returns:
+    - str: 'released' if the row is gone (claim again), 'expired' if it is older than IDEMPOTENCY_KEY_TTL
+      (delete it and claim again), 'abandoned' if this request's claim has no response after IDEMPOTENCY_LEASE
+      (take it over), else 'used' (replay it).
+    """
+
+    if stored is None:
+        return 'released'
+    if stored.created_at < now - IDEMPOTENCY_KEY_TTL:
+        return 'expired'
+    if stored.status_code is None and stored.request == request_fingerprint \
+            and stored.created_at < now - IDEMPOTENCY_LEASE:
+        return 'abandoned'
+    return 'used'
+
+
+def replay_error(stored: IdempotencyKey, request_fingerprint: str):
+    """
+    The error of a retry that cannot be replayed.
+
+    Returns:
+    - tuple or None: The message and status code, or None if the stored response can be replayed.
+    """
+
+    if stored.request != request_fingerprint:
+        return "Idempotency-Key was already used for another request", 422
+
+    if stored.status_code is None:
+        return "A request with this Idempotency-Key is still being processed", 409
+
+    return None
+
+
+def _claim(key: str, user_id: int, request_fingerprint: str):
+    """
+    Claim an idempotency key for the current request.
+
+    Returns:
+    - IdempotencyKey or None: The existing row if the key was used before, None if the claim succeeded.
+    """
+
+    while True:
+        try:
+            db.session.execute(claim_statement(key, user_id, request_fingerprint))
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+
+        stored = db.session.get(IdempotencyKey, (key, user_id))
+        state = claim_state(stored, request_fingerprint, datetime.now())
+        if state == 'expired':
+            _release(key, user_id)
+        elif state == 'abandoned':
+            taken = db.session.execute(takeover_statement(stored, datetime.now()))
+            db.session.commit()
+            if taken.rowcount == 1:
+                return None
+        elif state == 'used':
+            return stored
+
+
+def _release(key: str, user_id: int):
+    db.session.rollback()
+    db.session.execute(release_statement(key, user_id))
+    db.session.commit()
+
+
+def _replay(stored: IdempotencyKey, request_fingerprint: str):
+    error = replay_error(stored, request_fingerprint)
+    if error:
+        return send_response(*error)
+
+    response = Response(stored.response, status=stored.status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Decorator storing the response of a route by Idempotency-Key header, per user.
+
+    Must be applied below token_required, the view receives the authenticated user first.
+    Requests without the header are not affected. Responses with a server error are not stored,
+    so the request can be retried with the same key.
+    """
+
+    @wraps(view)
+    def decorated(user, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(user, *args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return send_response(f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters", 400)
+
+        request_fingerprint = fingerprint(request.method, request.full_path.rstrip('?'), request.get_data())
+        stored = _claim(key, user['id'], request_fingerprint)
+        if stored is not None:
+            return _replay(stored, request_fingerprint)
+
+        try:
+            response = make_response(view(user, *args, **kwargs))
+        except Exception:
+            _release(key, user['id'])
+            raise
+
+        if response.status_code >= 500:
+            _release(key, user['id'])
+            return response
+
+        db.session.execute(store_statement(key, user['id'], response.status_code, response.get_data(as_text=True)))
+        db.session.commit()
+        return response
+
+    return decorated
@@ -0,0 +1,113 @@
+"""
+Module Documentation: instrumentation.py
+
+This module provides helpers for measuring the database work done by the application.
+
+The time of a request is split into named timings ('db' for SQL statements, 'serialize' for converting rows and
+encoding JSON) accumulated in the request context, see metrics.RequestMetrics.
+
+Functions:
+- start_timings: Start collecting the timings of the current request.
+- add_timing: Add time to a timing of the current request.
+- instrument_sql: Time every SQL statement of every engine.
+
+Classes:
+- QueryCounter: Context manager recording the SQL statements executed on an engine.
+- timed: Context manager adding its duration to a timing of the current request.
+
+"""
+import time
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def start_timings():
+    # Timings are only collected within requests that called this, e.g. not in background export jobs
+    g.timings = {'db': 0.0, 'serialize': 0.0}
+    g.sql_statements = 0
+
+
+def add_timing(name: str, seconds: float):
+    """
+    Add time to a timing of the current request. Does nothing outside of an instrumented request.
+
+    Parameters:
+    - name (str): The name of the timing, e.g. 'serialize'.
+    - seconds (float): The time spent.
+    """
+
+    if has_request_context():
+        timings = g.get('timings')
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + seconds
+
+
+class timed:
+    """
+    Add the duration of the context to a timing of the current request.
+
+    Usage:
+        with timed('serialize'):
+            body = dumps(data)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_timing(self.name, time.perf_counter() - self.started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._timing_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_timing_started', None)
+    if started is None or not has_request_context() or g.get('timings') is None:
+        return
+    g.timings['db'] += time.perf_counter() - started
+    g.sql_statements += 1
+
+
+def instrument_sql():
+    # Listen on the Engine class, so the primary, the replica and engines created later are all timed
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+class QueryCounter:
+    """
+    Record the SQL statements executed on an engine while the context is active.
+
+    Usage:
+        with QueryCounter(db.engine) as queries:
+            client.get('/rentals?start=2023-12-01&end=2023-12-31')
+        assert queries.count <= 2
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
@@ -0,0 +1,292 @@
+"""
+Module Documentation: loader.py
+
+This module provides a bulk ingest path for loading the books catalog from a CSV file.
+
+Rows are streamed from the file in fixed size chunks, so memory usage stays flat no matter how
+large the catalog is. On PostgreSQL every chunk is sent with COPY FROM STDIN into a staging table and
+merged into books with INSERT ... ON CONFLICT. Other databases (e.g. SQLite in tests) fall back to a
+batched executemany INSERT with the dialect's upsert support, or an UPDATE of the existing books and an INSERT
+of the new ones on dialects without upserts. Existing books only get their catalog columns refreshed.
+
+Functions:
+- read_csv_chunks: Stream rows of a catalog CSV file as lists of book dictionaries.
+- load_book_chunks: Load chunks of book dictionaries into the books table, upserting on ISBN.
+- bulk_load_books: Load a catalog CSV file into the books table, upserting on ISBN.
+- bulk_insert: Insert rows of any table in batched executemany chunks.
+- chunked: Split a stream of rows into lists of at most chunk_size rows.
+
+"""
+import csv
+import io
+import logging
+import time
+from itertools import islice
+
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, func, insert, select, update
+
+from app.models import Book
+from app.response_cache import response_cache
+
+# Mapping between the CSV header and the columns of the books table
+CSV_COLUMNS = {
+    'ISBN': 'isbn',
+    'Book-Title': 'title',
+    'Book-Author': 'author',
+    'Year-Of-Publication': 'year_of_publication',
+    'Publisher': 'publisher',
+    'Image-URL-S': 'image_url_s',
+    'Image-URL-M': 'image_url_m',
+    'Image-URL-L': 'image_url_l',
+    'User-ID': 'rented_now',
+    'Book-Rating': 'rating',
+}
+
+INTEGER_COLUMNS = ('year_of_publication', 'rented_now', 'rating')
+
+# Columns refreshed when a book already exists. Rental state (isAvailable, rented_now) is left untouched
+# so a catalog reload never marks a rented book as available.
+CATALOG_COLUMNS = ('title', 'author', 'year_of_publication', 'publisher',
+                   'image_url_s', 'image_url_m', 'image_url_l', 'rating')
+
+BOOK_COLUMNS = tuple(CSV_COLUMNS.values()) + ('isAvailable',)
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_book(row: dict):
+    book = {column: (row.get(header) or None) for header, column in CSV_COLUMNS.items()}
+    for column in INTEGER_COLUMNS:
+        book[column] = _to_int(book[column])
+    book['isAvailable'] = True
+    return book
+
+
+def read_csv_chunks(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Stream a catalog CSV file in chunks.
+
+    Parameters:
+    - path (str): The path of the CSV file, using the header of data/Books.csv.
+    - chunk_size (int): The maximum number of rows per chunk.
+
+    Yields:
+    - list: A list of dictionaries keyed by books column name. ISBNs are unique within a chunk,
+      the last occurrence wins.
+    """
+
+    with open(path, newline='', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                break
+
+            chunk = {}
+            for row in rows:
+                book = _to_book(row)
+                if book['isbn']:
+                    chunk[book['isbn']] = book
+            yield list(chunk.values())
+
+
+def _copy_chunk(cursor, preparer, chunk: list):
+    # Serialize the chunk as CSV and stream it into the staging table. None is written as an
+    # unquoted empty field, which COPY reads as NULL. The columns are the keys of the rows,
+    # BOOK_COLUMNS for CSV files, plus the copies of generated catalogs.
+    names = list(chunk[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for book in chunk:
+        writer.writerow(['t' if book[column] is True else 'f' if book[column] is False else book[column]
+                         for column in names])
+    buffer.seek(0)
+
+    columns = ', '.join(preparer.quote(column) for column in names)
+    updates = ', '.join([f'{preparer.quote(column)} = EXCLUDED.{preparer.quote(column)}'
+                         for column in CATALOG_COLUMNS] + ['updated_at = now()'])
+
+    cursor.copy_expert(f"COPY books_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    cursor.execute(f"INSERT INTO books ({columns}) SELECT {columns} FROM books_staging "
+                   f"ON CONFLICT (isbn) DO UPDATE SET {updates}")
+    cursor.execute("TRUNCATE books_staging")
+
+
+def _load_with_copy(db, chunks, report):
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("CREATE TEMP TABLE books_staging (LIKE books INCLUDING DEFAULTS) ON COMMIT DROP")
+        preparer = db.engine.dialect.identifier_preparer
+
+        for chunk in chunks:
+            _copy_chunk(cursor, preparer, chunk)
+            report(len(chunk))
+
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def _upsert_statement(dialect_name: str):
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+
+    statement = dialect_insert(Book)
+    return statement.on_conflict_do_update(
+        index_elements=[Book.isbn],
+        set_=dict({column: statement.excluded[column] for column in CATALOG_COLUMNS}, updated_at=func.now()),
+    )
+
+
+def _update_statement():
+    # Catalog columns of existing books, for dialects without upserts. Bound as b_<column>, the column names
+    # are reserved for the SET clause.
+    return (update(Book)
+            .where(Book.isbn == bindparam('b_isbn'))
+            .values(dict({column: bindparam(f'b_{column}') for column in CATALOG_COLUMNS}, updated_at=func.now())))
+
+
+def _load_with_insert(db, chunks, report):
+    statement = _upsert_statement(db.engine.dialect.name)
+    with db.engine.begin() as connection:
+        for chunk in chunks:
+            if statement is None:
+                # Generic dialects have no upsert - update the books that exist inside the same transaction,
+                # keeping their rental state and copies, and insert the others
+                existing = set(connection.scalars(select(Book.isbn).where(
+                    Book.isbn.in_([book['isbn'] for book in chunk]))))
+                if existing:
+                    connection.execute(_update_statement(), [
+                        {f'b_{column}': book[column] for column in ('isbn',) + CATALOG_COLUMNS}
+                        for book in chunk if book['isbn'] in existing])
+                new_books = [book for book in chunk if book['isbn'] not in existing]
+                if new_books:
+                    connection.execute(insert(Book), new_books)
+            else:
+                # executemany - one batched round trip per chunk
+                connection.execute(statement, chunk)
+            report(len(chunk))
+
+
+def load_book_chunks(db, chunks, progress=None, use_copy=None):
+    """
+    Load chunks of book dictionaries into the books table, upserting on ISBN.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+    - chunks (iterable): Lists of dictionaries keyed by books column name, with the same keys in every row,
+      e.g. from read_csv_chunks. ISBNs must be unique within a chunk.
+    - progress (callable): Optional callback receiving a stats dictionary after every chunk.
+    - use_copy (bool): Force (True) or disable (False) the COPY path. By default COPY is used
+      when the database is PostgreSQL with the psycopg2 driver.
+
+    Returns:
+    - dict: The number of loaded rows, the elapsed seconds and the throughput in rows per second.
+    """
+
+    if use_copy is None:
+        use_copy = db.engine.dialect.name == 'postgresql' and db.engine.driver == 'psycopg2'
+
+    stats = {'rows': 0, 'seconds': 0.0, 'rows_per_second': 0.0}
+    started = time.perf_counter()
+
+    def report(rows: int):
+        stats['rows'] += rows
+        stats['seconds'] = time.perf_counter() - started
+        stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+        logging.info(f"Imported {stats['rows']} books ({stats['rows_per_second']:.0f} rows/s)")
+        if progress:
+            progress(dict(stats))
+
+    if use_copy:
+        _load_with_copy(db, chunks, report)
+    else:
+        _load_with_insert(db, chunks, report)
+
+    stats['seconds'] = time.perf_counter() - started
+    # Cached book responses and the in-memory search index (see searchController.py) may describe the previous
+    # catalog, the index is rebuilt on the next search
+    response_cache.invalidate_catalog()
+    if has_app_context():
+        current_app.extensions.pop('search_engine', None)
+    return stats
+
+
+def bulk_load_books(db, path: str = './data/Books.csv', chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    progress=None, use_copy=None):
+    """
+    Load a catalog CSV file into the books table, upserting on ISBN.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+    - path (str): The path of the CSV file.
+    - chunk_size (int): The number of rows read, sent and merged at a time.
+    - progress (callable): Optional callback receiving a stats dictionary after every chunk.
+    - use_copy (bool): Force (True) or disable (False) the COPY path. By default COPY is used
+      when the database is PostgreSQL with the psycopg2 driver.
+
+    Returns:
+    - dict: The number of loaded rows, the elapsed seconds and the throughput in rows per second.
+    """
+
+    stats = load_book_chunks(db, read_csv_chunks(path, chunk_size), progress, use_copy)
+    logging.info(f"Catalog import of '{path}' finished: {stats['rows']} books in {stats['seconds']:.2f}s")
+    return stats
+
+
+def chunked(rows, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Split a stream of rows into lists of at most chunk_size rows, reading one chunk at a time.
+
+    Parameters:
+    - rows (iterable): The rows.
+    - chunk_size (int): The maximum number of rows per chunk.
+
+    Yields:
+    - list: The next chunk_size rows.
+    """
+
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_insert(db, model, rows, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Insert rows in one transaction, one batched executemany INSERT per chunk, so memory usage stays flat.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+    - model: The model of the table, e.g. RentedHistory.
+    - rows (iterable): Dictionaries keyed by column attribute name, with the same keys in every row.
+    - chunk_size (int): The number of rows sent at a time.
+
+    Returns:
+    - int: The number of inserted rows.
+    """
+
+    count = 0
+    with db.engine.begin() as connection:
+        for chunk in chunked(rows, chunk_size):
+            connection.execute(insert(model), chunk)
+            count += len(chunk)
+    return count
@@ -0,0 +1,206 @@
+"""
+Module Documentation: metrics.py
+
+This module renders the operational metrics of the API in the Prometheus text exposition format,
+served by the /metrics route.
+
+Requests of the main blueprint are measured per route (the URL rule, e.g. '/book/<id>'): a latency histogram,
+the number of requests per status, and the SQL statements, SQL time and serialization time they spent (see
+instrumentation.py). With SERVER_TIMING (on in debug mode) responses carry the same split in a Server-Timing header.
+
+Functions:
+- pool_metrics: The connection pool metrics of an engine.
+- render_metrics: Render metrics in the Prometheus text format.
+
+Classes:
+- Histogram: Cumulative histogram with fixed buckets.
+- RequestMetrics: Per-route latency, SQL and serialization metrics of the requests.
+
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import current_app, g, request
+
+from app.engine import pool_stats
+from app.instrumentation import instrument_sql, start_timings
+
+# Prometheus content type of the text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (name, type, help, pool_stats key)
+POOL_METRICS = (
+    ('bookstore_db_pool_size', 'gauge', 'Connections kept open by the pool.', 'size'),
+    ('bookstore_db_pool_checked_out', 'gauge', 'Connections currently in use.', 'checked_out'),
+    ('bookstore_db_pool_overflow', 'gauge', 'Connections currently open beyond the pool size.', 'overflow'),
+    ('bookstore_db_pool_overflow_max', 'gauge', 'Most connections open beyond the pool size.', 'max_overflow'),
+    ('bookstore_db_pool_checkouts_total', 'counter', 'Connections checked out of the pool.', 'checkouts'),
+    ('bookstore_db_pool_timeouts_total', 'counter', 'Checkouts that timed out waiting for a connection.',
+     'timeouts'),
+    ('bookstore_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.', 'wait_seconds'),
+    ('bookstore_db_pool_wait_seconds_max', 'gauge', 'Longest wait for a connection.', 'max_wait_seconds'),
+)
+
+
+# Upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def pool_metrics(engine):
+    """
+    The connection pool metrics of an engine.
+
+    Parameters:
+    - engine: The engine.
+
+    Returns:
+    - list: (name, type, help, value) tuples, for render_metrics.
+    """
+
+    stats = pool_stats(engine)
+    return [(name, kind, description, stats[key]) for name, kind, description, key in POOL_METRICS if key in stats]
+
+
+def render_metrics(metrics):
+    """
+    Render metrics in the Prometheus text format.
+
+    Parameters:
+    - metrics (iterable): (name, type, help, value) tuples. The value is a number, or a list of
+      (suffix, labels, value) samples for labeled metrics and histograms, e.g. ('_count', {'route': '/books'}, 3).
+
+    Returns:
+    - str: The exposition text.
+    """
+
+    lines = []
+    for name, kind, description, value in metrics:
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if not isinstance(value, list):
+            lines.append(f'{name} {value}')
+            continue
+        for suffix, labels, sample in value:
+            lines.append(f'{name}{suffix}{_labels(labels)} {sample}')
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: dict):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+class Histogram:
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # Observations per bucket, the last one for values above every bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, labels: dict):
+        # Cumulative '_bucket' samples, then '_sum' and '_count'
+        samples, total = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            samples.append(('_bucket', dict(labels, le=bound), total))
+        samples.append(('_sum', labels, round(self.sum, 6)))
+        samples.append(('_count', labels, self.count))
+        return samples
+
+
+class RequestMetrics:
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.latency = {}
+        self.requests = {}
+        self.statements = {}
+        self.db_seconds = {}
+        self.serialize_seconds = {}
+        self._lock = threading.Lock()
+
+    def init_blueprint(self, blueprint):
+        # Measure every request of the blueprint, and time the SQL statements of every engine
+        instrument_sql()
+        blueprint.before_request(self.start)
+        blueprint.after_request(self.finish)
+
+    @staticmethod
+    def start():
+        g.metrics_started = time.perf_counter()
+        start_timings()
+
+    def finish(self, response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+
+        elapsed = time.perf_counter() - started
+        timings = g.timings
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        key = (route, request.method)
+
+        with self._lock:
+            if key not in self.latency:
+                self.latency[key] = Histogram(self.buckets)
+            self.latency[key].observe(elapsed)
+            status = key + (response.status_code,)
+            self.requests[status] = self.requests.get(status, 0) + 1
+            self.statements[key] = self.statements.get(key, 0) + g.sql_statements
+            self.db_seconds[key] = self.db_seconds.get(key, 0.0) + timings['db']
+            self.serialize_seconds[key] = self.serialize_seconds.get(key, 0.0) + timings['serialize']
+
+        if current_app.config.get('SERVER_TIMING', current_app.debug):
+            response.headers['Server-Timing'] = (
+                f'db;dur={timings["db"] * 1000:.3f};desc="{g.sql_statements} queries", '
+                f'serialize;dur={timings["serialize"] * 1000:.3f}, '
+                f'total;dur={elapsed * 1000:.3f}')
+        return response
+
+    def metrics(self):
+        """
+        The request metrics, for render_metrics.
+
+        Returns:
+        - list: (name, type, help, samples) tuples.
+        """
+
+        def labels(key):
+            return {'route': key[0], 'method': key[1]}
+
+        with self._lock:
+            latency = [sample for key, histogram in sorted(self.latency.items())
+                       for sample in histogram.samples(labels(key))]
+            requests = [('', dict(labels(key), status=key[2]), count) for key, count in sorted(self.requests.items())]
+            statements = [('', labels(key), count) for key, count in sorted(self.statements.items())]
+            db_seconds = [('', labels(key), round(value, 6)) for key, value in sorted(self.db_seconds.items())]
+            serialize_seconds = [('', labels(key), round(value, 6))
+                                 for key, value in sorted(self.serialize_seconds.items())]
+
+        return [
+            ('bookstore_http_request_duration_seconds', 'histogram', 'Latency of the requests per route.', latency),
+            ('bookstore_http_requests_total', 'counter', 'Requests per route and status.', requests),
+            ('bookstore_db_statements_total', 'counter', 'SQL statements executed per route.', statements),
+            ('bookstore_db_seconds_total', 'counter', 'Time spent in SQL statements per route.', db_seconds),
+            ('bookstore_serialization_seconds_total', 'counter',
+             'Time spent converting rows and encoding JSON per route.', serialize_seconds),
+        ]
+
+    def clear(self):
+        with self._lock:
+            for values in (self.latency, self.requests, self.statements, self.db_seconds, self.serialize_seconds):
+                values.clear()
+
+
+request_metrics = RequestMetrics()
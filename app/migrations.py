@@ -0,0 +1,230 @@
+"""
+Module Documentation: migrations.py
+
+This module upgrades databases created by earlier versions of the Bookstore API in place.
+
+Functions:
+- migrate_history_dates: Convert the history start_date/end_date columns from strings to dates.
+- add_book_copies: Add the copies/available_copies inventory columns to the books table.
+- add_updated_at: Add the updated_at change timestamp of incremental backups to the users, books and history tables.
+- drop_outdated_indexes: Drop indexes whose definition changed, so create_missing_indexes recreates them.
+- create_missing_indexes: Create the indexes declared on the models that do not exist yet.
+- rebuild_daily_revenue: Recompute the daily_revenue rollup from the rental history.
+- migrate_database: Run every migration, safe to run more than once.
+
+"""
+import logging
+
+from sqlalchemy import Column, Date, delete, func, insert, inspect, select, text, update
+
+from app.models import Book, DailyRevenue, RentedHistory
+
+
+def migrate_history_dates(db):
+    """
+    Convert the history start_date/end_date columns from strings to dates.
+
+    On PostgreSQL the column type is altered and existing 'YYYY-MM-DD' values are cast to dates.
+    SQLite stores dates as 'YYYY-MM-DD' strings already, so the rows only need empty strings cleared.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+
+    Returns:
+    - bool: True if rows or column types were changed, False if the table was already migrated.
+    """
+
+    columns = {column['name']: column['type'] for column in inspect(db.engine).get_columns('history')}
+
+    with db.engine.begin() as connection:
+        if db.engine.dialect.name == 'postgresql':
+            if all(isinstance(columns[name], Date) for name in ('start_date', 'end_date')):
+                return False
+
+            connection.execute(text(
+                "ALTER TABLE history "
+                "ALTER COLUMN start_date TYPE DATE USING NULLIF(start_date, '')::date, "
+                "ALTER COLUMN end_date TYPE DATE USING NULLIF(end_date, '')::date"
+            ))
+            logging.info('history dates migrated to DATE columns')
+            return True
+
+        result = connection.execute(text("UPDATE history SET end_date = NULL WHERE end_date = ''"))
+        return result.rowcount > 0
+
+
+def add_book_copies(db):
+    """
+    Add the copies/available_copies inventory columns to the books table, one copy per book.
+    Books that are rented out get no available copy.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+
+    Returns:
+    - bool: True if the columns were added, False if the table was already migrated.
+    """
+
+    columns = {column['name'] for column in inspect(db.engine).get_columns('books')}
+    if 'available_copies' in columns:
+        return False
+
+    with db.engine.begin() as connection:
+        if 'copies' not in columns:
+            connection.execute(text("ALTER TABLE books ADD COLUMN copies INTEGER NOT NULL DEFAULT 1"))
+        connection.execute(text("ALTER TABLE books ADD COLUMN available_copies INTEGER NOT NULL DEFAULT 1"))
+        connection.execute(update(Book).where(Book.isAvailable.is_(False)).values(available_copies=0))
+
+    logging.info('books inventory columns added')
+    return True
+
+
+def add_updated_at(db):
+    """
+    Add the updated_at change timestamp of incremental backups to the users, books and history tables.
+    Existing rows get the current time, so the next incremental backup contains them.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+
+    Returns:
+    - list: The names of the tables that got the column.
+    """
+
+    inspector = inspect(db.engine)
+    tables = [table for table in ('users', 'books', 'history')
+              if 'updated_at' not in {column['name'] for column in inspector.get_columns(table)}]
+
+    with db.engine.begin() as connection:
+        for table in tables:
+            # SQLite cannot add a column with a non-constant default, existing rows are filled separately
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP"))
+            connection.execute(text(f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP"))
+
+    if tables:
+        logging.info(f"updated_at added to {', '.join(tables)}")
+    return tables
+
+
+def drop_outdated_indexes(db):
+    """
+    Drop indexes whose columns differ from their declaration on the models, so create_missing_indexes
+    recreates them, e.g. ix_books_available_isbn on (isAvailable, isbn) before it became partial on isbn.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+
+    Returns:
+    - list: The names of the dropped indexes.
+    """
+
+    inspector = inspect(db.engine)
+    dropped = []
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            declared = {index.name: index for index in table.indexes}
+            for index in inspector.get_indexes(table.name):
+                model_index = declared.get(index['name'])
+                # Expression indexes (full text search) are not compared
+                if model_index is None or not all(isinstance(expression, Column)
+                                                  for expression in model_index.expressions):
+                    continue
+                if index['column_names'] != [column.name for column in model_index.columns]:
+                    model_index.drop(connection)
+                    dropped.append(index['name'])
+
+    for name in dropped:
+        logging.info(f'Index {name} dropped, its definition changed')
+    return dropped
+
+
+def create_missing_indexes(db):
+    """
+    Create the indexes declared on the models that do not exist yet.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+
+    Returns:
+    - list: The names of the created indexes.
+    """
+
+    def existing_indexes():
+        inspector = inspect(db.engine)
+        return {(table.name, index['name']) for table in db.metadata.sorted_tables
+                for index in inspector.get_indexes(table.name)}
+
+    before = existing_indexes()
+
+    with db.engine.begin() as connection:
+        if db.engine.dialect.name == 'postgresql':
+            # Trigram indexes of the search fallback
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if (table.name, index.name) not in before:
+                    # Indexes limited to another dialect are skipped by create()
+                    index.create(connection)
+
+    created = sorted(name for _, name in existing_indexes() - before)
+
+    if created:
+        logging.info(f"Indexes created: {', '.join(created)}")
+    return created
+
+
+def rebuild_daily_revenue(db):
+    """
+    Recompute the daily_revenue rollup from the rental history, one row per return day.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+
+    Returns:
+    - int: The number of days in the rollup.
+    """
+
+    closed_rentals = (select(RentedHistory.end_date,
+                             func.coalesce(func.sum(RentedHistory.total_cost), 0),
+                             func.count(RentedHistory.id))
+                      .where(RentedHistory.end_date.is_not(None))
+                      .group_by(RentedHistory.end_date))
+
+    with db.engine.begin() as connection:
+        connection.execute(delete(DailyRevenue))
+        result = connection.execute(insert(DailyRevenue).from_select(['day', 'revenue', 'rentals'], closed_rentals))
+
+    logging.info(f'daily_revenue rebuilt with {result.rowcount} days')
+    return result.rowcount
+
+
+def migrate_database(db):
+    """
+    Create missing tables, migrate the history dates, add the book inventory columns and the updated_at
+    timestamps, replace outdated indexes, create missing indexes and backfill the revenue rollup.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+
+    Returns:
+    - dict: What every step changed.
+    """
+
+    db.create_all()
+
+    changes = {
+        'history_dates': migrate_history_dates(db),
+        'book_copies': add_book_copies(db),
+        'updated_at': add_updated_at(db),
+        'outdated_indexes': drop_outdated_indexes(db),
+        'indexes': create_missing_indexes(db),
+        'daily_revenue': 0,
+    }
+
+    # Backfill the rollup the first time it is created
+    if not db.session.query(DailyRevenue.day).first():
+        changes['daily_revenue'] = rebuild_daily_revenue(db)
+
+    return changes
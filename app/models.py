@@ -9,14 +9,22 @@ Classes:
     including total cost, start and end dates, ISBN, and user ID.
 - Book: Represents book information,
     including ISBN, title, author, publication year, publisher,
-    image URLs, rented status, rating, and availability.
+    image URLs, rented status, rating, availability and the number of copies.
+- SeedVersion: Marks the version of the sample data seeded into the database.
+- DailyRevenue: Materialized rollup of the rental fees collected per return day.
+- IdempotencyKey: The stored response of a rent/return request sent with an Idempotency-Key header.
 
 """
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, String, cast, event, func, literal
+from sqlalchemy.dialects.postgresql import REGCONFIG
 from werkzeug.security import generate_password_hash, check_password_hash
 
-db = SQLAlchemy()
+from app.replica import RoutingSession
+
+# db.session sends the reads of replica routes to the 'replica' bind when one is configured
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class User(db.Model):
@@ -28,6 +36,10 @@ class User(db.Model):
     password = db.Column(db.String, nullable=False)
     isAdmin = db.Column(db.Boolean, default=False)
 
+    # Last change of the row, the watermark of incremental backups (see backup.py)
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now(), server_default=func.now(),
+                           index=True)
+
     def __init__(self, username, email, password):
         self.username = username
         self.email = email
@@ -43,16 +55,29 @@ class User(db.Model):
 
 class RentedHistory(db.Model):
     __tablename__ = 'history'
+    __table_args__ = (
+        # Open rental of a book (return_book) and open rentals for backups - partial, only rented books
+        db.Index('ix_history_open_isbn', 'isbn',
+                 postgresql_where=db.text('end_date IS NULL'), sqlite_where=db.text('end_date IS NULL')),
+        # Rentals of a user, open ones first (get_user_by_id)
+        db.Index('ix_history_user_end_date', 'user', 'end_date'),
+        # Rentals started within a period (get_all_rented_books_for_period)
+        db.Index('ix_history_start_end_date', 'start_date', 'end_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
     total_cost = db.Column(db.Float)
-    start_date = db.Column(db.String, nullable=False)
-    end_date = db.Column(db.String)  # change to date type
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date)
 
     isbn = db.Column(db.String, db.ForeignKey('books.isbn'), nullable=False)
     user = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
+    # Last change of the row, the watermark of incremental backups (see backup.py)
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now(), server_default=func.now(),
+                           index=True)
+
     # Define the relationships
     book = db.relationship('Book', backref='rented_histories', foreign_keys=[isbn])
     user_info = db.relationship('User', backref='rented_histories', foreign_keys=[user])
@@ -67,6 +92,19 @@ class RentedHistory(db.Model):
 
 class Book(db.Model):
     __tablename__ = 'books'
+    __table_args__ = (
+        # Keyset pagination of the listings - filter column first, then ISBN order
+        db.Index('ix_books_author_isbn', 'author', 'isbn'),
+        db.Index('ix_books_publisher_isbn', 'publisher', 'isbn'),
+        db.Index('ix_books_year_isbn', 'year_of_publication', 'isbn'),
+        # Available books by ISBN (/books) - partial, so it only holds the available books, and covering on
+        # PostgreSQL: the listing page is read from the index alone
+        db.Index('ix_books_available_isbn', 'isbn',
+                 postgresql_where=db.text('"isAvailable" = true'), sqlite_where=db.text('"isAvailable" = 1'),
+                 postgresql_include=['title', 'author', 'year_of_publication', 'publisher', 'image_url_s',
+                                     'image_url_m', 'image_url_l', 'rating', 'isAvailable', 'copies',
+                                     'available_copies']),
+    )
 
     isbn = db.Column(db.String, primary_key=True, nullable=False)
 
@@ -83,8 +121,17 @@ class Book(db.Model):
     rating = db.Column(db.Integer)
     isAvailable = db.Column(db.Boolean, default=True)
 
+    # Copies of the book in stock and copies not rented out. Rent and return change available_copies with a
+    # single UPDATE and keep isAvailable (available_copies > 0) in step.
+    copies = db.Column(db.Integer, nullable=False, default=1, server_default=db.text('1'))
+    available_copies = db.Column(db.Integer, nullable=False, default=1, server_default=db.text('1'))
+
+    # Last change of the row, the watermark of incremental backups (see backup.py)
+    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now(), server_default=func.now(),
+                           index=True)
+
     def __init__(self, isbn, title, author, year_of_publication, publisher,
-                 image_url_s, image_url_m, image_url_l, rented_now, rating, isAvailable=True):
+                 image_url_s, image_url_m, image_url_l, rented_now, rating, isAvailable=True, copies=1):
         self.isbn = isbn
         self.title = title
         self.author = author
@@ -96,3 +143,71 @@ class Book(db.Model):
         self.rented_now = rented_now
         self.rating = rating
         self.isAvailable = isAvailable
+        self.copies = copies
+        self.available_copies = copies if isAvailable else 0
+
+
+# Full text search document of a book (title, author and publisher). Built with || so the expression
+# is immutable and can be indexed.
+BOOK_SEARCH_DOCUMENT = func.to_tsvector(
+    cast(literal('simple', String), REGCONFIG),
+    func.coalesce(Book.title, '') + ' ' + func.coalesce(Book.author, '') + ' ' + func.coalesce(Book.publisher, ''),
+)
+
+# PostgreSQL only: GIN index for full text search and trigram indexes for the typo tolerant fallback
+db.Index('ix_books_search', BOOK_SEARCH_DOCUMENT, postgresql_using='gin').ddl_if(dialect='postgresql')
+db.Index('ix_books_title_trgm', Book.title, postgresql_using='gin',
+         postgresql_ops={'title': 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+db.Index('ix_books_author_trgm', Book.author, postgresql_using='gin',
+         postgresql_ops={'author': 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+db.Index('ix_books_publisher_trgm', Book.publisher, postgresql_using='gin',
+         postgresql_ops={'publisher': 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+
+event.listen(Book.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+class SeedVersion(db.Model):
+    __tablename__ = 'seed_version'
+
+    version = db.Column(db.Integer, primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False)
+
+    def __init__(self, version, applied_at):
+        self.version = version
+        self.applied_at = applied_at
+
+
+class DailyRevenue(db.Model):
+    __tablename__ = 'daily_revenue'
+
+    day = db.Column(db.Date, primary_key=True)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    rentals = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, day, revenue, rentals):
+        self.day = day
+        self.revenue = revenue
+        self.rentals = rentals
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+
+    key = db.Column(db.String(255), primary_key=True)
+    user = db.Column(db.Integer, primary_key=True)
+
+    # 'METHOD /path?query body-hash' of the first request, the key must not be reused for another one
+    request = db.Column(db.String, nullable=False)
+    # When the key was claimed, or taken over after the lease of an unfinished request expired
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    # Empty while the first request is still being processed
+    status_code = db.Column(db.Integer)
+    response = db.Column(db.Text)
+
+    def __init__(self, key, user, request, created_at):
+        self.key = key
+        self.user = user
+        self.request = request
+        self.created_at = created_at
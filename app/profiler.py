@@ -0,0 +1,286 @@
+"""
+Module Documentation: profiler.py
+
+This module profiles a sampled fraction of the requests in place, for hot-path analysis in production.
+
+The profiler is off by default and turned on by an admin through PUT /profiler. A profiled request registers its
+thread with a statistical sampler: a background thread reads the stack of every registered thread each
+PROFILE_INTERVAL seconds (sys._current_frames), so the request itself runs at full speed and only pays for two
+dictionary updates. Stacks are aggregated per route in the collapsed format ('frame;frame;frame count' lines)
+read by flamegraph.pl, speedscope and inferno, and the PROFILE_SLOWEST slowest profiled requests are kept with
+their own stacks. Turning the profiler off writes one '<route>.collapsed' file per route to PROFILE_DIR.
+
+State is per process: with several workers every worker profiles and reports its own requests.
+
+Functions:
+- collapse: The collapsed representation of a stack.
+
+Classes:
+- StackSampler: Samples the stacks of registered threads from a background thread.
+- RequestProfiler: Profiles sampled requests of a blueprint, per route.
+
+"""
+import heapq
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+PROFILE_DIR = 'profiles'
+
+# Seconds between two samples of a profiled thread
+PROFILE_INTERVAL = 0.005
+
+# Fraction of the requests profiled while the profiler is on
+PROFILE_SAMPLE_RATE = 0.1
+
+# Slowest profiled requests kept with their stacks
+PROFILE_SLOWEST = 20
+
+# Deepest stack recorded, deeper frames (closest to the root) are cut
+MAX_STACK_DEPTH = 128
+
+
+def collapse(frame):
+    """
+    The collapsed representation of a stack.
+
+    Parameters:
+    - frame: The innermost frame.
+
+    Returns:
+    - str: 'file:function' of every frame, outermost first, separated by ';'.
+    """
+
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        frames.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(frames))
+
+
+class StackSampler:
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.threads = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id: int):
+        # Sample the thread until stop is called
+        with self._lock:
+            self.threads[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def stop(self, thread_id: int):
+        """
+        Stop sampling a thread.
+
+        Parameters:
+        - thread_id (int): The id of the thread.
+
+        Returns:
+        - Counter: The number of samples of every collapsed stack of the thread.
+        """
+
+        with self._lock:
+            return self.threads.pop(thread_id, Counter())
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self.threads:
+                    # Cleared under the lock, so a thread registered meanwhile sets it again
+                    self._wakeup.clear()
+                else:
+                    frames = sys._current_frames()
+                    for thread_id, counts in self.threads.items():
+                        frame = frames.get(thread_id)
+                        if frame is not None and thread_id != own:
+                            counts[collapse(frame)] += 1
+            if not self._wakeup.is_set():
+                self._wakeup.wait()
+            else:
+                time.sleep(self.interval)
+
+
+class RequestProfiler:
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, interval: float = PROFILE_INTERVAL,
+                 slowest: int = PROFILE_SLOWEST, directory: str = PROFILE_DIR):
+        """
+        Parameters:
+        - sample_rate (float): The fraction of the requests profiled while the profiler is on.
+        - interval (float): Seconds between two samples of a profiled request.
+        - slowest (int): The number of slowest profiled requests kept.
+        - directory (str): The folder of the collapsed stack files.
+        """
+        self.enabled = False
+        self.sample_rate = sample_rate
+        self.routes = None
+        self.max_slowest = slowest
+        self.directory = directory
+        self.sampler = StackSampler(interval)
+        self.stacks = {}
+        self.requests = Counter()
+        self.slowest = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Settings of the optional [Profiler] section of config.ini, see AppConfig.configure_app
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', self.sample_rate)
+        self.sampler.interval = app.config.get('PROFILE_INTERVAL', self.sampler.interval)
+        self.max_slowest = app.config.get('PROFILE_SLOWEST', self.max_slowest)
+        self.directory = app.config.get('PROFILE_DIR', self.directory)
+
+    def init_blueprint(self, blueprint):
+        # Sampling stops on teardown, which runs even when the view or an after_request hook raised
+        blueprint.before_request(self.start)
+        blueprint.after_request(self.record_status)
+        blueprint.teardown_request(self.finish)
+
+    def configure(self, enabled: bool, sample_rate: float = None, routes: list = None):
+        """
+        Turn the profiler on or off. Turning it off writes the collapsed stacks of every route.
+
+        Parameters:
+        - enabled (bool): Profile requests from now on.
+        - sample_rate (float): The fraction of the requests profiled (default is None to keep the current one).
+        - routes (list): Only profile these routes, e.g. ['/books'] (default is None for every route).
+
+        Returns:
+        - list: The files written when the profiler was turned off, else an empty list.
+        """
+
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if enabled:
+            self.routes = set(routes) if routes else None
+        was_enabled, self.enabled = self.enabled, enabled
+        return self.write() if was_enabled and not enabled else []
+
+    def start(self):
+        if not self.enabled or request.url_rule is None:
+            return
+        if self.routes is not None and request.url_rule.rule not in self.routes:
+            return
+        if random.random() >= self.sample_rate:
+            return
+
+        g.profile_started = time.perf_counter()
+        self.sampler.start(threading.get_ident())
+
+    def record_status(self, response):
+        if 'profile_started' in g:
+            g.profile_status = response.status_code
+        return response
+
+    def finish(self, exception=None):
+        started = g.pop('profile_started', None)
+        if started is None:
+            return
+
+        counts = self.sampler.stop(threading.get_ident())
+        duration = time.perf_counter() - started
+        # Requests ending in an unhandled exception never got a response
+        status = g.pop('profile_status', None) if exception is None else None
+        route = request.url_rule.rule
+        profile = {
+            'id': uuid.uuid4().hex,
+            'route': route,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': status if status is not None else 500,
+            'duration_ms': round(duration * 1000, 3),
+            'samples': sum(counts.values()),
+            'time': datetime.now().isoformat(),
+            'stacks': counts,
+        }
+
+        with self._lock:
+            self.stacks.setdefault(route, Counter()).update(counts)
+            self.requests[route] += 1
+            # Min-heap of the slowest requests: a faster request than all kept ones is not kept
+            entry = (duration, profile['id'], profile)
+            if len(self.slowest) < self.max_slowest:
+                heapq.heappush(self.slowest, entry)
+            elif duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def collapsed(self, route: str = None, profile_id: str = None):
+        """
+        The collapsed stacks of a route or of one of the slowest requests, flamegraph-ready.
+
+        Parameters:
+        - route (str): The route, e.g. '/books'.
+        - profile_id (str): The id of one of the slowest requests.
+
+        Returns:
+        - str or None: One 'stack count' line per stack, or None if there is no such route or request.
+        """
+
+        with self._lock:
+            if profile_id is not None:
+                counts = next((profile['stacks'] for _, _, profile in self.slowest if profile['id'] == profile_id),
+                              None)
+            else:
+                counts = self.stacks.get(route)
+            if counts is None:
+                return None
+            return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+
+    def write(self):
+        """
+        Write the collapsed stacks of every profiled route to '<directory>/<route>.collapsed'.
+
+        Returns:
+        - list: The paths of the files.
+        """
+
+        with self._lock:
+            routes = list(self.stacks)
+
+        os.makedirs(self.directory, exist_ok=True)
+        paths = []
+        for route in routes:
+            name = route.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'index'
+            path = os.path.join(self.directory, f'{name}.collapsed')
+            with open(path, 'w') as file:
+                file.write(self.collapsed(route))
+            paths.append(path)
+        return paths
+
+    def status(self):
+        with self._lock:
+            slowest = [{key: value for key, value in profile.items() if key != 'stacks'}
+                       for _, _, profile in sorted(self.slowest, reverse=True)]
+            return {
+                'enabled': self.enabled,
+                'sample_rate': self.sample_rate,
+                'routes': sorted(self.routes) if self.routes else None,
+                'profiled': dict(self.requests),
+                'samples': {route: sum(counts.values()) for route, counts in self.stacks.items()},
+                'slowest': slowest,
+            }
+
+    def clear(self):
+        with self._lock:
+            self.stacks.clear()
+            self.requests.clear()
+            self.slowest.clear()
+
+
+request_profiler = RequestProfiler()
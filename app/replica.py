@@ -0,0 +1,186 @@
+"""
+Module Documentation: replica.py
+
+This module routes the read-only queries of the catalog and reporting routes to a read replica.
+
+The replica is the 'replica' bind (SQLALCHEMY_BINDS, from replica_db_string in config.ini). Routes and service
+methods decorated with read_replica.reads send their SELECT statements to it; everything else, and every
+statement of a transaction that already wrote, goes to the primary database.
+
+A replica lags behind the primary, so after a user commits a write their reads stay on the primary for
+REPLICA_STICKINESS seconds (read-your-writes). Cached responses built from the replica within that window
+expire when the window does.
+
+Classes:
+- RoutingSession: The db.session class, choosing the primary or the replica per statement.
+- ReadReplica: The route decorator and the stickiness bookkeeping.
+
+"""
+import inspect
+import time
+from functools import wraps
+
+import jwt
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy import Select, UpdateBase
+
+from app.cache import TTLCache
+
+REPLICA_BIND = 'replica'
+
+
+def is_read(clause):
+    # Plain SELECTs only, SELECT ... FOR UPDATE locks rows on the primary
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            # Reads of a transaction that wrote must see its own changes
+            self.info['wrote'] = True
+        elif (bind is None and is_read(clause) and not self.info.get('wrote')
+              and has_app_context() and g.get('read_replica')):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                g.replica_used = True
+                return replica
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _committed(session):
+    if session.info.pop('wrote', False):
+        user = g.get('user') if has_app_context() else None
+        read_replica.wrote(user['id'] if user else None)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('wrote', None)
+
+
+class ReadReplica:
+
+    def __init__(self, stickiness: float = 5, maxsize: int = 65536, clock=time.monotonic):
+        """
+        Parameters:
+        - stickiness (float): Seconds a user's reads stay on the primary after they wrote.
+        - maxsize (int): The maximum number of users tracked at once.
+        - clock (callable): The time source, in seconds (default is time.monotonic).
+        """
+        self.stickiness = stickiness
+        self.clock = clock
+        self.writers = TTLCache(maxsize=maxsize, clock=clock)
+        self.last_write = float('-inf')
+
+    def init_app(self, app):
+        # Setting of the [Database] section of config.ini, see AppConfig.configure_app
+        self.stickiness = app.config.get('REPLICA_STICKINESS', self.stickiness)
+
+    def reads(self, f):
+        """
+        Decorator sending the SELECT statements of a route or service method to the replica, unless the
+        requesting user wrote within the stickiness window. Generators read from the replica while they are iterated.
+        """
+
+        if inspect.isgeneratorfunction(f):
+            @wraps(f)
+            def generator(*args, **kwargs):
+                if not self.configured() or g.get('read_replica') is not None:
+                    yield from f(*args, **kwargs)
+                    return
+
+                g.read_replica = not self.is_sticky(self.current_user())
+                try:
+                    yield from f(*args, **kwargs)
+                finally:
+                    g.pop('read_replica', None)
+                    g.pop('replica_used', None)
+
+            return generator
+
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            # Nested calls (a decorated service method in a decorated route) keep the outer choice
+            if not self.configured() or g.get('read_replica') is not None:
+                return f(*args, **kwargs)
+
+            g.read_replica = not self.is_sticky(self.current_user())
+            streamed = False
+            try:
+                result = f(*args, **kwargs)
+                # A streamed response runs its queries after the route returned, within the same context
+                streamed = getattr(result, 'is_streamed', False)
+                return result
+            finally:
+                if not streamed:
+                    g.pop('read_replica', None)
+                    g.pop('replica_used', None)
+
+        return decorated
+
+    @staticmethod
+    def configured():
+        return has_app_context() and REPLICA_BIND in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+
+    @staticmethod
+    def current_user():
+        # The id of the requesting user, or None for anonymous requests
+        user = g.get('user')
+        if user is not None:
+            return user['id']
+
+        token = request.headers.get('x-access-token') if has_request_context() else None
+        if not token:
+            return None
+
+        from app.utilities import authenticate
+
+        try:
+            return authenticate(token)['id']
+        except jwt.InvalidTokenError:
+            return None
+
+    def wrote(self, user_id=None):
+        """
+        Record a committed write, keeping the user's reads on the primary for the stickiness window.
+
+        Parameters:
+        - user_id (int): The user who wrote, or None if unknown.
+        """
+
+        self.last_write = self.clock()
+        if user_id is not None:
+            self.writers.set(user_id, True, ttl=self.stickiness)
+
+    def is_sticky(self, user_id):
+        return user_id is not None and self.writers.get(user_id) is not None
+
+    def cache_ttl(self, ttl: float):
+        """
+        The time to live of a response cached by the current request. Responses read from the replica
+        within the stickiness window of a write may be stale, so they expire when the window does.
+
+        Parameters:
+        - ttl (float): The configured time to live.
+
+        Returns:
+        - float: The time to live to use.
+        """
+
+        remaining = self.stickiness - (self.clock() - self.last_write)
+        if not g.get('replica_used') or remaining <= 0:
+            return ttl
+        return min(ttl, remaining)
+
+    def pinned(self):
+        # The current request must read from the primary (the user wrote recently)
+        return g.get('read_replica') is False
+
+
+read_replica = ReadReplica()
@@ -0,0 +1,217 @@
+"""
+Module Documentation: request_log.py
+
+This module sets up the application logging and writes one structured record per request.
+
+Request threads never write to disk: the root logger only puts records on a bounded in-memory queue
+(QueueHandler), and a single QueueListener thread formats them as JSON lines and writes them to a rotating log file.
+When the queue is full the record is dropped and counted instead of blocking the request.
+
+Every request is logged as a JSON record with its method, route, status, latency and user id. Successful GET and
+HEAD requests are the bulk of the traffic; they are sampled at LOG_SAMPLE_RATE (the rate is part of the record),
+while writes and errors are always logged.
+
+Settings (optional [Logging] section of config.ini, see AppConfig.configure_app):
+- file: The log file, relative to the project folder (default is 'db.log').
+- level: The minimum level of the records (default is INFO).
+- rotation: 'size' to rotate at max_bytes, or 'time' to rotate at 'when' (default is 'size').
+- max_bytes, backups, when: Size limit, number of rotated files kept and rotation time.
+- sample_rate: The fraction of the successful GET requests logged (default is 1.0).
+- queue_size: The number of records waiting to be written before new ones are dropped.
+
+Functions:
+- configure_logging: Route the root logger through the queue to the log file.
+
+Classes:
+- JSONFormatter: Formats records as one JSON object per line.
+- DroppingQueueHandler: QueueHandler that never blocks.
+- SamplingFilter: Samples the records of successful GET requests.
+- RequestLog: Flask extension logging every request.
+
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from flask import g, request
+
+from app.serialization import dumps
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOG_FILE = 'db.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+LOG_WHEN = 'midnight'
+LOG_QUEUE_SIZE = 10000
+LOG_SAMPLE_RATE = 1.0
+
+# Methods of the high volume routes whose successful requests are sampled
+SAMPLED_METHODS = ('GET', 'HEAD')
+
+# Logger of the per-request records
+logger = logging.getLogger('bookstore.requests')
+
+
+class JSONFormatter(logging.Formatter):
+    # One JSON object per line; runs in the listener thread, not in the request
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'source': f'{record.filename}:{record.lineno}',
+        }
+        if getattr(record, 'request', None):
+            entry.update(record.request)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return dumps(entry).decode()
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Puts records on the queue without waiting; the listener thread formats them
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The queue stays in this process, the record does not need to be formatted or copied for pickling
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        fields = getattr(record, 'request', None)
+        if not fields or self.rate >= 1:
+            return True
+        if fields['method'] not in SAMPLED_METHODS or fields['status'] >= 400:
+            return True
+        return random.random() < self.rate
+
+
+class _Listener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # Stopping waits for the records still on the queue, unlike put_nowait on a full queue
+        self.queue.put(self._sentinel)
+
+
+_pipeline = {}
+
+
+def _stop():
+    listener = _pipeline.pop('listener', None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    handler = _pipeline.pop('handler', None)
+    if handler is not None:
+        logging.getLogger().removeHandler(handler)
+
+
+def configure_logging(settings: dict):
+    """
+    Route the root logger through a queue to the rotating log file. Calling it again replaces the previous setup.
+
+    Parameters:
+    - settings (dict): The LOG_* settings of the app config (file, level, rotation, max_bytes, backups, when,
+      sample_rate, queue_size).
+
+    Returns:
+    - DroppingQueueHandler: The handler of the root logger, with the number of dropped records.
+    """
+
+    _stop()
+
+    path = settings.get('LOG_FILE') or LOG_FILE
+    if not os.path.isabs(path):
+        path = os.path.join(ROOT, path)
+
+    if settings.get('LOG_ROTATION', 'size') == 'time':
+        file_handler = TimedRotatingFileHandler(path, when=settings.get('LOG_WHEN', LOG_WHEN),
+                                                backupCount=settings.get('LOG_BACKUPS', LOG_BACKUPS), delay=True)
+    else:
+        file_handler = RotatingFileHandler(path, maxBytes=settings.get('LOG_MAX_BYTES', LOG_MAX_BYTES),
+                                           backupCount=settings.get('LOG_BACKUPS', LOG_BACKUPS), delay=True)
+    file_handler.setFormatter(JSONFormatter())
+
+    handler = DroppingQueueHandler(queue.Queue(maxsize=settings.get('LOG_QUEUE_SIZE', LOG_QUEUE_SIZE)))
+    handler.addFilter(SamplingFilter(settings.get('LOG_SAMPLE_RATE', LOG_SAMPLE_RATE)))
+
+    root = logging.getLogger()
+    root.setLevel(settings.get('LOG_LEVEL', 'INFO'))
+    root.addHandler(handler)
+
+    listener = _Listener(handler.queue, file_handler)
+    listener.start()
+    _pipeline.update(listener=listener, handler=handler)
+    return handler
+
+
+atexit.register(_stop)
+
+
+class RequestLog:
+
+    def __init__(self):
+        self.handler = None
+
+    def init_app(self, app):
+        # Logging is set up once per process, by the last app created
+        self.handler = configure_logging(app.config)
+        app.before_request(self._start)
+        app.after_request(self._log)
+
+    @staticmethod
+    def _start():
+        g.request_started = time.perf_counter()
+
+    def _log(self, response):
+        if not logger.isEnabledFor(logging.INFO):
+            return response
+
+        started = g.get('request_started')
+        user = g.get('user')
+        fields = {
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else request.path,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'latency_ms': round((time.perf_counter() - started) * 1000, 3) if started else None,
+            'user_id': user['id'] if user else None,
+            'remote_addr': request.remote_addr,
+        }
+        sampling = self.handler.filters[0] if self.handler else None
+        if sampling is not None and fields['method'] in SAMPLED_METHODS and sampling.rate < 1:
+            fields['sample_rate'] = sampling.rate
+
+        logger.info('request', extra={'request': fields})
+        return response
+
+    def dropped(self):
+        # Records dropped because the log queue was full
+        return self.handler.dropped if self.handler else 0
+
+
+request_log = RequestLog()
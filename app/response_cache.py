@@ -0,0 +1,207 @@
+"""
+Module Documentation: response_cache.py
+
+This module provides a read-through cache for the JSON responses of the catalog lookup routes.
+
+Cached responses are grouped by tag (e.g. 'book:042511774X' or 'author:Amy Tan'). Every tag has a generation
+number that is part of the cache key, so invalidating a tag is a single increment and stale entries simply stop
+being read. Every key also holds the generation of the CATALOG_TAG, which catalog loads bump to make every cached
+response stale at once, and the negotiated media type, so a response is only served to clients accepting it
+(responses carry 'Vary: Accept'). With a read replica, responses read from it shortly after a write are kept only until the replica
+caught up (see replica.py). Responses carry an ETag and conditional requests with a matching If-None-Match get a 304.
+
+Classes:
+- LocalCacheBackend: In-process LRU cache with TTL (the default).
+- RedisCacheBackend: Shared backend for any client with the redis-py get/set/incr interface.
+- ResponseCache: The route decorator, invalidation and hit/miss counters.
+
+"""
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+
+from flask import Response, request
+
+from app.cache import TTLCache
+from app.replica import read_replica
+
+
+# Tag of every cached response, bumped when the whole catalog changes (e.g. a bulk load)
+CATALOG_TAG = 'books'
+
+
+class LocalCacheBackend:
+
+    def __init__(self, maxsize: int = 4096, clock=time.monotonic):
+        self.entries = TTLCache(maxsize=maxsize, clock=clock)
+        self.clock = clock
+        # tag: (generation, time of the last increment)
+        self.generations = {}
+        self._max_ttl = 0.0
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value, ttl: float):
+        self._max_ttl = max(self._max_ttl, ttl)
+        self.entries.set(key, value, ttl=ttl)
+
+    def generation(self, tag: str):
+        return self.generations.get(tag, (0,))[0]
+
+    def incr(self, tag: str):
+        now = self.clock()
+        with self._lock:
+            self.generations[tag] = (self.generation(tag) + 1, now)
+            if now >= self._next_prune:
+                self._prune(now)
+
+    def _prune(self, now: float):
+        # Entries keyed with the generations of a tag not bumped for longer than the longest TTL have expired,
+        # so the tag can restart from 0. Twice the TTL covers entries computed before an increment and stored after.
+        horizon = 2 * self._max_ttl
+        self.generations = {tag: value for tag, value in self.generations.items() if now - value[1] <= horizon}
+        self._next_prune = now + horizon
+
+    def clear(self):
+        self.entries.clear()
+        with self._lock:
+            self.generations.clear()
+
+
+class RedisCacheBackend:
+
+    def __init__(self, client, prefix: str = 'bookstore:'):
+        """
+        Parameters:
+        - client: A redis.Redis instance, or any object with the same get/set/incr/delete/scan_iter methods.
+        - prefix (str): Prefix of every key written by the cache.
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl: float):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    def generation(self, tag: str):
+        return int(self.client.get(f'{self.prefix}generation:{tag}') or 0)
+
+    def incr(self, tag: str):
+        self.client.incr(f'{self.prefix}generation:{tag}')
+
+    def clear(self):
+        for key in self.client.scan_iter(f'{self.prefix}*'):
+            self.client.delete(key)
+
+
+class ResponseCache:
+
+    def __init__(self, backend=None, ttl: float = 300):
+        self.backend = backend or LocalCacheBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Settings from the optional [Cache] section of config.ini, see AppConfig.configure_app
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        backend = app.config.get('RESPONSE_CACHE_BACKEND')
+        if backend is not None:
+            self.backend = backend
+
+    def cached(self, tag):
+        """
+        Decorator caching the successful JSON responses of a route.
+
+        Parameters:
+        - tag (callable): Builds the invalidation tag from the route arguments, e.g. lambda author: f'author:{author}'.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def decorated(*args, **kwargs):
+                # Users reading their own writes from the primary skip the cache
+                if read_replica.pinned():
+                    return view(*args, **kwargs)
+
+                view_tag = tag(*args, **kwargs)
+                key = (f'response:{view_tag}:{self.backend.generation(view_tag)}:'
+                       f'{self.backend.generation(CATALOG_TAG)}:{request.accept_mimetypes.best or "*/*"}:'
+                       f'{request.full_path}')
+
+                entry = self.backend.get(key)
+                self._count(entry is not None)
+                if entry is not None:
+                    response = Response(entry['body'], status=200, mimetype=entry['mimetype'])
+                    return self._conditional(response, entry['etag'], 'HIT')
+
+                response = view(*args, **kwargs)
+                response.vary.add('Accept')
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+
+                body = response.get_data(as_text=True)
+                entry = {'body': body, 'mimetype': response.mimetype,
+                         'etag': hashlib.sha1(body.encode()).hexdigest()}
+                self.backend.set(key, entry, read_replica.cache_ttl(self.ttl))
+
+                return self._conditional(response, entry['etag'], 'MISS')
+
+            return decorated
+
+        return decorator
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @staticmethod
+    def _conditional(response, etag: str, status: str):
+        response.vary.add('Accept')
+        response.set_etag(etag)
+        response.headers['X-Cache'] = status
+        return response.make_conditional(request)
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.incr(tag)
+
+    @staticmethod
+    def book_tags(book):
+        # Tags of every cached response that may contain the book
+        return (f'book:{book.isbn}',
+                f'author:{book.author}',
+                f'publisher:{book.publisher}',
+                f'date:{book.year_of_publication}')
+
+    def invalidate_catalog(self):
+        # Every cached response may be stale after a catalog load. With the local backend only the cache of the
+        # current process is invalidated, other processes serve their entries until the TTL expires.
+        self.invalidate(CATALOG_TAG)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+response_cache = ResponseCache()
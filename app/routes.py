@@ -9,82 +9,239 @@ Routes:
 3. /book/<id> (GET) : Retrieve detailed information about a specific book.
 ... (other routes)
 
+Book listings (/books, /author, /publisher, /date) are paginated by ISBN. They accept the url arguments
+'limit' (capped at MAX_PAGE_SIZE) and 'cursor' (the 'next' value of the previous page).
+With 'format=ndjson' (or an 'Accept: application/x-ndjson' header) the whole listing is streamed instead,
+one JSON book per line.
+
+/book, /author, /publisher and /date responses are cached (see response_cache.py) with ETag support.
+
+/search?q= ranks books by title, author and publisher (PostgreSQL full text search with a trigram fallback
+for typos). It is paginated like the listings and accepts the filters author, publisher, year and available.
+
+Books have several copies (PUT /book/<id>/copies); a book is available while a copy is not rented out.
+/return/<id> returns the longest open rental of the book, or the one of '?user=<id>'.
+
+/rent/batch and /return/batch take a JSON body {"isbns": [...]} and process the whole cart in one transaction,
+answering with one result per ISBN.
+
+/rent and /return accept an 'Idempotency-Key' header: retries with the same key get the stored response
+instead of renting or returning the book again (see idempotency.py).
+
+The catalog routes and the reports read from the read replica when one is configured (see replica.py).
+
+/metrics exposes the connection pool (checkouts, wait time, overflow) and per-route latency histograms, SQL statement
+counts, SQL time and serialization time in the Prometheus text format. In debug mode (or with SERVER_TIMING) every
+response carries them in a Server-Timing header.
+
+/rentals and /revenue stream the report as CSV with 'format=csv' (or 'Accept: text/csv'). With 'export=true' they
+queue a background CSV export instead and answer 202, the status of the job is served by /exports/<job_id>.
+'format=parquet' and 'format=arrow' queue a columnar export (requires pyarrow), the /rentals one partitioned by
+the start date of the rentals.
+
+/revenue accepts 'group_by' (day, week, month, author or publisher) for a breakdown instead of the total. The total
+is the sum of the fees of the rentals returned in the period (before, of the rentals started in it).
+
+/profiler (admin) turns the sampling profiler on and off and lists the slowest profiled requests (see profiler.py);
+/profiler/stacks returns the collapsed stacks of a route (?route=/books) or of a request (?id=<id>).
+
 """
 
-from flask import request, Blueprint
+import os
+
+from flask import request, Blueprint, Response, send_file, send_from_directory, url_for
 from app.utilities import *
 from app.models import db
-from app.controllers import bookController, userController, historyController
+from app.controllers import bookController, userController, historyController, searchController
+from app.response_cache import response_cache
+from app.replica import read_replica
+from app.exports import COLUMNAR_FORMATS, EXPORT_FORMATS, columnar_available, export_jobs
+from app.idempotency import idempotent
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, pool_metrics, render_metrics, request_metrics
+from app.profiler import request_profiler
 
 main_app = Blueprint('main', __name__)
 
+# Per-route latency, SQL and serialization metrics of every request, served by /metrics
+request_metrics.init_blueprint(main_app)
+# Sampled in-place profiling of the requests, off until an admin turns it on with PUT /profiler
+request_profiler.init_blueprint(main_app)
+
 BookService = bookController.BookService()
 HistoryService = historyController.HistoryService()
 UserService = userController.UserService()
+SearchService = searchController.SearchService()
+
+
+def list_books(filters: dict):
+    # Shared by the book listing routes - one page, or the full listing streamed as NDJSON
+    try:
+        after, limit = get_page_args(request.args)
+    except ValueError as e:
+        return send_response(str(e), 400)
 
+    if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+        return send_ndjson_stream(BookService.stream_books(filters, after, request.args.get('limit', type=int)))
 
-# Custom middleware to log requests
-@main_app.before_request
-def log_request_info():
-    # Log information about the incoming request
-    logging.info(f'New request : {request.url} from {request.remote_addr}.')
+    data, next_isbn = BookService.get_books_page(filters, after, limit)
+    return send_response(data, next_cursor=encode_cursor(next_isbn) if next_isbn else None)
 
 
 # Retrieve a list of all available books
 @main_app.route('/books', methods=['GET'])
+@read_replica.reads
 def get_all_books():
-    data = BookService.get_all_books()
-    return send_response(data)
+    return list_books(bookController.AVAILABLE_BOOKS)
 
 
 # Retrieve a list of available books based on a specified category.
 @main_app.route('/author/<author>', methods=['GET'])
+@read_replica.reads
+@response_cache.cached(lambda author: f'author:{author}')
 def get_books_by_author(author):
-    data = BookService.get_book_by_identifier('author', author)
-    return send_response(data)
+    return list_books({'author': author})
 
 
 # Retrieve detailed information about a specific book.
 @main_app.route('/book/<id>', methods=['GET'])
+@read_replica.reads
+@response_cache.cached(lambda id: f'book:{id}')
 def get_books_by_id(id):
     data = BookService.get_book_by_identifier('isbn', id)
     return send_response(data)
 
 
+# Change the number of copies of a book in stock.
+@main_app.route('/book/<id>/copies', methods=['PUT'])
+@token_required
+def set_book_copies(user, id):
+    if not user['isAdmin']:
+        return send_response("Oops you do not have the permission to access this resource.", 403)
+
+    data = request.get_json(silent=True) or {}
+    # bool is an int subclass: {"copies": true} is not a number of copies
+    if not isinstance(data.get('copies'), int) or isinstance(data['copies'], bool):
+        return send_response("Please provide the number of copies", 400)
+
+    return BookService.set_copies(db, id, data['copies'])
+
+
 # Retrieve a list of available books that was released by a specific publisher
 @main_app.route('/publisher/<publisher>', methods=['GET'])
+@read_replica.reads
+@response_cache.cached(lambda publisher: f'publisher:{publisher}')
 def get_books_by_publisher(publisher):
-    data = BookService.get_book_by_identifier('publisher', publisher)
-    return send_response(data)
+    return list_books({'publisher': publisher})
 
 
 # Retrieve a list of available books that was released on a specific year
 @main_app.route('/date/<date>', methods=['GET'])
+@read_replica.reads
+@response_cache.cached(lambda date: f'date:{date}')
 def get_books_by_date(date):
-    data = BookService.get_book_by_identifier('year_of_publication', date)
-    return send_response(data)
+    return list_books({'year_of_publication': date})
+
+
+# Search books by title, author and publisher, best match first.
+@main_app.route('/search', methods=['GET'])
+@read_replica.reads
+def search_books():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return send_response("Please provide a search query", 400)
+
+    try:
+        offset, limit = get_page_args(request.args, cursor_key='offset')
+        filters = {name: request.args[name] for name in searchController.SEARCH_FILTERS if name in request.args}
+        data, next_offset = SearchService.search(query, filters, offset or 0, limit)
+    except ValueError as e:
+        return send_response(str(e), 400)
+
+    return send_response(data, next_cursor=encode_cursor(next_offset, 'offset') if next_offset else None)
 
 
 # Rent a book, making it unavailable for others to rent.
 @main_app.route('/rent/<book_id>', methods=['POST'])
 @token_required
+@idempotent
 def set_book_as_rented(user, book_id):
     return BookService.rent_book(db, user['id'], book_id)
 
 
+# Rent a cart of books in one transaction, with one result per book.
+@main_app.route('/rent/batch', methods=['POST'])
+@token_required
+@idempotent
+def rent_books(user):
+    book_ids = get_batch(request.get_json(silent=True))
+    if book_ids is None or not all(isinstance(book_id, str) for book_id in book_ids):
+        return send_response(f"Please provide a list of at most {MAX_BATCH_SIZE} ISBNs as 'isbns'", 400)
+
+    return BookService.rent_books(db, user['id'], book_ids)
+
+
 # Return a rented book and calculate the rental fee based on the number of days rented.
 @main_app.route('/return/<book_id>', methods=['PUT'])
 @token_required
+@idempotent
 def get_rented_book(user, book_id):
     if not user['isAdmin']:
         return send_response("Oops you do not have the permission to access this resource.", 403)
 
-    return HistoryService.return_book(db, book_id)
+    # A title can be rented by several users, 'user' picks whose copy is returned
+    return HistoryService.return_book(db, book_id, request.args.get('user', type=int))
+
+
+# Return a cart of books in one transaction, with the rental fee of every book.
+@main_app.route('/return/batch', methods=['PUT'])
+@token_required
+@idempotent
+def return_books(user):
+    if not user['isAdmin']:
+        return send_response("Oops you do not have the permission to access this resource.", 403)
+
+    # Items are ISBNs, or {"isbn": ..., "user": ...} to return the copy of a specific user
+    items = get_return_batch(request.get_json(silent=True))
+    if items is None:
+        return send_response(f"Please provide a list of at most {MAX_BATCH_SIZE} ISBNs as 'isbns'", 400)
+
+    return HistoryService.return_books(db, items)
+
+
+def report_format():
+    # The reports are CSV streamed to the client with format=csv or 'Accept: text/csv', JSON otherwise
+    if request.args.get('format') in COLUMNAR_FORMATS:
+        return False
+    return request.args.get('format') == 'csv' or request.accept_mimetypes.best == 'text/csv'
+
+
+def export_format():
+    # The file format of a queued export: format=parquet or format=arrow, CSV with export=true, None otherwise
+    fmt = request.args.get('format')
+    if fmt in COLUMNAR_FORMATS:
+        return fmt
+    return 'csv' if request.args.get('export') == 'true' else None
+
+
+def queue_export(filename: str, period: tuple, rows, fieldnames: list = None, **options):
+    # Accepted background export of a report, its status is served by /exports/<job_id>. The file name carries the
+    # date range, so exports of other ranges on the same day get their own file.
+    fmt = export_format()
+    if fmt in COLUMNAR_FORMATS and not columnar_available():
+        return send_response("Parquet and Arrow exports require the 'pyarrow' package", 501)
+
+    start_date, end_date = period
+    job = export_jobs.submit(filename, rows, fieldnames, fmt, key=f'{start_date}_{end_date}', **options)
+    response = send_response(job, 202)
+    response.headers['X-Export-Job'] = job['id']
+    response.headers['Location'] = url_for('main.get_export', job_id=job['id'])
+    return response
 
 
 # Retrieve a list of books that were rented within a specified date range.    
 @main_app.route('/rentals', methods=['GET'])
 @token_required
+@read_replica.reads
 def get_rentals(user):
     valid_dates = is_date_args_valid(request.args)
 
@@ -94,11 +251,26 @@ def get_rentals(user):
     if not user['isAdmin']:
         return send_response("Oops you do not have the permission to access this resource.", 403)
 
-    start_date, end_date = valid_dates
+    try:
+        start_date, end_date = (to_date(value) for value in valid_dates)
+    except ValueError:
+        return send_response("Please provide valid dates", 400)
+
+    if report_format():
+        return send_csv_stream(HistoryService.stream_rented_books(start_date, end_date), "Rentals",
+                               historyController.RENTAL_FIELDS)
 
-    data = HistoryService.get_all_rented_books_for_period(start_date, end_date, 'list')
+    if export_format() in COLUMNAR_FORMATS:
+        return queue_export("Rentals", (start_date, end_date),
+                            lambda: HistoryService.stream_rented_books(start_date, end_date, dated=True),
+                            columns=historyController.DATED_RENTAL_COLUMNS, partition_by='start_date')
+
+    if export_format():
+        return queue_export("Rentals", (start_date, end_date),
+                            lambda: HistoryService.stream_rented_books(start_date, end_date),
+                            historyController.RENTAL_FIELDS)
 
-    export_to_csv(data, "Rentals")
+    data = HistoryService.get_all_rented_books_for_period(start_date, end_date, 'list')
 
     return send_response(data)
 
@@ -106,6 +278,7 @@ def get_rentals(user):
 # Calculate and retrieve the total revenue generated by book rentals within a specified date range.
 @main_app.route('/revenue', methods=['GET'])
 @token_required
+@read_replica.reads
 def get_total_revenue(user):
     valid_dates = is_date_args_valid(request.args)
 
@@ -115,14 +288,65 @@ def get_total_revenue(user):
     if not user['isAdmin']:
         return send_response("Oops you do not have the permission to access this resource.", 403)
 
-    start_date, end_date = valid_dates
+    try:
+        start_date, end_date = (to_date(value) for value in valid_dates)
+    except ValueError:
+        return send_response("Please provide valid dates", 400)
 
-    # Calculate total revenue for this specific range
-    data = HistoryService.calculate_total_rental_fee(start_date, end_date)
+    group_by = request.args.get('group_by')
 
-    export_to_csv(data, "TotalRevenue")
+    if group_by and group_by not in historyController.REVENUE_GROUPS:
+        return send_response(f"group_by must be one of: {', '.join(historyController.REVENUE_GROUPS)}", 400)
 
-    return send_response(data)
+    if not group_by:
+        # Total revenue for this specific range
+        filename, fieldnames = "TotalRevenue", ['total_revenue']
+        rows = lambda: [{'total_revenue': HistoryService.calculate_total_rental_fee(start_date, end_date)}]
+    else:
+        # Revenue of the range broken down by day, week, month, author or publisher
+        filename, fieldnames = f"RevenueBy{group_by.capitalize()}", [group_by, 'revenue', 'rentals']
+        rows = lambda: HistoryService.calculate_revenue_breakdown(start_date, end_date, group_by)
+
+    if report_format():
+        return send_csv_stream(rows(), filename, fieldnames)
+
+    if export_format():
+        return queue_export(filename, (start_date, end_date), rows, fieldnames)
+
+    data = rows()
+    return send_response(data if group_by else data[0]['total_revenue'])
+
+
+# Status of a background export of /rentals or /revenue, with ?download=true to get the file.
+# Partitioned exports are folders, their files are listed in 'files' and downloaded with &file=<name>.
+@main_app.route('/exports/<job_id>', methods=['GET'])
+@token_required
+def get_export(user, job_id):
+    if not user['isAdmin']:
+        return send_response("Oops you do not have the permission to access this resource.", 403)
+
+    job = export_jobs.get(job_id)
+    if job is None:
+        return send_response("Export job not found", 404)
+
+    finished = job['status'] in ('done', 'skipped')
+    partitioned = finished and os.path.isdir(job['file'])
+    if partitioned:
+        job['files'] = sorted(os.path.relpath(os.path.join(folder, name), job['file'])
+                              for folder, _, names in os.walk(job['file']) for name in names)
+
+    if request.args.get('download') == 'true':
+        if not finished:
+            return send_response(f"Export job is {job['status']}", 409)
+        mimetype = EXPORT_FORMATS[job['format']][1]
+        if partitioned:
+            if request.args.get('file') not in job['files']:
+                return send_response("Please provide one of the 'files' of the export as 'file'", 400)
+            return send_from_directory(os.path.abspath(job['file']), request.args['file'], mimetype=mimetype,
+                                       as_attachment=True)
+        return send_file(os.path.abspath(job['file']), mimetype=mimetype, as_attachment=True)
+
+    return send_response(job)
 
 
 # Create a new user account
@@ -156,12 +380,72 @@ def login():
     return UserService.login(auth)
 
 
-# create a backup csv with the current state of the users database.
+# Write an incremental backup of the database (a full one the first time), see backup.py.
 @main_app.route('/backup', methods=['GET'])
 @token_required
 def get_backup(user):
     if not user['isAdmin']:
         return send_response("Oops you do not have the permission to access this resource.", 403)
 
-    return send_response('Back up successfully created', 200) if backup() else send_response(
-        'Back up could not be created', 404)
+    try:
+        return send_response(backup())
+    except (OSError, ValueError, ImportError) as e:
+        logging.error(f"Backup failed: {e}")
+        return send_response('Back up could not be created', 500)
+
+
+# Hit and miss counters of the catalog response cache
+@main_app.route('/cache/stats', methods=['GET'])
+@token_required
+def get_cache_stats(user):
+    if not user['isAdmin']:
+        return send_response("Oops you do not have the permission to access this resource.", 403)
+
+    return send_response(response_cache.stats())
+
+
+# Connection pool and per-route request metrics in the Prometheus text format
+@main_app.route('/metrics', methods=['GET'])
+def get_metrics():
+    metrics = pool_metrics(db.engine) + request_metrics.metrics()
+    return Response(render_metrics(metrics), content_type=METRICS_CONTENT_TYPE)
+
+
+# Sampling profiler: GET its status and the slowest profiled requests, PUT {"enabled": true, "sample_rate": 0.1,
+# "routes": ["/books"]} to turn it on. Turning it off writes one collapsed stack file per route.
+@main_app.route('/profiler', methods=['GET', 'PUT'])
+@token_required
+def profiler(user):
+    if not user['isAdmin']:
+        return send_response("Oops you do not have the permission to access this resource.", 403)
+
+    if request.method == 'GET':
+        return send_response(request_profiler.status())
+
+    data = request.get_json(silent=True) or {}
+    enabled, sample_rate, routes = data.get('enabled'), data.get('sample_rate'), data.get('routes')
+
+    if not isinstance(enabled, bool):
+        return send_response("Please provide 'enabled' as true or false", 400)
+    if sample_rate is not None and (isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float))
+                                    or not 0 < sample_rate <= 1):
+        return send_response("Please provide a 'sample_rate' between 0 and 1", 400)
+    if routes is not None and (not isinstance(routes, list) or not all(isinstance(route, str) for route in routes)):
+        return send_response("Please provide 'routes' as a list of routes, e.g. [\"/books\"]", 400)
+
+    files = request_profiler.configure(enabled, sample_rate, routes)
+    return send_response(dict(request_profiler.status(), files=files))
+
+
+# Collapsed stacks (flamegraph.pl / speedscope input) of a route (?route=/books) or a slow request (?id=<id>)
+@main_app.route('/profiler/stacks', methods=['GET'])
+@token_required
+def get_profiler_stacks(user):
+    if not user['isAdmin']:
+        return send_response("Oops you do not have the permission to access this resource.", 403)
+
+    stacks = request_profiler.collapsed(route=request.args.get('route'), profile_id=request.args.get('id'))
+    if stacks is None:
+        return send_response("No profile for this route or request", 404)
+
+    return Response(stacks, mimetype='text/plain')
@@ -0,0 +1,175 @@
+"""
+Module Documentation: serialization.py
+
+This module serializes the API responses.
+
+JSON is encoded with orjson when it is installed and with the standard json module otherwise; both produce the
+same documents (compact, keys in insertion order, dates and datetimes in ISO 8601). The Flask app uses it through
+JSONProvider, so every send_response, jsonify and dictionary returned by a route is encoded by it.
+
+Query results are converted to dictionaries by serializers compiled once per model or result: the column keys are
+read once and every row is zipped with them, instead of filtering vars() of an ORM instance per row.
+
+Functions:
+- dumps: Encode a value as JSON bytes.
+- loads: Decode a JSON document.
+- model_serializer: The serializer of a model, compiled from its column list.
+- rows_to_dicts: Convert the rows of a query result to dictionaries.
+- stream_dicts: Convert the rows of a streamed query result to dictionaries, one at a time.
+
+Classes:
+- JSONProvider: Flask JSON provider encoding with dumps.
+
+"""
+from datetime import date
+from decimal import Decimal
+from operator import attrgetter
+from uuid import UUID
+
+import json
+
+from flask.json.provider import JSONProvider as BaseJSONProvider
+from sqlalchemy import Date, DateTime
+
+from app.instrumentation import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Attributes never serialized from a model instance
+EXCLUDED_ATTRIBUTES = ('password', 'isAdmin', 'rented_now', 'updated_at')
+
+_serializers = {}
+
+
+def _default(value):
+    # Types neither encoder handles natively (orjson handles dates, datetimes and UUIDs itself)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (UUID, bytes)):
+        return str(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    """
+    Encode a value as JSON bytes.
+
+    Parameters:
+    - value: Dictionaries, lists, strings, numbers, booleans, None, dates and datetimes.
+
+    Returns:
+    - bytes: The compact UTF-8 JSON document.
+    """
+
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(document):
+    """
+    Decode a JSON document.
+
+    Parameters:
+    - document (str or bytes): The JSON document.
+
+    Returns:
+    - The decoded value.
+    """
+
+    if orjson is not None:
+        return orjson.loads(document)
+    return json.loads(document)
+
+
+def model_serializer(model, exclude: tuple = EXCLUDED_ATTRIBUTES):
+    """
+    The serializer of a model, compiled once from its column list.
+
+    Parameters:
+    - model: The SQLAlchemy model class.
+    - exclude (tuple): The attributes left out (default is EXCLUDED_ATTRIBUTES).
+
+    Returns:
+    - callable: Converts an instance of the model to a dictionary, dates and datetimes as ISO 8601 strings.
+    """
+
+    serializer = _serializers.get((model, exclude))
+    if serializer is not None:
+        return serializer
+
+    keys = tuple(column.key for column in model.__table__.columns if column.key not in exclude)
+    dates = frozenset(column.key for column in model.__table__.columns
+                      if column.key in keys and isinstance(column.type, (Date, DateTime)))
+    getter = attrgetter(*keys)
+
+    if dates:
+        def serializer(instance):
+            return {key: value.isoformat() if key in dates and value is not None else value
+                    for key, value in zip(keys, getter(instance))}
+    else:
+        def serializer(instance):
+            return dict(zip(keys, getter(instance)))
+
+    _serializers[(model, exclude)] = serializer
+    return serializer
+
+
+def rows_to_dicts(result):
+    """
+    Convert the rows of a query result to dictionaries, reading the column keys once.
+
+    Parameters:
+    - result: A Result (or a list of Row objects of the same query).
+
+    Returns:
+    - list: One dictionary per row.
+    """
+
+    rows = result.all() if hasattr(result, 'all') else result
+    if not rows:
+        return []
+    keys = tuple(rows[0]._fields)
+    with timed('serialize'):
+        return [dict(zip(keys, row)) for row in rows]
+
+
+def stream_dicts(result):
+    """
+    Convert the rows of a (server-side cursor) query result to dictionaries, one at a time.
+
+    Parameters:
+    - result: A Result.
+
+    Yields:
+    - dict: One dictionary per row.
+    """
+
+    keys = tuple(result.keys())
+    for row in result:
+        yield dict(zip(keys, row))
+
+
+class JSONProvider(BaseJSONProvider):
+    # Flask JSON provider encoding responses with dumps, installed by create_app
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with timed('serialize'):
+            body = dumps(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,366 @@
+"""
+Module Documentation: synthetic.py
+
+This module generates a realistic catalog, users and multi-year rental history at production scale, for tests,
+benchmarks and load tests.
+
+Popularity is skewed the way real catalogs are: the books rented, the users renting, the authors and publishers of
+the books and the words of the titles all follow a Zipf distribution, so a few best sellers and heavy users account
+for most of the rentals while the long tail is rarely touched. Rentals grow over the years, and the popular books
+are scattered over the ISBN range instead of being its first rows.
+
+Every generator is a stream of dictionaries, deterministic by seed (the same seed and sizes always give the same
+rows, password hashes included), so millions of rows are written with flat memory usage: to CSV files readable by the bulk loader, or straight
+into the database through the bulk ingest path (COPY on PostgreSQL).
+
+Every generated rental is closed, so every book is available when the load finishes.
+
+Functions:
+- book_isbn: The ISBN-10 of the book with the given index.
+- popular_isbn: The ISBN of the book with the given popularity rank.
+- generate_books: Stream synthetic books.
+- generate_users: Stream synthetic users.
+- generate_rentals: Stream synthetic closed rentals.
+- write_dataset: Write a synthetic dataset to CSV files.
+- load_dataset: Load a synthetic dataset into the database.
+
+Classes:
+- ZipfSampler: Draws ranks from a bounded Zipf distribution in constant memory.
+
+"""
+import csv
+import hashlib
+import math
+import os
+import random
+import string
+from datetime import date, timedelta
+from functools import lru_cache
+from math import gcd
+
+from app.fees import DEFAULT_TIERS, rental_fee
+from app.loader import CSV_COLUMNS, DEFAULT_CHUNK_SIZE, bulk_insert, chunked, load_book_chunks
+from app.migrations import rebuild_daily_revenue
+from app.models import RentedHistory, User
+
+# Exponent of the popularity distributions, close to the one measured on book sales and library loans
+ZIPF_EXPONENT = 1.1
+
+# The rental history ends the day before HISTORY_END, deterministic instead of relative to today
+HISTORY_END = date(2024, 1, 1)
+HISTORY_YEARS = 3
+
+# Mean and maximum rental duration in days
+MEAN_RENTAL_DAYS = 7
+MAX_RENTAL_DAYS = 60
+
+# Password of every generated user, hashed once since hashing is deliberately slow
+DEFAULT_PASSWORD = 'synthetic'
+
+# scrypt parameters of werkzeug's generate_password_hash
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 15, 8, 1
+
+# Books per author and per publisher, on average
+BOOKS_PER_AUTHOR = 8
+BOOKS_PER_PUBLISHER = 100
+
+FIRST_NAMES = ('Amy', 'Ann', 'Anthony', 'Carlos', 'Chen', 'Clara', 'David', 'Elena', 'Fatima', 'George', 'Grace',
+               'Hiro', 'Ingrid', 'James', 'Jane', 'Kofi', 'Laura', 'Leo', 'Maria', 'Mark', 'Nadia', 'Noah', 'Olga',
+               'Omar', 'Paul', 'Priya', 'Rosa', 'Sam', 'Sofia', 'Tom', 'Yuki', 'Zoe')
+LAST_NAMES = ('Adams', 'Baker', 'Beattie', 'Brown', 'Chandler', 'Costa', 'Dubois', 'Evans', 'Fischer', 'Garcia',
+              'Hughes', 'Ivanova', 'Jensen', 'Kaiser', 'Khan', 'Lee', 'Martin', 'Moreau', 'Nakamura', 'Novak',
+              'Okafor', 'Patel', 'Quinn', 'Rossi', 'Santos', 'Schmidt', 'Silva', 'Smith', 'Tan', 'Walker', 'Wong',
+              'Young')
+PUBLISHER_WORDS = ('Ivy', 'Harper', 'Scribner', 'Mira', 'Ecco', 'Penguin', 'Vintage', 'Anchor', 'Bantam', 'Orbit',
+                   'Tor', 'Faber', 'Beacon', 'Granta', 'Picador', 'Riverhead')
+PUBLISHER_SUFFIXES = ('Books', 'Press', 'Publishing', 'House', 'Editions')
+TITLE_WORDS = ('the', 'of', 'and', 'a', 'in', 'love', 'night', 'house', 'war', 'secret', 'life', 'world', 'girl',
+               'city', 'dark', 'last', 'river', 'time', 'stories', 'heart', 'king', 'garden', 'shadow', 'winter',
+               'summer', 'road', 'sea', 'star', 'kitchen', 'club', 'murder', 'light', 'fire', 'history', 'journey',
+               'island', 'dream', 'wife', 'daughter', 'stranger', 'empire', 'mountain', 'letters', 'song', 'silence',
+               'memory', 'forest', 'storm', 'bridge', 'children', 'promise', 'truth', 'blood', 'gold', 'moon',
+               'return', 'voices', 'wind', 'glass', 'paper', 'spring', 'code', 'machine', 'ocean', 'lost', 'hidden')
+
+# Salts of the random generators, so every stream is independent of the others
+_STREAMS = {'books': 1, 'users': 2, 'rentals': 3}
+
+
+class ZipfSampler:
+    """
+    Draws ranks 0..n-1 where rank k has a probability proportional to 1 / (k + 1) ** exponent.
+
+    Ranks are drawn by inverting the continuous approximation of the distribution's CDF, so sampling takes constant
+    time and memory whatever n is (a table of cumulative weights would take hundreds of MB for 10M books).
+    """
+
+    def __init__(self, n: int, exponent: float = ZIPF_EXPONENT):
+        self.n = n
+        self.exponent = exponent
+        if exponent == 1:
+            self._log_span = math.log(n + 1)
+        else:
+            self._power = 1 - exponent
+            self._span = (n + 1) ** self._power - 1
+
+    def rank(self, u: float):
+        # The rank at quantile u of [0, 1)
+        if self.exponent == 1:
+            x = math.exp(u * self._log_span)
+        else:
+            x = (1 + u * self._span) ** (1 / self._power)
+        return min(int(x) - 1, self.n - 1)
+
+    def sample(self, rng: random.Random):
+        return self.rank(rng.random())
+
+
+@lru_cache(maxsize=64)
+def _scatter(n: int):
+    # Stride and inverse of a permutation of 0..n-1 spreading the popular ranks over the whole range
+    if n <= 1:
+        return 1, 0
+    stride = 2654435761 % n or 1
+    while gcd(stride, n) != 1:
+        stride += 1
+    return stride, pow(stride, -1, n)
+
+
+def _rng(seed: int, stream: str, index: int = 0):
+    return random.Random(seed * 1000003 + _STREAMS[stream] * 7919 + index)
+
+
+def book_isbn(index: int):
+    """
+    The ISBN-10 of the book with the given index, with a valid check digit.
+
+    Parameters:
+    - index (int): The index of the book, from 0 to 999999999.
+
+    Returns:
+    - str: The ISBN, e.g. '0000000019'.
+    """
+
+    digits = f'{index:09d}'
+    check = sum((10 - position) * int(digit) for position, digit in enumerate(digits)) % 11
+    return digits + ('0' if check == 0 else 'X' if check == 1 else str(11 - check))
+
+
+def popular_isbn(rank: int, count: int):
+    """
+    The ISBN of the book with the given popularity rank, the way generate_books and generate_rentals rank them.
+
+    Parameters:
+    - rank (int): The popularity rank, 0 for the most rented book, e.g. from ZipfSampler.sample.
+    - count (int): The number of books.
+
+    Returns:
+    - str: The ISBN of the book.
+    """
+
+    return book_isbn((rank + 1) * _scatter(count)[0] % count)
+
+
+def _author(index: int):
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[index // len(FIRST_NAMES) % len(LAST_NAMES)]
+    rest = index // (len(FIRST_NAMES) * len(LAST_NAMES))
+    if rest == 0:
+        return f'{first} {last}'
+    # Initials and numbers keep the names unique beyond the combinations of first and last names
+    number = '' if rest <= 26 else f' {(rest - 1) // 26 + 1}'
+    return f'{first} {chr(ord("A") + (rest - 1) % 26)}. {last}{number}'
+
+
+def _publisher(index: int):
+    word, suffix = index % len(PUBLISHER_WORDS), index // len(PUBLISHER_WORDS) % len(PUBLISHER_SUFFIXES)
+    name = f'{PUBLISHER_WORDS[word]} {PUBLISHER_SUFFIXES[suffix]}'
+    return name if index < len(PUBLISHER_WORDS) * len(PUBLISHER_SUFFIXES) else f'{name} {index}'
+
+
+def generate_books(count: int, seed: int = 0, exponent: float = ZIPF_EXPONENT):
+    """
+    Stream synthetic books. Popular books (the ones generate_rentals rents most) have more copies.
+
+    Parameters:
+    - count (int): The number of books; the ISBN of book i is book_isbn(i).
+    - seed (int): The seed of the generator.
+    - exponent (float): The exponent of the author, publisher and title word distributions.
+
+    Yields:
+    - dict: A book keyed by books column name.
+    """
+
+    authors = ZipfSampler(max(count // BOOKS_PER_AUTHOR, 1), exponent)
+    publishers = ZipfSampler(max(count // BOOKS_PER_PUBLISHER, 1), exponent)
+    words = ZipfSampler(len(TITLE_WORDS), exponent)
+    _, inverse = _scatter(count)
+
+    for index in range(count):
+        rng = _rng(seed, 'books', index)
+        isbn = book_isbn(index)
+        title = ' '.join(TITLE_WORDS[words.sample(rng)] for _ in range(rng.randint(1, 5))).capitalize()
+        # Popularity rank of the book, see generate_rentals
+        rank = (index * inverse - 1) % count
+        copies = 3 if rank < count // 100 else 2 if rank < count // 10 else 1
+        yield {
+            'isbn': isbn,
+            'title': title,
+            'author': _author(authors.sample(rng)),
+            'year_of_publication': max(HISTORY_END.year - int(rng.expovariate(1 / 15)), 1900),
+            'publisher': _publisher(publishers.sample(rng)),
+            'image_url_s': f'http://images.amazon.com/images/P/{isbn}.01.THUMBZZZ.jpg',
+            'image_url_m': f'http://images.amazon.com/images/P/{isbn}.01.MZZZZZZZ.jpg',
+            'image_url_l': f'http://images.amazon.com/images/P/{isbn}.01.LZZZZZZZ.jpg',
+            'rented_now': None,
+            'rating': rng.randint(0, 10),
+            'isAvailable': True,
+            'copies': copies,
+            'available_copies': copies,
+        }
+
+
+def _password_hash(password: str, seed: int):
+    # The hash generate_password_hash would store, with a salt drawn from the seed instead of a random one, so the
+    # users are deterministic by seed too. check_password_hash accepts it.
+    # Index 0 of the users stream, the users are drawn from 1 to count
+    rng = _rng(seed, 'users', 0)
+    salt = ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(16))
+    hashed = hashlib.scrypt(password.encode(), salt=salt.encode(), n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P,
+                            maxmem=132 * SCRYPT_N * SCRYPT_R * SCRYPT_P)
+    return f'scrypt:{SCRYPT_N}:{SCRYPT_R}:{SCRYPT_P}${salt}${hashed.hex()}'
+
+
+def generate_users(count: int, seed: int = 0, password: str = DEFAULT_PASSWORD):
+    """
+    Stream synthetic users, in id order: inserted into an empty table they get the ids 1 to count.
+    User 1 is an admin, every user has the same password.
+
+    Parameters:
+    - count (int): The number of users.
+    - seed (int): The seed of the generator.
+    - password (str): The password of every user.
+
+    Yields:
+    - dict: A user keyed by users column name.
+    """
+
+    hashed = _password_hash(password, seed)
+    for user_id in range(1, count + 1):
+        name = f'{FIRST_NAMES[_rng(seed, "users", user_id).randrange(len(FIRST_NAMES))].lower()}{user_id}'
+        yield {'username': name, 'email': f'{name}@example.com', 'password': hashed,
+               'isAdmin': user_id == 1}
+
+
+def generate_rentals(count: int, books: int, users: int, seed: int = 0, years: int = HISTORY_YEARS,
+                     end: date = HISTORY_END, exponent: float = ZIPF_EXPONENT, tiers=DEFAULT_TIERS):
+    """
+    Stream synthetic closed rentals over the years before end, with Zipfian book and user popularity
+    and a growing number of rentals per day.
+
+    Parameters:
+    - count (int): The number of rentals.
+    - books (int): The number of books of generate_books.
+    - users (int): The number of users of generate_users.
+    - seed (int): The seed of the generator.
+    - years (int): The number of years of history.
+    - end (date): The day after the last return.
+    - exponent (float): The exponent of the book and user popularity distributions.
+    - tiers (tuple): The pricing table of the fees, the app's PRICING_TIERS to match what a return charges
+      (default is DEFAULT_TIERS).
+
+    Yields:
+    - dict: A rental keyed by history column name, with the fee of rental_fee.
+    """
+
+    book_ranks, user_ranks = ZipfSampler(books, exponent), ZipfSampler(users, exponent)
+    user_stride, _ = _scatter(users)
+    days = years * 365
+    first_day = end - timedelta(days=days)
+    rng = _rng(seed, 'rentals')
+
+    for _ in range(count):
+        duration = min(1 + int(rng.expovariate(1 / MEAN_RENTAL_DAYS)), MAX_RENTAL_DAYS)
+        # Skewed towards the end: the number of rentals per day grows over the years
+        start = first_day + timedelta(days=min(int(days * rng.random() ** 0.75), days - duration - 1))
+        finish = start + timedelta(days=duration)
+        yield {
+            'isbn': popular_isbn(book_ranks.sample(rng), books),
+            'user': (user_ranks.sample(rng) + 1) * user_stride % users + 1,
+            'start_date': start,
+            'end_date': finish,
+            'total_cost': rental_fee(start, finish, tiers),
+        }
+
+
+def _write_csv(path: str, rows, fieldnames: list, header: dict = None):
+    # Stream rows to a CSV file; header maps column names to the CSV header names
+    header = header or {}
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow([header.get(name, name) for name in fieldnames])
+        count = 0
+        for row in rows:
+            writer.writerow(['' if row[name] is None else row[name] for name in fieldnames])
+            count += 1
+    return count
+
+
+def write_dataset(directory: str, books: int, users: int, rentals: int, seed: int = 0, tiers=DEFAULT_TIERS):
+    """
+    Write a synthetic dataset to CSV files. Books.csv has the header of data/Books.csv, so it can be loaded with
+    bulk_load_books or the import-books command.
+
+    Parameters:
+    - directory (str): The folder of Books.csv, Users.csv and Rentals.csv, created if needed.
+    - books (int): The number of books.
+    - users (int): The number of users.
+    - rentals (int): The number of rentals.
+    - seed (int): The seed of the generators.
+    - tiers (tuple): The pricing table of the rental fees (default is DEFAULT_TIERS).
+
+    Returns:
+    - dict: The path and the number of rows of every file.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    files = {
+        'books': ('Books.csv', generate_books(books, seed), list(CSV_COLUMNS.values()),
+                  {column: name for name, column in CSV_COLUMNS.items()}),
+        'users': ('Users.csv', generate_users(users, seed), ['username', 'email', 'password', 'isAdmin'], None),
+        'rentals': ('Rentals.csv', generate_rentals(rentals, books, users, seed, tiers=tiers),
+                    ['isbn', 'user', 'start_date', 'end_date', 'total_cost'], None),
+    }
+
+    written = {}
+    for name, (filename, rows, fieldnames, header) in files.items():
+        path = os.path.join(directory, filename)
+        written[name] = {'path': path, 'rows': _write_csv(path, rows, fieldnames, header)}
+    return written
+
+
+def load_dataset(db, books: int, users: int, rentals: int, seed: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 progress=None, tiers=DEFAULT_TIERS):
+    """
+    Load a synthetic dataset into an empty database through the bulk ingest path, then rebuild the revenue rollup.
+    The users table must be empty so the users get the ids the rentals refer to.
+
+    Parameters:
+    - db: The SQLAlchemy database instance.
+    - books (int): The number of books.
+    - users (int): The number of users.
+    - rentals (int): The number of rentals.
+    - seed (int): The seed of the generators.
+    - chunk_size (int): The number of rows sent at a time.
+    - progress (callable): Optional callback receiving the stats of the books load after every chunk.
+    - tiers (tuple): The pricing table of the rental fees, the app's PRICING_TIERS (default is DEFAULT_TIERS).
+
+    Returns:
+    - dict: The number of books, users, rentals and revenue days loaded.
+    """
+
+    loaded = {'books': load_book_chunks(db, chunked(generate_books(books, seed), chunk_size), progress)['rows']}
+    loaded['users'] = bulk_insert(db, User, generate_users(users, seed), chunk_size)
+    loaded['rentals'] = bulk_insert(db, RentedHistory, generate_rentals(rentals, books, users, seed, tiers=tiers),
+                                    chunk_size)
+    loaded['revenue_days'] = rebuild_daily_revenue(db)
+    return loaded
@@ -4,45 +4,93 @@ Module Documentation: utilities.py
 This module provides utility functions for handling responses, validating data, and interacting with the database.
 
 Functions:
+- response_body: Build the JSON envelope of a response.
 - send_response: Generate a JSON response for HTTP requests.
+- send_csv_stream: Generate a streamed CSV response.
+- send_ndjson_stream: Generate a streamed newline delimited JSON response.
+- encode_cursor / decode_cursor: Convert between ISBNs and opaque pagination cursors.
+- get_page_args: Read the pagination arguments of a request.
+- get_batch: Read the ISBNs of a batch request body.
+- get_return_batch: Read the items of a batch return request body.
 - is_date_args_valid: Check if provided date URL arguments are valid.
-- import_data: Import data from a CSV file into the database.
-- export_to_csv: Export data to CSV files.
+- to_date: Convert a 'YYYY-MM-DD' string to a date.
+- import_data: Import sample users, rentals and the books catalog into the database.
+- seed_database: Create the tables and import the sample data once per seed version.
 - user_data_is_valid: Validate incoming user registration data.
+- get_secret_key: Return the JWT secret key, read from config.ini once per process.
+- authenticate: Resolve a JWT to the requesting user, using the token and role caches.
+- invalidate_user: Drop the cached tokens and role of a user after it changes.
 - token_required: Decorator function for routes requiring authentication.
 - to_dict: Convert SQLAlchemy model instances to dictionaries.
-- config_logger: Configure the logger for logging to a file.
-- backup: Create a backup of current rented books to a CSV file.
+- backup: Write an incremental backup of the tables.
 
 """
-from datetime import datetime
-from functools import wraps
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from calendar import monthrange
+from datetime import date, datetime
+from functools import lru_cache, wraps
 
+import json
 import jwt
 import logging
 import os
-import pandas as pd
-from flask import jsonify, make_response, request
+import time
+from flask import Response, current_app, g, has_app_context, jsonify, make_response, request, stream_with_context
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 
 from config.Config import AppConfig
-from app.models import Book, User, RentedHistory
+from app.models import db, User, RentedHistory, SeedVersion
+from app.loader import bulk_load_books
+from app.migrations import rebuild_daily_revenue
+from app.cache import TTLCache
+from app.exports import csv_chunks
+from app.serialization import dumps, model_serializer
+from app.instrumentation import timed
+from app.backup import BACKUP_DIR, run_backup
+from app.replica import RoutingSession
 
+# Bump when the sample data imported by import_data changes
+SEED_VERSION = 1
 
-def send_response(response_content, status_code=None):
+BOOKS_CSV_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'Books.csv')
+
+# Lifetime of the JWTs created on login, in seconds
+TOKEN_LIFETIME = 120
+
+# Decoded tokens and user roles, so the authenticated hot path does no config file read and no DB query.
+# Role entries live at least as long as a token, so a role changed by invalidate_user overrides the
+# isAdmin claim of every token issued before the change. The caches are per process: other workers do not see
+# the invalidation and keep serving a changed role for at most TOKEN_LIFETIME seconds.
+token_cache = TTLCache(maxsize=10000, ttl=TOKEN_LIFETIME)
+role_cache = TTLCache(maxsize=10000, ttl=TOKEN_LIFETIME)
+_UNKNOWN_ROLE = object()
+
+# Pagination of book listings
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+# Books per /rent/batch or /return/batch request
+MAX_BATCH_SIZE = 100
+
+
+def response_body(response_content, status_code=None, next_cursor=None):
     """
-    Generate a JSON response.
+    Build the JSON envelope of a response, shared by the Flask and the ASGI app.
 
     Parameters:
     - response_content (string or list or dict): Either the data to be included in the response or an error message.
     - status_code (int): The HTTP status code (default is None).
+    - next_cursor (str): The cursor of the next page of a paginated listing (default is None).
 
     Returns:
-    - A Flask JSON response.
+    - dict: The response body.
     """
 
-    response_data = {"status": "success", "status code": 200}
+    response_data = {"status": "success", "status code": status_code or 200}
 
-    if status_code and status_code != 200 and status_code != 201:
+    if status_code and not 200 <= status_code < 300:
         response_data.update({"status": "error", "message": response_content, "status code": status_code})
 
     elif response_content is None:
@@ -57,7 +105,161 @@ def send_response(response_content, status_code=None):
     else:
         response_data["data"] = response_content
 
-    return make_response(response_data, status_code)
+    if next_cursor:
+        response_data["next"] = next_cursor
+
+    return response_data
+
+
+def send_response(response_content, status_code=None, next_cursor=None):
+    """
+    Generate a JSON response.
+
+    Parameters:
+    - response_content (string or list or dict): Either the data to be included in the response or an error message.
+    - status_code (int): The HTTP status code (default is None).
+    - next_cursor (str): The cursor of the next page of a paginated listing (default is None).
+
+    Returns:
+    - A Flask JSON response.
+    """
+
+    return make_response(response_body(response_content, status_code, next_cursor), status_code)
+
+
+def send_csv_stream(rows, filename: str, fieldnames: list = None):
+    """
+    Generate a streamed CSV response, sent in chunks as the rows are read.
+
+    Parameters:
+    - rows (iterable): The rows, as dictionaries, e.g. from a server-side cursor.
+    - filename (str): The name of the downloaded file, without extension.
+    - fieldnames (list): The columns (default is the keys of the first row).
+
+    Returns:
+    - Response: The text/csv response.
+    """
+
+    response = Response(stream_with_context(csv_chunks(rows, fieldnames)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+def send_ndjson_stream(rows):
+    """
+    Generate a streamed newline delimited JSON response, one line per row.
+
+    Parameters:
+    - rows (iterable): An iterable of dictionaries, consumed lazily while the response is sent.
+
+    Returns:
+    - A Flask streamed response with the 'application/x-ndjson' mimetype.
+    """
+
+    def generate():
+        for row in rows:
+            yield dumps(row) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def encode_cursor(value, key: str = 'isbn'):
+    # Opaque for clients - only the API knows it is the last ISBN (or the offset) of the page
+    return urlsafe_b64encode(json.dumps({key: value}).encode()).decode()
+
+
+def decode_cursor(cursor: str, key: str = 'isbn'):
+    """
+    Decode a pagination cursor created by encode_cursor.
+
+    Parameters:
+    - cursor (str): The opaque cursor sent by the client.
+    - key (str): The kind of cursor, 'isbn' for keyset pagination or 'offset' for ranked results.
+
+    Returns:
+    - str or int: The ISBN to continue after, or the offset of the page.
+
+    Raises:
+    - ValueError: If the cursor is malformed.
+    """
+
+    try:
+        value = json.loads(urlsafe_b64decode(cursor.encode()))[key]
+    except (DecodeError, UnicodeError, ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+    # A forged cursor must not reach the query as a negative or non integer OFFSET
+    valid = isinstance(value, int) and not isinstance(value, bool) and value >= 0 if key == 'offset' \
+        else isinstance(value, str)
+    if not valid:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return value
+
+
+def get_page_args(argsList: dict, cursor_key: str = 'isbn'):
+    """
+    Read the pagination url arguments 'cursor' and 'limit'.
+
+    Parameters:
+    - args_list (dict): The request arguments.
+    - cursor_key (str): The kind of cursor, see decode_cursor.
+
+    Returns:
+    - tuple: The decoded cursor (or None) and the page size, capped at MAX_PAGE_SIZE.
+
+    Raises:
+    - ValueError: If the cursor or the limit are not valid.
+    """
+
+    cursor = argsList.get('cursor')
+    after = decode_cursor(cursor, cursor_key) if cursor else None
+
+    limit = argsList.get('limit', DEFAULT_PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid limit: {limit}")
+
+    if limit < 1:
+        raise ValueError(f"Invalid limit: {limit}")
+    return after, min(limit, MAX_PAGE_SIZE)
+
+
+def get_batch(data):
+    """
+    Read the list of ISBNs of a batch request body, {"isbns": [...]}.
+
+    Parameters:
+    - data (dict): The JSON request body.
+
+    Returns:
+    - list or None: The items of the batch, or None if the body is not valid or has more than MAX_BATCH_SIZE items.
+    """
+
+    items = data.get('isbns') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_SIZE:
+        return None
+    return items
+
+
+def get_return_batch(data):
+    """
+    Read the items of a batch return request body, {"isbns": [...]}. Items are ISBNs, or {"isbn": ..., "user": ...}
+    to return the copy of a specific user.
+
+    Parameters:
+    - data (dict): The JSON request body.
+
+    Returns:
+    - list or None: The items as {'isbn': str, 'user': int or None} dictionaries, or None if the body is not valid.
+    """
+
+    items = get_batch(data)
+    items = items and [{'isbn': item} if isinstance(item, str) else item for item in items]
+    if not items or not all(isinstance(item, dict) and isinstance(item.get('isbn'), str)
+                            and isinstance(item.get('user'), (int, type(None))) for item in items):
+        return None
+    return items
 
 
 def is_date_args_valid(argsList: dict):
@@ -80,6 +282,33 @@ def is_date_args_valid(argsList: dict):
     return [start_date, end_date]
 
 
+def to_date(value):
+    """
+    Convert a 'YYYY-MM-DD' string to a date.
+
+    A day past the end of the month (e.g. '2023-02-31') is clamped to the last day of that month,
+    so it keeps working as an inclusive upper bound like it did when dates were stored as strings.
+
+    Parameters:
+    - value (str or date): The date to convert.
+
+    Returns:
+    - date: The converted date.
+
+    Raises:
+    - ValueError: If the value is not a date in the format 'YYYY-MM-DD'.
+    """
+
+    if isinstance(value, date):
+        return value
+
+    try:
+        year, month, day = (int(part) for part in value.split('-'))
+        return date(year, month, min(day, monthrange(year, month)[1]))
+    except (AttributeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid date: {value}") from e
+
+
 def import_data(db):
     """
    Import data from a CSV file into Bookstore database.
@@ -105,15 +334,6 @@ def import_data(db):
         {"total_cost": 4.5, "start_date": "2023-12-21", "end_date": "2023-12-27", "isbn": "1841721522", "user_id": 2},
     ]
 
-    # Add users to the database
-    for rental in rented_history_data:
-        new_rental = RentedHistory(rental.get('total_cost'),
-                          rental.get('start_date'),
-                          rental.get('end_date'),
-                          rental.get('isbn'),
-                          rental.get('user_id'))
-        db.session.add(new_rental)
-
     # Add users to the database
     for user_data in users_data:
         new_user = User(user_data.get('username'),
@@ -123,26 +343,17 @@ def import_data(db):
 
     db.session.commit()
 
+    # Load the books catalog with the bulk loader
+    bulk_load_books(db, BOOKS_CSV_PATH)
 
-    data = pd.read_csv('./data/Books.csv')
-
-    # Iterate over rows and add data to the database
-    for _, row in data.iterrows():
-        book = Book(
-            isbn=row['ISBN'],
-            title=row['Book-Title'],
-            author=row['Book-Author'],
-            year_of_publication=row['Year-Of-Publication'],
-            publisher=row['Publisher'],
-            image_url_s=row['Image-URL-S'],
-            image_url_m=row['Image-URL-M'],
-            image_url_l=row['Image-URL-L'],
-            rented_now=row['User-ID'],
-            rating=row['Book-Rating'],
-            isAvailable=True
-        )
-        db.session.add(book)
-
+    # Add rented history records to the database
+    for rental in rented_history_data:
+        new_rental = RentedHistory(rental.get('total_cost'),
+                          to_date(rental.get('start_date')),
+                          to_date(rental.get('end_date')) if rental.get('end_date') else None,
+                          rental.get('isbn'),
+                          rental.get('user_id'))
+        db.session.add(new_rental)
 
     # Commit changes to the database
     db.session.commit()
@@ -150,33 +361,33 @@ def import_data(db):
     logging.info('Database and Tables data imported successfully')
 
 
-def export_to_csv(data, filename: str):
+def seed_database(db):
     """
-    Export data for rental and total revenue to CSV files.
+    Create the database tables and import the sample data, unless this seed version is already applied.
 
     Parameters:
-        - data (list or int): The data to be exported.
-        - filename (str): The filename for the CSV file.
+    - db: The SQLAlchemy database instance.
+
+    Returns:
+    - bool: True if the seed version was applied, False if the database was already seeded.
     """
-    try:
-        # Create new timestamp
-        date = datetime.now()
-        date = date.strftime('%Y-%m-%d')
 
-        # Create path
-        path = f"output/{filename}-{date}.csv"
+    db.create_all()
 
-        # Format data before passing them on Dataframe constructor
-        df = pd.DataFrame(data) if filename.lower() == 'rentals' else pd.DataFrame({"total_revenue": [data]})
+    if db.session.get(SeedVersion, SEED_VERSION):
+        logging.info(f'Seed version {SEED_VERSION} already applied. No action taken.')
+        return False
 
-        # Check if the file exists - if not create backup
-        if not os.path.exists(path):
-            df.to_csv(path, index=False)
-            logging.info(f"New CSV file '{filename}-{date}.csv' created with data.")
-        else:
-            logging.warning(f"Backup already exists for '{filename}-{date}.csv'. No action taken.")
-    except Exception as e:
-        logging.error(e)
+    # Databases seeded before the version marker existed only get the marker recorded
+    if not User.query.first():
+        import_data(db)
+        rebuild_daily_revenue(db)
+
+    db.session.add(SeedVersion(SEED_VERSION, datetime.now()))
+    db.session.commit()
+
+    logging.info(f'Seed version {SEED_VERSION} applied')
+    return True
 
 
 def user_data_is_valid(data: dict):
@@ -186,6 +397,112 @@ def user_data_is_valid(data: dict):
     return True
 
 
+@lru_cache(maxsize=None)
+def _read_secret_key(path: str):
+    return AppConfig(path=path).get_secret_key() if path else AppConfig().get_secret_key()
+
+
+def get_secret_key(path: str = None):
+    """
+    Return the JWT secret key.
+
+    Inside an application context the key configured on the app is used, otherwise config.ini
+    is read once per process and path.
+
+    Parameters:
+    - path (str): The path of config.ini, used outside an application context (default is AppConfig's).
+
+    Returns:
+    - str: The secret key.
+    """
+
+    if has_app_context():
+        return current_app.config['SECRET_KEY']
+    return _read_secret_key(path)
+
+
+def authenticate(token: str):
+    """
+    Resolve a JWT to the requesting user.
+
+    Decoded tokens and user roles are cached. The role comes from the role cache, then from the
+    isAdmin claim of the token, and only for tokens without the claim from the database.
+
+    Parameters:
+    - token (str): The encoded JWT.
+
+    Returns:
+    - dict: The 'id' and 'isAdmin' of the user.
+
+    Raises:
+    - jwt.ExpiredSignatureError: If the token has expired.
+    - jwt.InvalidTokenError: If the token is not valid or the user does not exist.
+    """
+
+    data = token_cache.get(token)
+    if data is None:
+        data = jwt.decode(token, get_secret_key(), algorithms=['HS256'])
+        ttl = data['exp'] - time.time() if 'exp' in data else None
+        token_cache.set(token, data, ttl=ttl)
+
+    user_id = data['user_id']
+
+    is_admin = role_cache.get(user_id, default=_UNKNOWN_ROLE)
+    if is_admin is _UNKNOWN_ROLE:
+        if 'isAdmin' in data:
+            is_admin = data['isAdmin']
+        else:
+            user = db.session.query(User.isAdmin).filter_by(id=user_id).first()
+            is_admin = bool(user.isAdmin) if user else None
+            role_cache.set(user_id, is_admin)
+
+    if is_admin is None:
+        raise jwt.InvalidTokenError(f"User {user_id} not found")
+
+    return {'id': user_id, 'isAdmin': is_admin}
+
+
+def invalidate_user(user_id: int, is_admin=None):
+    """
+    Drop the cached tokens of a user and record its current role.
+
+    Parameters:
+    - user_id (int): The unique identifier of the user.
+    - is_admin (bool): The current role of the user, or None if the user no longer exists.
+    """
+
+    token_cache.delete_where(lambda token, data: data.get('user_id') == user_id)
+    role_cache.set(user_id, is_admin)
+
+
+def _user_changed(target, is_admin):
+    # Users changed through the ORM are invalidated once committed, a rolled back change keeps the cached role
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('user_updates', {})[target.id] = is_admin
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    _user_changed(target, bool(target.isAdmin))
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    _user_changed(target, None)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _users_committed(session):
+    for user_id, is_admin in session.info.pop('user_updates', {}).items():
+        invalidate_user(user_id, is_admin)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _users_rolled_back(session):
+    session.info.pop('user_updates', None)
+
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -197,56 +514,34 @@ def token_required(f):
             return jsonify({'message': 'Token is missing !!'}), 401
 
         try:
-            config = AppConfig()
-            data = jwt.decode(token, config.get_secret_key(), algorithms=['HS256'])
-            user = User.query.filter_by(id=data['user_id']).first()
-
-            # Create a dictionary with only the desired attributes
-            user = {
-                'id': user.id,
-                'isAdmin': user.isAdmin
-            }
-
+            user = authenticate(token)
         except jwt.ExpiredSignatureError:
-            return jsonify({'message': 'Token has expired'}),
+            return jsonify({'message': 'Token has expired'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'message': 'Invalid token'}), 401
+
+        # The writer of the request, for the read replica stickiness (see replica.py)
+        g.user = user
         return f(user, *args, **kwargs)
 
     return decorated
 
 
 def to_dict(instance):
-    if hasattr(instance, '__dict__'):
-        # Exclude specific attributes for user instance and SQLalchemy
-        excluded_attributes = ['_sa_instance_state', 'password', 'isAdmin', 'rented_now']
-        return {key: value for key, value in vars(instance).items() if key not in excluded_attributes}
+    if hasattr(instance, '__table__'):
+        # Serializer compiled once per model, without the password, role and internal columns
+        with timed('serialize'):
+            return model_serializer(type(instance))(instance)
     logging.warning("Object type not supported for conversion to dictionary.")
 
 
 def backup():
-    rented_books = RentedHistory.query.filter(
-        RentedHistory.end_date.is_(None),
-    ).all()
-
-    if not rented_books:
-        return False
-
-    data = [to_dict(rental) for rental in rented_books]
-
-    # Create new timestamp
-    date = datetime.now()
-    date = date.strftime('%Y-%m-%d')
+    """
+    Write an incremental backup of the tables, see backup.run_backup. The first backup is a full one.
 
-    # Create path
-    path = f"output/Backup-{date}.csv"
+    Returns:
+    - dict: The manifest of the backup.
+    """
 
-    # Check if the file exists - if not create backup
-    if not os.path.exists(path):
-        df = pd.DataFrame.from_records(data, exclude=['end_date', 'total_cost', 'id'])
-        df.to_csv(path, index=False)
-        logging.info('Backup created successfully')
-        return True
-    else:
-        logging.warning("Backup already exists. No action taken.")
-        return False
+    return run_backup(db, current_app.config.get('BACKUP_DIR', BACKUP_DIR), incremental=True,
+                      compression=current_app.config.get('BACKUP_COMPRESSION', 'gzip'))
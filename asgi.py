@@ -0,0 +1,5 @@
+from app.asgi import create_asgi_app
+
+# ASGI entry point - run with an async server, e.g. `uvicorn asgi:app --workers 4`.
+# create_app sets up the logging to db.log, see app/request_log.py.
+app = create_asgi_app()
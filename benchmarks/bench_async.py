@@ -0,0 +1,146 @@
+"""
+Module Documentation: bench_async.py
+
+Throughput benchmark of the sync (Flask, threaded WSGI server) and async (ASGI, uvicorn) serving modes.
+
+Both servers are started on the same database and driven with the same number of concurrent clients.
+Without --config a seeded SQLite database stands in for PostgreSQL.
+
+Usage:
+    python -m benchmarks.bench_async --config ./config/config.ini --route /books?limit=50 --concurrency 32
+    python -m benchmarks.bench_async --requests 2000
+
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'sync': """
+import sys
+from werkzeug.serving import run_simple
+from app import create_app
+run_simple('127.0.0.1', int(sys.argv[2]), create_app(config_path=sys.argv[1]), threaded=True)
+""",
+    'async': """
+import sys
+import uvicorn
+from app.asgi import create_asgi_app
+uvicorn.run(create_asgi_app(config_path=sys.argv[1]), host='127.0.0.1', port=int(sys.argv[2]), log_level='warning')
+""",
+}
+
+SEED = """
+import sys
+from app import create_app
+from app.models import db
+from app.utilities import seed_database
+with create_app(config_path=sys.argv[1]).app_context():
+    seed_database(db)
+"""
+
+
+def sqlite_config(directory: str):
+    # config.ini of a seeded SQLite database standing in for PostgreSQL
+    path = os.path.join(directory, 'config.ini')
+    with open(path, 'w') as file:
+        file.write("[Database]\nsecret_key = benchmark-secret-key-for-the-sqlite-database\n\n"
+                   f"[DatabaseURL]\nconnection_db_string = sqlite:///{os.path.join(directory, 'bookstore.db')}\n")
+    subprocess.run([sys.executable, '-c', SEED, path], cwd=ROOT, check=True)
+    return path
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def drive(port: int, route: str, requests: int, concurrency: int):
+    # Every client keeps one connection open and sends its share of the requests
+    def client(count):
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        latencies, errors = [], 0
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                connection.request('GET', route)
+                response = connection.getresponse()
+                response.read()
+                errors += response.status != 200
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port)
+            latencies.append(time.perf_counter() - started)
+        connection.close()
+        return latencies, errors
+
+    shares = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(client, shares))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for result, _ in results for latency in result)
+    return {
+        'throughput': len(latencies) / elapsed,
+        'p50': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+        'errors': sum(errors for _, errors in results),
+    }
+
+
+def run_mode(mode: str, config_path: str, route: str, requests: int, concurrency: int):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-c', SERVERS[mode], config_path, str(port)], cwd=ROOT,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(port)
+        drive(port, route, min(requests, 100), concurrency)  # warm up
+        return drive(port, route, requests, concurrency)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the throughput of the sync and async serving modes.')
+    parser.add_argument('--config', help='Path of config.ini (default is a seeded SQLite database).')
+    parser.add_argument('--route', default='/books?limit=50', help='Route requested by the clients.')
+    parser.add_argument('--requests', type=int, default=2000, help='Number of requests per mode.')
+    parser.add_argument('--concurrency', type=int, default=32, help='Number of concurrent clients.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.abspath(args.config) if args.config else sqlite_config(directory)
+
+        print(f"{'mode':<8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+        for mode in SERVERS:
+            result = run_mode(mode, config_path, args.route, args.requests, args.concurrency)
+            print(f"{mode:<8}{result['throughput']:>10.1f}{result['p50'] * 1000:>10.1f}"
+                  f"{result['p95'] * 1000:>10.1f}{result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    main()
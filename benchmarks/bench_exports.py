@@ -0,0 +1,125 @@
+"""
+Module Documentation: bench_exports.py
+
+Benchmarks of the /rentals export formats.
+
+Writes the same synthetic rentals, partitioned by start date for the columnar formats, with:
+- pandas csv: the original export_to_csv (pd.DataFrame(data).to_csv of the whole list).
+- csv: app.exports.write_csv, streamed row by row.
+- parquet / arrow: app.exports.write_columnar, in record batches (requires pyarrow).
+
+and reports the best write time, the size on disk and the best time to load the export back
+(pandas.read_csv for CSV, a pyarrow dataset for Parquet, memory-mapped IPC files for Arrow).
+
+Usage:
+    python -m benchmarks.bench_exports --rentals 200000 --days 365 --repeat 3
+
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import timeit
+from datetime import date, timedelta
+
+from app.controllers.historyController import DATED_RENTAL_COLUMNS
+from app.exports import arrow_schema, columnar_available, write_columnar, write_csv
+
+
+def make_rentals(count: int, days: int, seed: int = 0):
+    rng = random.Random(seed)
+    start = date(2023, 1, 1)
+    rows = []
+    for index in range(count):
+        isbn = f'{rng.randrange(10 ** 9):010d}'
+        rows.append({
+            'isbn': isbn, 'title': f'Title {isbn}', 'author': f'Author {rng.randrange(5000)}',
+            'year_of_publication': rng.randrange(1950, 2024), 'publisher': f'Publisher {rng.randrange(500)}',
+            'image_url_s': f'http://images.example.com/{isbn}.01.THUMBZZZ.jpg',
+            'image_url_m': f'http://images.example.com/{isbn}.01.MZZZZZZZ.jpg',
+            'image_url_l': f'http://images.example.com/{isbn}.01.LZZZZZZZ.jpg',
+            'isRented': rng.random() < 0.1, 'rating': rng.randrange(11), 'isAvailable': True, 'copies': 1,
+            'available_copies': 1, 'start_date': start + timedelta(days=index * days // count),
+        })
+    return rows
+
+
+def size_of(path: str):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(folder, name)) for folder, _, names in os.walk(path) for name in names)
+
+
+def remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def pandas_csv(rows, path: str):
+    import pandas as pd
+
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def read_arrow(path: str):
+    import pyarrow as pa
+
+    tables = []
+    for folder, _, names in os.walk(path):
+        for name in names:
+            with pa.memory_map(os.path.join(folder, name)) as source:
+                tables.append(pa.ipc.open_file(source).read_all())
+    return sum(table.num_rows for table in tables)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the CSV, Parquet and Arrow exports of /rentals.')
+    parser.add_argument('--rentals', type=int, default=200000, help='Number of exported rentals.')
+    parser.add_argument('--days', type=int, default=365, help='Number of days (partitions) the rentals span.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs; the best one is reported.')
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    rows = make_rentals(args.rentals, args.days)
+    directory = tempfile.mkdtemp(prefix='bench_exports')
+
+    cases = {
+        'pandas csv': ('export.csv', lambda path: pandas_csv(rows, path), pd.read_csv),
+        'csv': ('export.csv', lambda path: write_csv(rows, path), pd.read_csv),
+    }
+    if columnar_available():
+        import pyarrow.dataset as ds
+
+        schema = arrow_schema(DATED_RENTAL_COLUMNS)
+        cases['parquet'] = ('export.parquet',
+                            lambda path: write_columnar(rows, path, 'parquet', schema, partition_by='start_date'),
+                            lambda path: ds.dataset(path, format='parquet', partitioning='hive').to_table())
+        cases['arrow'] = ('export.arrow',
+                          lambda path: write_columnar(rows, path, 'arrow', schema, partition_by='start_date'),
+                          read_arrow)
+    else:
+        print("pyarrow is not installed, only the CSV paths are measured.")
+
+    try:
+        print(f"{'format':<12}{'write ms':>12}{'size MB':>12}{'read ms':>12}")
+        for name, (filename, write, read) in cases.items():
+            path = os.path.join(directory, filename)
+
+            def run():
+                remove(path)
+                write(path)
+
+            best_write = min(timeit.repeat(run, number=1, repeat=args.repeat))
+            best_read = min(timeit.repeat(lambda: read(path), number=1, repeat=args.repeat))
+            print(f"{name:<12}{best_write * 1000:>12.1f}{size_of(path) / 2 ** 20:>12.2f}{best_read * 1000:>12.1f}")
+            remove(path)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Module Documentation: bench_fees.py
+
+Microbenchmarks of the rental fee calculation.
+
+Compares, for the same set of rentals:
+- pandas scalar: the original calculate_rental_fee (two pd.to_datetime calls per rental).
+- python scalar: app.fees.rental_fee called once per rental.
+- numpy batch: app.fees.batch_rental_fees called once for all rentals.
+
+Usage:
+    python -m benchmarks.bench_fees --rentals 10000 --repeat 5
+
+"""
+import argparse
+import random
+import timeit
+from datetime import date, timedelta
+
+from app.fees import rental_fee, batch_rental_fees
+
+
+def pandas_fee(start: str, end: str):
+    import pandas as pd
+
+    dt0 = pd.to_datetime(start, format='%Y-%m-%d')
+    dt1 = pd.to_datetime(end, format='%Y-%m-%d')
+    days = (dt1 - dt0).days
+
+    if days <= 3:
+        return days * 1
+    return 3 * 1 + (days - 3) * 0.5
+
+
+def make_rentals(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    starts, ends = [], []
+    for _ in range(count):
+        start = date(2020, 1, 1) + timedelta(days=rng.randrange(1500))
+        starts.append(start.isoformat())
+        ends.append((start + timedelta(days=rng.randrange(60))).isoformat())
+    return starts, ends
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the scalar and batch rental fee calculations.')
+    parser.add_argument('--rentals', type=int, default=10000, help='Number of rentals per run.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs; the best one is reported.')
+    args = parser.parse_args()
+
+    starts, ends = make_rentals(args.rentals)
+    pairs = list(zip(starts, ends))
+
+    cases = {
+        'pandas scalar': lambda: [pandas_fee(start, end) for start, end in pairs],
+        'python scalar': lambda: [rental_fee(start, end) for start, end in pairs],
+        'numpy batch': lambda: batch_rental_fees(starts, ends),
+    }
+
+    assert cases['python scalar']() == batch_rental_fees(starts, ends).tolist()
+
+    print(f"{'path':<15}{'best ms':>12}{'us/rental':>12}")
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=args.repeat))
+        print(f"{name:<15}{best * 1000:>12.2f}{best * 1e6 / args.rentals:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
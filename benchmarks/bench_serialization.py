@@ -0,0 +1,110 @@
+"""
+Module Documentation: bench_serialization.py
+
+Benchmarks of the /books serialization, before and after the precompiled serializers and the orjson encoder.
+
+Compares, for the same page of books of a synthetic catalog in SQLite:
+- before: ORM instances, to_dict filtering vars() of every instance, Flask's default JSON provider.
+- after: plain column rows, serialization.rows_to_dicts, serialization.dumps (orjson when installed).
+
+and the same two encoders end to end, for GET /books through the Flask test client.
+
+Usage:
+    python -m benchmarks.bench_serialization --books 20000 --limit 1000 --repeat 20
+
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import insert, select
+
+from app import create_app, serialization
+from app.controllers.bookController import BOOK_FIELDS
+from app.models import db, Book
+from app.serialization import JSONProvider, rows_to_dicts
+
+
+def legacy_to_dict(instance):
+    # to_dict before the precompiled serializers
+    excluded_attributes = ['_sa_instance_state', 'password', 'isAdmin', 'rented_now', 'updated_at']
+    return {key: value.isoformat() if isinstance(value, date) else value
+            for key, value in vars(instance).items() if key not in excluded_attributes}
+
+
+def make_books(count: int):
+    return [{'isbn': f'{index:010d}', 'title': f'Title {index}', 'author': f'Author {index % 5000}',
+             'year_of_publication': 1950 + index % 74, 'publisher': f'Publisher {index % 500}',
+             'image_url_s': f'http://images.example.com/{index}.01.THUMBZZZ.jpg',
+             'image_url_m': f'http://images.example.com/{index}.01.MZZZZZZZ.jpg',
+             'image_url_l': f'http://images.example.com/{index}.01.LZZZZZZZ.jpg',
+             'isRented': False, 'rating': index % 11, 'isAvailable': True, 'copies': 1, 'available_copies': 1}
+            for index in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the /books serialization before and after orjson.')
+    parser.add_argument('--books', type=int, default=20000, help='Number of books in the catalog.')
+    parser.add_argument('--limit', type=int, default=1000, help='Number of books per page.')
+    parser.add_argument('--repeat', type=int, default=20, help='Number of runs; the best one is reported.')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='bench_serialization')
+    config_path = os.path.join(directory, 'config.ini')
+    with open(config_path, 'w') as file:
+        file.write("[Database]\nsecret_key = benchmark-secret-key-for-the-sqlite-database\n\n"
+                   f"[DatabaseURL]\nconnection_db_string = sqlite:///{os.path.join(directory, 'bookstore.db')}\n")
+
+    app = create_app(config_path=config_path)
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(Book), make_books(args.books))
+        db.session.commit()
+
+        default_json = DefaultJSONProvider(app)
+        fast_json = JSONProvider(app)
+
+        def before():
+            db.session.expunge_all()
+            books = Book.query.filter_by(isAvailable=True).order_by(Book.isbn).limit(args.limit).all()
+            return default_json.response({'data': [legacy_to_dict(book) for book in books]}).get_data()
+
+        def after():
+            rows = db.session.execute(select(*BOOK_FIELDS).where(Book.isAvailable).order_by(Book.isbn)
+                                      .limit(args.limit))
+            return fast_json.response({'data': rows_to_dicts(rows)}).get_data()
+
+        assert default_json.loads(before()) == fast_json.loads(after())
+
+        client = app.test_client()
+        route = f'/books?limit={args.limit}'
+
+        def request(provider):
+            def run():
+                app.json = provider
+                return client.get(route).get_data()
+            return run
+
+        encoder = 'orjson' if serialization.orjson is not None else 'json (orjson is not installed)'
+        print(f"{args.limit} books per page, encoder: {encoder}")
+        print(f"{'case':<28}{'best ms':>12}{'us/book':>12}")
+        cases = {
+            'serialize before': before,
+            'serialize after': after,
+            'GET /books default json': request(default_json),
+            'GET /books JSONProvider': request(fast_json),
+        }
+        for name, case in cases.items():
+            best = min(timeit.repeat(case, number=1, repeat=args.repeat))
+            print(f"{name:<28}{best * 1000:>12.2f}{best * 1e6 / args.limit:>12.2f}")
+
+        db.session.remove()
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Module Documentation: bench_startup.py
+
+Startup-time benchmark for the Bookstore API.
+
+Every run starts a fresh Python process (a cold worker) and measures:
+- import: importing the application package.
+- create_app: building the Flask app with the application factory.
+- first_request: serving the first request with the test client.
+
+Usage:
+    python -m benchmarks.bench_startup --config ./config/config.ini --route /books --runs 10
+
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app(config_path=sys.argv[1])
+created = time.perf_counter()
+response = app.test_client().get(sys.argv[2])
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'total': served - started,
+    'status': response.status_code,
+    'pandas_imported': 'pandas' in sys.modules,
+}))
+"""
+
+
+def run_once(config_path: str, route: str):
+    output = subprocess.run([sys.executable, '-c', WORKER, config_path, route],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start import time and time-to-first-request.')
+    parser.add_argument('--config', default='./config/config.ini', help='Path of config.ini.')
+    parser.add_argument('--route', default='/books', help='Route requested by the first request.')
+    parser.add_argument('--runs', type=int, default=10, help='Number of fresh processes to start.')
+    args = parser.parse_args()
+
+    samples = [run_once(os.path.abspath(args.config), args.route) for _ in range(args.runs)]
+
+    print(f"{'phase':<15}{'median ms':>12}{'max ms':>12}")
+    for phase in ('import', 'create_app', 'first_request', 'total'):
+        values = [sample[phase] * 1000 for sample in samples]
+        print(f"{phase:<15}{statistics.median(values):>12.1f}{max(values):>12.1f}")
+
+    print(f"status codes: {sorted({sample['status'] for sample in samples})}")
+    print(f"pandas imported: {any(sample['pandas_imported'] for sample in samples)}")
+
+
+if __name__ == '__main__':
+    main()
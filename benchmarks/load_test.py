@@ -0,0 +1,283 @@
+"""
+Module Documentation: load_test.py
+
+Reproducible load test of the API.
+
+Seeds a synthetic catalog (10k to 10M books) with users and a matching multi-year rental history generated by
+app.synthetic, with Zipfian popularity, starts the API
+in a separate process and drives every scenario with a fixed number of concurrent clients, each keeping one
+connection open:
+- books: GET /books?limit=50
+- book: GET /book/<id>, popular books being requested most, like the rental history
+- rent_return: POST /rent/<id> then PUT /return/<id>?user=<id>, recorded as 'rent' and 'return'
+- rentals: GET /rentals for a random month
+- revenue: GET /revenue?group_by=month for a random year
+
+The p50/p95/p99 latency, throughput and errors (5xx and connection failures) of every scenario are written to a
+JSON results file. With --baseline the results are compared to a stored results file: a scenario regresses when its
+p95 or p99 latency grew, or its throughput dropped, by more than --tolerance; the exit status is then 1.
+
+Without --config a fresh SQLite database is created in a temporary folder. With --config (e.g. a local PostgreSQL
+database) the catalog is seeded into that database, which must be empty, or reused as is with --reuse.
+
+Usage:
+    python -m benchmarks.load_test --books 100000 --concurrency 16 --requests 2000 --output results.json
+    python -m benchmarks.load_test --config ./config/config.ini --books 1000000 --baseline baseline.json
+    python -m benchmarks.load_test --books 10000 --output baseline.json   # store a baseline
+
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app.synthetic import HISTORY_END, HISTORY_YEARS, ZipfSampler, book_isbn, load_dataset, popular_isbn
+from benchmarks.bench_async import ROOT, SERVERS, free_port, wait_until_ready
+
+SCENARIOS = ('books', 'book', 'rent_return', 'rentals', 'revenue')
+
+# First day of the generated rental history
+FIRST_DAY = HISTORY_END - timedelta(days=HISTORY_YEARS * 365)
+
+# Latency percentiles and throughput compared to the baseline
+COMPARED = (('p95_ms', 1), ('p99_ms', 1), ('throughput', -1))
+
+
+def sqlite_config(directory: str):
+    # config.ini of a SQLite database in the folder, with the server's log kept out of the project folder
+    path = os.path.join(directory, 'config.ini')
+    with open(path, 'w') as file:
+        file.write("[Database]\nsecret_key = load-test-secret-key-for-the-sqlite-database\n\n"
+                   f"[DatabaseURL]\nconnection_db_string = sqlite:///{os.path.join(directory, 'bookstore.db')}\n\n"
+                   f"[Logging]\nfile = {os.path.join(directory, 'requests.log')}\nsample_rate = 0.01\n")
+    return path
+
+
+def prepare_database(config_path: str, args):
+    # Seed the database (unless reused) and return the tokens of the admin and of every client
+    from app import create_app
+    from app.controllers.userController import UserService
+    from app.fees import DEFAULT_TIERS
+    from app.models import db, Book, User
+
+    app = create_app(config_path=config_path)
+    with app.app_context():
+        if not args.reuse:
+            db.create_all()
+            if db.session.query(Book.isbn).first() is not None or db.session.query(User.id).first() is not None:
+                raise SystemExit("The database already has books or users: pass --reuse to load test it as is.")
+            started = time.perf_counter()
+            load_dataset(db, args.books, args.users, args.rentals, args.seed,
+                         tiers=app.config.get('PRICING_TIERS', DEFAULT_TIERS))
+            print(f"Seeded {args.books} books, {args.rentals} rentals and {args.users} users "
+                  f"in {time.perf_counter() - started:.1f}s")
+
+        books = db.session.query(Book.isbn).count()
+        dialect = db.engine.dialect.name
+        service = UserService()
+        tokens = {'admin': service.generate_token(1, is_admin=True),
+                  'users': [service.generate_token(2 + client % max(args.users - 1, 1), is_admin=False)
+                            for client in range(args.concurrency)]}
+        db.session.remove()
+    return books, dialect, tokens
+
+
+def percentile(latencies: list, percent: float):
+    # Nearest-rank percentile of sorted latencies
+    return latencies[max(math.ceil(len(latencies) * percent / 100) - 1, 0)]
+
+
+def summary(latencies: list, errors: int, elapsed: float):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def drive(port: int, plan, requests: int, concurrency: int, seed: int):
+    """
+    Send the requests of a scenario from concurrent clients.
+
+    Parameters:
+    - port (int): The port of the server.
+    - plan (callable): plan(rng, client) returns the (name, method, path, headers) requests of one iteration.
+    - requests (int): The number of iterations, shared by the clients.
+    - concurrency (int): The number of clients.
+    - seed (int): The seed of the clients' random generators.
+
+    Returns:
+    - dict: The summary of every request name.
+    """
+
+    def client(index, count):
+        rng = random.Random(seed * 1000 + index)
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        latencies, errors = {}, {}
+        for _ in range(count):
+            for name, method, path, headers in plan(rng, index):
+                started = time.perf_counter()
+                try:
+                    connection.request(method, path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    failed = response.status >= 500
+                except (OSError, http.client.HTTPException):
+                    failed = True
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port)
+                latencies.setdefault(name, []).append(time.perf_counter() - started)
+                errors[name] = errors.get(name, 0) + failed
+        connection.close()
+        return latencies, errors
+
+    shares = [requests // concurrency + (index < requests % concurrency) for index in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(client, range(concurrency), shares))
+    elapsed = time.perf_counter() - started
+
+    names = {name for latencies, _ in results for name in latencies}
+    return {name: summary([latency for latencies, _ in results for latency in latencies.get(name, [])],
+                          sum(errors.get(name, 0) for _, errors in results), elapsed)
+            for name in sorted(names)}
+
+
+def plans(books: int, tokens: dict, users: int):
+    # The requests of one iteration of every scenario
+    admin = {'x-access-token': tokens['admin']}
+
+    popularity = ZipfSampler(books)
+
+    def random_isbn(rng):
+        return book_isbn(rng.randrange(books))
+
+    def month(rng):
+        start = FIRST_DAY + timedelta(days=rng.randrange(HISTORY_YEARS * 365))
+        return f'start={start.replace(day=1)}&end={start.replace(day=28)}'
+
+    def rent_return(rng, client):
+        isbn, user = random_isbn(rng), 2 + client % max(users - 1, 1)
+        return [('rent', 'POST', f'/rent/{isbn}', {'x-access-token': tokens['users'][client]}),
+                ('return', 'PUT', f'/return/{isbn}?user={user}', admin)]
+
+    def revenue(rng, client):
+        year = FIRST_DAY.year + rng.randrange(HISTORY_YEARS)
+        return [('revenue', 'GET', f'/revenue?start={year}-01-01&end={year}-12-31&group_by=month', admin)]
+
+    return {
+        'books': lambda rng, client: [('books', 'GET', '/books?limit=50', {})],
+        'book': lambda rng, client: [('book', 'GET', f'/book/{popular_isbn(popularity.sample(rng), books)}', {})],
+        'rent_return': rent_return,
+        'rentals': lambda rng, client: [('rentals', 'GET', f'/rentals?{month(rng)}', admin)],
+        'revenue': revenue,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Compare results to a baseline.
+
+    Parameters:
+    - results (dict): The results of this run.
+    - baseline (dict): The results of the baseline run.
+    - tolerance (float): The relative change allowed, e.g. 0.2 for 20%.
+
+    Returns:
+    - list: (scenario, metric, baseline, current, change) of every regression.
+    """
+
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric, direction in COMPARED:
+            if not previous.get(metric) or metric not in current:
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            if change * direction > tolerance:
+                regressions.append((name, metric, previous[metric], current[metric], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the API and compare the results to a baseline.')
+    parser.add_argument('--config', help='Path of config.ini (default is a fresh SQLite database).')
+    parser.add_argument('--reuse', action='store_true', help='Load test the database of --config as is.')
+    parser.add_argument('--books', type=int, default=10000, help='Number of books of the synthetic catalog.')
+    parser.add_argument('--rentals', type=int, help='Number of rentals (default is 2 per book).')
+    parser.add_argument('--users', type=int, default=1000, help='Number of users.')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=1000, help='Number of iterations per scenario.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent clients.')
+    parser.add_argument('--server', choices=sorted(SERVERS), default='sync', help='Serving mode.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the catalog and of the clients.')
+    parser.add_argument('--output', default='load_test.json', help='Path of the JSON results file.')
+    parser.add_argument('--baseline', help='JSON results file to compare to.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative change (default 0.2).')
+    args = parser.parse_args()
+    args.users = max(args.users, 2)
+    if args.rentals is None:
+        args.rentals = 2 * args.books
+
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.abspath(args.config) if args.config else sqlite_config(directory)
+        books, dialect, tokens = prepare_database(config_path, args)
+
+        port = free_port()
+        server = subprocess.Popen([sys.executable, '-c', SERVERS[args.server], config_path, str(port)], cwd=ROOT,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_ready(port)
+            scenario_plans = plans(books, tokens, args.users)
+            scenarios = {}
+            for name in args.scenarios:
+                drive(port, scenario_plans[name], min(args.requests, 50), args.concurrency, args.seed)  # warm up
+                scenarios.update(drive(port, scenario_plans[name], args.requests, args.concurrency, args.seed))
+        finally:
+            server.terminate()
+            server.wait()
+
+    results = {
+        'meta': {'time': datetime.now().isoformat(timespec='seconds'), 'database': dialect, 'server': args.server,
+                 'books': books, 'rentals': args.rentals, 'users': args.users, 'requests': args.requests,
+                 'concurrency': args.concurrency, 'seed': args.seed, 'python': platform.python_version()},
+        'scenarios': scenarios,
+    }
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f"{'request':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, result in scenarios.items():
+        print(f"{name:<10}{result.get('throughput', 0):>10.1f}{result.get('p50_ms', 0):>10.1f}"
+              f"{result.get('p95_ms', 0):>10.1f}{result.get('p99_ms', 0):>10.1f}{result['errors']:>8}")
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for name, metric, previous, current, change in regressions:
+            print(f"REGRESSION {name} {metric}: {previous} -> {current} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -17,14 +17,90 @@ class AppConfig:
         else:
             raise FileNotFoundError(f"Config file '{self.config_file}' not found.")
 
-    def configure_app(self, app, db):
+    def configure_app(self, app, db, overrides=None):
         # Configure SQLAlchemy
         db_url = self.config.get('DatabaseURL', 'connection_db_string').format(**self.config['Database'])
         app.config['SQLALCHEMY_DATABASE_URI'] = db_url
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
         app.config['SECRET_KEY'] = self.config.get('Database', 'secret_key')
+        app.config['PRICING_TIERS'] = self.get_pricing_tiers()
+        app.config['RESPONSE_CACHE_TTL'] = self.config.getfloat('Cache', 'ttl', fallback=300)
+        app.config['RESPONSE_CACHE_BACKEND'] = self.get_cache_backend()
+        app.config['DATABASE_POOL'] = self.get_pool_settings()
+        app.config['EXPORT_WORKERS'] = self.config.getint('Exports', 'workers', fallback=2)
+        app.config['EXPORT_DIR'] = self.config.get('Exports', 'directory', fallback='output')
+        app.config['BACKUP_DIR'] = self.config.get('Backup', 'directory', fallback='backups')
+        app.config['BACKUP_COMPRESSION'] = self.config.get('Backup', 'compression', fallback='gzip')
+        app.config['REPLICA_STICKINESS'] = self.config.getfloat('Database', 'replica_stickiness', fallback=5)
+        app.config.update(self.get_logging_settings())
+        app.config['PROFILE_DIR'] = self.config.get('Profiler', 'directory', fallback='profiles')
+        app.config['PROFILE_SAMPLE_RATE'] = self.config.getfloat('Profiler', 'sample_rate', fallback=0.1)
+        app.config['PROFILE_INTERVAL'] = self.config.getfloat('Profiler', 'interval', fallback=0.005)
+        app.config['PROFILE_SLOWEST'] = self.config.getint('Profiler', 'slowest', fallback=20)
+
+        # Optional read replica of the catalog and report routes, see app/replica.py
+        replica_url = self.config.get('DatabaseURL', 'replica_db_string', fallback=None)
+        if replica_url:
+            app.config['SQLALCHEMY_BINDS'] = {'replica': replica_url.format(**self.config['Database'])}
+
+        # Explicit settings (e.g. from tests) win over config.ini
+        app.config.update(overrides or {})
+
+        # Pool size, timeouts and PgBouncer mode of the engine, for the final database URL
+        from app.engine import engine_options
+
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI'],
+                                                                          app.config['DATABASE_POOL']))
 
         db.init_app(app)
 
+    def get_logging_settings(self):
+        # Optional [Logging] section, see app/request_log.py
+        settings = {
+            'LOG_FILE': self.config.get('Logging', 'file', fallback='db.log'),
+            'LOG_LEVEL': self.config.get('Logging', 'level', fallback='INFO').upper(),
+            'LOG_ROTATION': self.config.get('Logging', 'rotation', fallback='size'),
+            'LOG_WHEN': self.config.get('Logging', 'when', fallback='midnight'),
+        }
+        if self.config.has_option('Logging', 'max_bytes'):
+            settings['LOG_MAX_BYTES'] = self.config.getint('Logging', 'max_bytes')
+        if self.config.has_option('Logging', 'backups'):
+            settings['LOG_BACKUPS'] = self.config.getint('Logging', 'backups')
+        if self.config.has_option('Logging', 'sample_rate'):
+            settings['LOG_SAMPLE_RATE'] = self.config.getfloat('Logging', 'sample_rate')
+        if self.config.has_option('Logging', 'queue_size'):
+            settings['LOG_QUEUE_SIZE'] = self.config.getint('Logging', 'queue_size')
+        # Server-Timing response header, on in debug mode by default (see app/metrics.py)
+        if self.config.has_option('Logging', 'server_timing'):
+            settings['SERVER_TIMING'] = self.config.getboolean('Logging', 'server_timing')
+        return settings
+
     def get_secret_key(self):
         return self.config.get('Database', 'secret_key')
+
+    def get_pool_settings(self):
+        # Optional pool settings of the [Database] section, see app/engine.py
+        from app.engine import read_pool_settings
+
+        return read_pool_settings(self.config['Database']) if self.config.has_section('Database') else {}
+
+    def get_pricing_tiers(self):
+        # Optional [Pricing] section, e.g. tiers = 3:1.0, *:0.5
+        from app.fees import parse_tiers, DEFAULT_TIERS
+
+        value = self.config.get('Pricing', 'tiers', fallback=None)
+        return parse_tiers(value) if value else DEFAULT_TIERS
+
+    def get_cache_backend(self):
+        # Optional [Cache] section - backend = local (default) or redis with redis_url
+        if self.config.get('Cache', 'backend', fallback='local') != 'redis':
+            return None
+
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis cache backend requires the 'redis' package.")
+
+        from app.response_cache import RedisCacheBackend
+
+        return RedisCacheBackend(redis.Redis.from_url(self.config.get('Cache', 'redis_url')))
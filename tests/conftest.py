@@ -0,0 +1,62 @@
+import os
+import pytest
+from app import create_app
+from app.models import db
+from app.utilities import token_cache, role_cache
+from app.response_cache import response_cache
+
+
+@pytest.fixture
+def sqlite_app(tmp_path):
+    # Flask app backed by a throwaway SQLite database instead of the PostgreSQL server from config.ini
+    config_file = tmp_path / 'config.ini'
+    config_file.write_text(
+        "[Database]\n"
+        "secret_key = test-secret\n\n"
+        "[DatabaseURL]\n"
+        f"connection_db_string = sqlite:///{tmp_path / 'bookstore.db'}\n"
+    )
+
+    app = create_app(config_path=str(config_file))
+
+    # Cached tokens, roles and responses must not leak between databases
+    token_cache.clear()
+    role_cache.clear()
+    response_cache.clear()
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def postgres_app(tmp_path):
+    # Flask app on the PostgreSQL database of BOOKSTORE_TEST_POSTGRES_URL, for the PostgreSQL only code paths
+    # (COPY, full text search). Skipped when the variable is not set.
+    url = os.environ.get('BOOKSTORE_TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('BOOKSTORE_TEST_POSTGRES_URL is not set')
+    pytest.importorskip('psycopg2')
+
+    config_file = tmp_path / 'config.ini'
+    config_file.write_text(
+        "[Database]\n"
+        "secret_key = test-secret\n\n"
+        "[DatabaseURL]\n"
+        f"connection_db_string = {url}\n"
+    )
+
+    app = create_app(config_path=str(config_file))
+    token_cache.clear()
+    role_cache.clear()
+    response_cache.clear()
+
+    with app.app_context():
+        db.session.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.commit()
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,93 @@
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('httpx')
+pytest.importorskip('aiosqlite')
+pytest.importorskip('greenlet')
+
+from starlette.testclient import TestClient
+from app.asgi import async_database_url, create_asgi_app
+from app.models import db, DailyRevenue, IdempotencyKey, RentedHistory
+from app.controllers.userController import UserService
+from app.utilities import seed_database
+
+
+@pytest.fixture
+def async_client(sqlite_app, tmp_path):
+    # The ASGI app on the database of the sqlite_app fixture
+    seed_database(db)
+    with TestClient(create_asgi_app(config_path=str(tmp_path / 'config.ini'))) as client:
+        yield client
+
+
+def test_async_database_url():
+    url = async_database_url('postgresql+psycopg2://u:p@localhost/books')
+    assert url.render_as_string(hide_password=False) == 'postgresql+asyncpg://u:p@localhost/books'
+    assert str(async_database_url('sqlite:///bookstore.db')) == 'sqlite+aiosqlite:///bookstore.db'
+    with pytest.raises(ValueError):
+        async_database_url('mysql://localhost/books')
+
+
+def test_catalog_matches_sync_app(sqlite_app, async_client):
+    sync_client = sqlite_app.test_client()
+
+    for route in ('/books?limit=5', '/book/074322678X', '/author/Amy Tan', '/date/2002?limit=3'):
+        assert async_client.get(route).json() == sync_client.get(route).json
+
+    next_page = async_client.get('/books?limit=5').json()['next']
+    assert async_client.get(f'/books?limit=5&cursor={next_page}').json() == \
+        sync_client.get(f'/books?limit=5&cursor={next_page}').json
+
+
+def test_rent_and_return(sqlite_app, async_client):
+    user = {'x-access-token': UserService().generate_token(1, is_admin=False)}
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+    assert async_client.post('/rent/074322678X').status_code == 401
+    assert async_client.post('/rent/074322678X', headers=user).status_code == 200
+    assert async_client.post('/rent/074322678X', headers=user).status_code == 400
+
+    assert async_client.put('/return/074322678X', headers=user).status_code == 403
+    response = async_client.put('/return/074322678X', headers=admin)
+    assert response.json()['total revenue'] == 0.0
+
+    rental = RentedHistory.query.filter_by(isbn='074322678X').one()
+    assert rental.end_date is not None and rental.total_cost == 0.0
+
+
+def test_return_batch(sqlite_app, async_client):
+    user = {'x-access-token': UserService().generate_token(1, is_admin=False)}
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+    books = ['074322678X', '1552041778']
+    async_client.post('/rent/batch', json={'isbns': books}, headers=user)
+    rentals_before = db.session.query(db.func.coalesce(db.func.sum(DailyRevenue.rentals), 0)).scalar()
+
+    assert async_client.put('/return/batch', json={'isbns': books}, headers=user).status_code == 403
+    assert async_client.put('/return/batch', json={'isbns': [{'user': 1}]}, headers=admin).status_code == 400
+    response = async_client.put('/return/batch', json={'isbns': [books[0], {'isbn': books[1], 'user': 1}, 'unknown']},
+                                headers=admin)
+
+    assert response.status_code == 200
+    assert response.json()['data'] == [
+        {'isbn': books[0], 'status': 'returned', 'fee': 0.0},
+        {'isbn': books[1], 'status': 'returned', 'fee': 0.0},
+        {'isbn': 'unknown', 'status': 'error', 'message': "Book not found or not currently rented"},
+    ]
+    assert RentedHistory.query.filter(RentedHistory.isbn.in_(books), RentedHistory.end_date.is_(None)).count() == 0
+    assert db.session.query(db.func.sum(DailyRevenue.rentals)).scalar() == rentals_before + 2
+
+
+def test_idempotency_key(sqlite_app, async_client):
+    headers = {'x-access-token': UserService().generate_token(1, is_admin=False), 'Idempotency-Key': 'cart'}
+
+    first = async_client.post('/rent/batch', json={'isbns': ['074322678X']}, headers=headers)
+    replayed = async_client.post('/rent/batch', json={'isbns': ['074322678X']}, headers=headers)
+
+    assert replayed.status_code == first.status_code == 200
+    assert replayed.headers['Idempotent-Replayed'] == 'true' and replayed.json() == first.json()
+    assert RentedHistory.query.filter_by(isbn='074322678X').count() == 1
+    # Another cart with the same key is rejected, by both apps
+    assert async_client.post('/rent/batch', json={'isbns': ['1552041778']}, headers=headers).status_code == 422
+    assert sqlite_app.test_client().post('/rent/batch', json={'isbns': ['1552041778']},
+                                         headers=headers).status_code == 422
+    assert IdempotencyKey.query.count() == 1
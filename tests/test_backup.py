@@ -0,0 +1,86 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, update
+from app.backup import list_backups, restore_backup, run_backup
+from app.controllers.userController import UserService
+from app.models import db, Book, DailyRevenue, RentedHistory, User
+from app.utilities import seed_database
+
+OLD = datetime(2020, 1, 1)
+
+
+def counts():
+    return {model.__tablename__: db.session.query(func.count()).select_from(model).scalar()
+            for model in (User, Book, RentedHistory, DailyRevenue)}
+
+
+def test_full_and_incremental_backup_restore(sqlite_app, tmp_path):
+    seed_database(db)
+    directory = str(tmp_path / 'backups')
+
+    # Rows changed before the first backup
+    for model in (User, Book, RentedHistory):
+        db.session.execute(update(model).values(updated_at=OLD))
+    db.session.commit()
+
+    full = run_backup(db, directory, incremental=True, overlap=timedelta(seconds=1))
+    assert full['mode'] == 'full'
+    assert full['tables']['books']['rows'] == counts()['books']
+    assert full['tables']['books']['file'] == 'books.csv.gz'
+    assert all(stats['bytes'] > 0 for stats in full['tables'].values())
+
+    # One rental and one return after the backup
+    client = sqlite_app.test_client()
+    user = {'x-access-token': UserService().generate_token(1, is_admin=False)}
+    assert client.post('/rent/074322678X', headers=user).status_code == 200
+    # The watermark column is not part of the API
+    assert 'updated_at' not in client.get('/book/074322678X').json['data']
+    expected = counts()
+    rented = db.session.get(Book, '074322678X').available_copies
+
+    incremental = run_backup(db, directory, incremental=True, compression='none',
+                             overlap=timedelta(seconds=1))
+    assert incremental['mode'] == 'incremental'
+    assert incremental['tables']['books']['rows'] == 1
+    assert incremental['tables']['history']['rows'] == 1
+    assert incremental['tables']['users']['rows'] == 0
+    assert [backup['mode'] for backup in list_backups(directory)] == ['full', 'incremental']
+
+    # Restore into an empty database
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    result = restore_backup(db, directory)
+
+    assert result['backups'] == [os.path.basename(full['path']), os.path.basename(incremental['path'])]
+    assert counts() == expected
+    assert db.session.get(Book, '074322678X').available_copies == rented
+    assert db.session.get(User, 1).updated_at == OLD
+
+
+def test_restore_until_and_errors(sqlite_app, tmp_path):
+    seed_database(db)
+    directory = str(tmp_path / 'backups')
+
+    with pytest.raises(ValueError):
+        restore_backup(db, directory)
+    with pytest.raises(ValueError):
+        run_backup(db, directory, compression='lz4')
+
+    first = run_backup(db, directory)
+    run_backup(db, directory)
+    assert restore_backup(db, directory, until=os.path.basename(first['path']))['backups'] == [
+        os.path.basename(first['path'])]
+
+
+def test_backup_route(sqlite_app, tmp_path):
+    seed_database(db)
+    sqlite_app.config['BACKUP_DIR'] = str(tmp_path / 'backups')
+    client = sqlite_app.test_client()
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+    assert client.get('/backup', headers=admin).json['data']['mode'] == 'full'
+    # A second backup the same day is an incremental one instead of being refused
+    assert client.get('/backup', headers=admin).json['data']['mode'] == 'incremental'
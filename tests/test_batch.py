@@ -0,0 +1,68 @@
+from app.models import db, DailyRevenue, RentedHistory
+from app.controllers.userController import UserService
+from app.instrumentation import QueryCounter
+from app.utilities import seed_database
+
+BOOKS = ['074322678X', '1552041778', '1558746218']
+
+
+def test_rent_and_return_batch(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+    user = {'x-access-token': UserService().generate_token(1, is_admin=False)}
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+    with QueryCounter(db.engine) as queries:
+        response = client.post('/rent/batch', json={'isbns': BOOKS + ['unknown', BOOKS[0]]}, headers=user)
+
+    assert response.status_code == 200
+    assert [item['status'] for item in response.json['data']] == ['rented', 'rented', 'rented', 'error', 'error']
+    assert response.json['data'][4]['message'] == "Book is already in the batch"
+    # One UPDATE for the copies and one INSERT for the rentals
+    assert sum(statement.startswith('INSERT INTO history') for statement in queries.statements) == 1
+    assert sum(statement.startswith('UPDATE books') for statement in queries.statements) == 1
+
+    rentals_before = db.session.query(db.func.coalesce(db.func.sum(DailyRevenue.rentals), 0)).scalar()
+    response = client.put('/return/batch', json={'isbns': [BOOKS[0], {'isbn': BOOKS[1], 'user': 1}, 'unknown']},
+                          headers=admin)
+
+    assert response.status_code == 200
+    assert response.json['data'] == [
+        {'isbn': BOOKS[0], 'status': 'returned', 'fee': 0.0},
+        {'isbn': BOOKS[1], 'status': 'returned', 'fee': 0.0},
+        {'isbn': 'unknown', 'status': 'error', 'message': "Book not found or not currently rented"},
+    ]
+    assert RentedHistory.query.filter(RentedHistory.isbn.in_(BOOKS), RentedHistory.end_date.is_(None)).count() == 1
+    assert db.session.query(db.func.sum(DailyRevenue.rentals)).scalar() == rentals_before + 2
+
+
+def test_batch_validation(sqlite_app):
+    client = sqlite_app.test_client()
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+    assert client.post('/rent/batch', json={'isbns': []}, headers=admin).status_code == 400
+    assert client.post('/rent/batch', json={'isbns': ['1'] * 101}, headers=admin).status_code == 400
+    assert client.post('/rent/batch', json={'isbns': [1]}, headers=admin).status_code == 400
+    assert client.put('/return/batch', json={'isbns': [{'user': 1}]}, headers=admin).status_code == 400
+    assert client.put('/return/batch', json=['1'], headers=admin).status_code == 400
+
+
+def test_return_batch_rolls_back_on_database_errors(sqlite_app, monkeypatch):
+    from sqlalchemy.exc import OperationalError
+    from app.controllers.historyController import HistoryService
+
+    seed_database(db)
+    client = sqlite_app.test_client()
+    user = {'x-access-token': UserService().generate_token(1, is_admin=False)}
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+    client.post('/rent/batch', json={'isbns': BOOKS}, headers=user)
+
+    def failing_rollup(*args):
+        raise OperationalError('UPDATE daily_revenue', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(HistoryService, 'add_to_daily_revenue', failing_rollup)
+    response = client.put('/return/batch', json={'isbns': BOOKS}, headers=admin)
+
+    assert response.status_code == 500
+    # The rentals closed before the error are open again
+    assert RentedHistory.query.filter(RentedHistory.isbn.in_(BOOKS), RentedHistory.end_date.is_(None)).count() == 3
@@ -0,0 +1,48 @@
+from app.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expiry():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=10)
+    assert cache.get('a') == 1
+
+    clock.now = 6
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+    assert cache.stats() == {'size': 1, 'hits': 2, 'misses': 1}
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+
+    # 'b' was the least recently used entry
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_ttl_cache_delete_where():
+    cache = TTLCache()
+    cache.set('token-1', {'user_id': 1})
+    cache.set('token-2', {'user_id': 2})
+
+    cache.delete_where(lambda key, value: value['user_id'] == 1)
+
+    assert cache.get('token-1') is None
+    assert cache.get('token-2') == {'user_id': 2}
@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from hashlib import sha256
+from threading import Barrier
+from app.idempotency import IDEMPOTENCY_LEASE
+from app.models import db, IdempotencyKey, RentedHistory
+from app.controllers.userController import UserService
+from app.utilities import seed_database
+
+ISBN = '074322678X'
+THREADS = 16
+
+
+def race(app, requests):
+    # Run the requests at once, every thread with its own client (and so its own session)
+    barrier = Barrier(len(requests))
+
+    def send(request):
+        client = app.test_client()
+        barrier.wait()
+        return request(client)
+
+    with ThreadPoolExecutor(len(requests)) as pool:
+        return list(pool.map(send, requests))
+
+
+def open_rentals(isbn):
+    db.session.expire_all()
+    return RentedHistory.query.filter(RentedHistory.isbn == isbn, RentedHistory.end_date.is_(None)).count()
+
+
+def test_concurrent_rents_rent_once(sqlite_app):
+    seed_database(db)
+    tokens = [UserService().generate_token(user_id, is_admin=False) for user_id in range(1, THREADS + 1)]
+
+    responses = race(sqlite_app, [
+        lambda client, token=token: client.post(f'/rent/{ISBN}', headers={'x-access-token': token})
+        for token in tokens
+    ])
+
+    assert sorted(response.status_code for response in responses) == [200] + [400] * (THREADS - 1)
+    assert open_rentals(ISBN) == 1
+
+
+def test_concurrent_returns_return_once(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+    assert client.post(f'/rent/{ISBN}', headers=admin).status_code == 200
+
+    responses = race(sqlite_app, [lambda client: client.put(f'/return/{ISBN}', headers=admin)] * THREADS)
+
+    assert sorted(response.status_code for response in responses) == [200] + [400] * (THREADS - 1)
+    assert open_rentals(ISBN) == 0
+    assert RentedHistory.query.filter(RentedHistory.isbn == ISBN).count() == 1
+
+
+def test_retries_with_idempotency_key_rent_once(sqlite_app):
+    seed_database(db)
+    headers = {'x-access-token': UserService().generate_token(1, is_admin=False), 'Idempotency-Key': 'cart-42'}
+
+    responses = race(sqlite_app, [lambda client: client.post(f'/rent/{ISBN}', headers=headers)] * THREADS)
+
+    # One request rents the book, the others replay its response or see it still in progress
+    assert {response.status_code for response in responses} <= {200, 409}
+    assert open_rentals(ISBN) == 1
+
+    replay = sqlite_app.test_client().post(f'/rent/{ISBN}', headers=headers)
+    assert replay.status_code == 200
+    assert replay.headers['Idempotent-Replayed'] == 'true'
+    assert replay.json['data'] == 'Book rented successfully'
+    assert open_rentals(ISBN) == 1
+
+
+def test_idempotency_key_is_scoped(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+    user = {'x-access-token': UserService().generate_token(1, is_admin=False), 'Idempotency-Key': 'k'}
+    other_user = {'x-access-token': UserService().generate_token(2, is_admin=False), 'Idempotency-Key': 'k'}
+
+    assert client.post(f'/rent/{ISBN}', headers=user).status_code == 200
+    # Same key for another book is rejected, another user's key is independent
+    assert client.post('/rent/1552041778', headers=user).status_code == 422
+    assert client.post('/rent/1552041778', headers=other_user).status_code == 200
+    assert IdempotencyKey.query.count() == 2
+
+    # Without the header nothing is stored
+    assert client.post(f'/rent/{ISBN}', headers={'x-access-token': user['x-access-token']}).status_code == 400
+    assert IdempotencyKey.query.count() == 2
+
+
+def test_concurrent_rents_of_copies(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+    assert client.put(f'/book/{ISBN}/copies', json={'copies': True}, headers=admin).status_code == 400
+    assert client.put(f'/book/{ISBN}/copies', json={'copies': 3}, headers=admin).json['data']['available_copies'] == 3
+
+    tokens = [UserService().generate_token(user_id, is_admin=False) for user_id in range(1, THREADS + 1)]
+    responses = race(sqlite_app, [
+        lambda client, token=token: client.post(f'/rent/{ISBN}', headers={'x-access-token': token})
+        for token in tokens
+    ])
+
+    assert sorted(response.status_code for response in responses) == [200] * 3 + [400] * (THREADS - 3)
+    assert open_rentals(ISBN) == 3
+
+    book = client.get(f'/book/{ISBN}').json['data']
+    assert (book['available_copies'], book['isAvailable']) == (0, False)
+
+    # Copies rented out can not be removed from stock
+    assert client.put(f'/book/{ISBN}/copies', json={'copies': 2}, headers=admin).status_code == 400
+
+    responses = race(sqlite_app, [lambda client: client.put(f'/return/{ISBN}', headers=admin)] * 5)
+    assert sorted(response.status_code for response in responses) == [200] * 3 + [400] * 2
+    assert open_rentals(ISBN) == 0
+    assert client.get(f'/book/{ISBN}').json['data']['available_copies'] == 3
+
+
+def test_return_copy_of_user(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+    client.put(f'/book/{ISBN}/copies', json={'copies': 2}, headers=admin)
+
+    for user_id in (1, 2):
+        token = UserService().generate_token(user_id, is_admin=False)
+        assert client.post(f'/rent/{ISBN}', headers={'x-access-token': token}).status_code == 200
+
+    assert client.put(f'/return/{ISBN}?user=2', headers=admin).status_code == 200
+    assert [rental.user for rental in RentedHistory.query.filter_by(isbn=ISBN, end_date=None)] == [1]
+    assert client.put(f'/return/{ISBN}?user=2', headers=admin).status_code == 400
+
+
+def test_idempotency_key_is_bound_to_the_body(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+    headers = {'x-access-token': UserService().generate_token(1, is_admin=False), 'Idempotency-Key': 'cart'}
+
+    assert client.post('/rent/batch', json={'isbns': [ISBN]}, headers=headers).status_code == 200
+    assert client.post('/rent/batch', json={'isbns': [ISBN]}, headers=headers).headers['Idempotent-Replayed'] == 'true'
+    # Another cart with the same key is rejected instead of replaying the first cart's response
+    assert client.post('/rent/batch', json={'isbns': ['1552041778']}, headers=headers).status_code == 422
+    assert open_rentals('1552041778') == 0
+
+
+def test_abandoned_idempotency_claim_is_taken_over(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+    headers = {'x-access-token': UserService().generate_token(1, is_admin=False), 'Idempotency-Key': 'crashed'}
+
+    # A request claimed the key and died before storing its response
+    claim = IdempotencyKey('crashed', 1, f'POST /rent/{ISBN} {sha256(b"").hexdigest()}', datetime.now())
+    db.session.add(claim)
+    db.session.commit()
+    assert client.post(f'/rent/{ISBN}', headers=headers).status_code == 409
+
+    claim.created_at = datetime.now() - IDEMPOTENCY_LEASE * 2
+    db.session.commit()
+    response = client.post(f'/rent/{ISBN}', headers=headers)
+
+    assert response.status_code == 200 and 'Idempotent-Replayed' not in response.headers
+    assert open_rentals(ISBN) == 1
+    db.session.expire_all()
+    assert db.session.get(IdempotencyKey, ('crashed', 1)).status_code == 200
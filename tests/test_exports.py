@@ -0,0 +1,172 @@
+import csv
+import io
+import os
+import threading
+from datetime import date
+
+import pytest
+from app.controllers.userController import UserService
+from app.exports import ExportJobs, export_file, export_jobs, write_csv
+from app.models import db
+from app.utilities import seed_database
+
+PERIOD = 'start=2000-01-01&end=2100-01-01'
+
+
+@pytest.fixture
+def admin(sqlite_app, tmp_path, monkeypatch):
+    seed_database(db)
+    monkeypatch.setattr(export_jobs, 'directory', str(tmp_path / 'output'))
+    return {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+
+def test_job_lifecycle(sqlite_app, tmp_path):
+    jobs = ExportJobs(max_workers=1, directory=str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+
+    def rows():
+        started.set()
+        release.wait(5)
+        yield {'isbn': '1', 'title': 'A'}
+
+    job = jobs.submit('Report', rows)
+    assert job['status'] == 'queued'
+    assert started.wait(5)
+    assert jobs.get(job['id'])['status'] == 'running'
+
+    release.set()
+    job = jobs.wait(job['id'], timeout=5)
+    assert (job['status'], job['rows']) == ('done', 1)
+    assert open(job['file']).read().splitlines() == ['isbn,title', '1,A']
+    # Finished jobs keep no future
+    assert job['id'] not in jobs.futures
+
+    # Today's file exists, the second export keeps it
+    assert jobs.wait(jobs.submit('Report', lambda: [{'isbn': '2'}])['id'], timeout=5)['status'] == 'skipped'
+
+    def broken():
+        raise RuntimeError('database gone')
+
+    job = jobs.wait(jobs.submit('Broken', broken)['id'], timeout=5)
+    assert (job['status'], job['error']) == ('failed', 'database gone')
+
+
+def test_export_file_keeps_existing_file(tmp_path):
+    path, count = export_file([{'a': 1}], 'Report', str(tmp_path), key='2023-01-01_2023-01-31')
+    assert count == 1
+
+    assert export_file([{'a': 2}, {'a': 3}], 'Report', str(tmp_path), key='2023-01-01_2023-01-31') == (path, None)
+    assert open(path).read().splitlines() == ['a', '1']
+
+    # Another query of the report gets its own file
+    other, count = export_file([{'a': 2}, {'a': 3}], 'Report', str(tmp_path), key='2023-02-01_2023-02-28')
+    assert other != path and count == 2
+
+
+def test_job_status_is_shared_by_processes(sqlite_app, tmp_path):
+    # Another worker process, with its own ExportJobs, serves the status of the job from its status file
+    jobs, other_worker = ExportJobs(max_workers=1, directory=str(tmp_path)), ExportJobs(directory=str(tmp_path))
+
+    job = jobs.wait(jobs.submit('Report', lambda: [{'isbn': '1'}])['id'], timeout=5)
+    assert other_worker.get(job['id']) == job
+    assert other_worker.get('unknown') is None and other_worker.get('../' * 10 + 'etc/passwd') is None
+
+
+def test_partial_file_removed_on_failure(tmp_path):
+    def rows():
+        yield {'a': 1}
+        raise RuntimeError('cursor closed')
+
+    with pytest.raises(RuntimeError):
+        write_csv(rows(), str(tmp_path / 'report.csv'))
+    assert os.listdir(tmp_path) == []
+
+
+def test_export_route_and_download(sqlite_app, admin):
+    client = sqlite_app.test_client()
+
+    response = client.get(f'/rentals?{PERIOD}&export=true', headers=admin)
+    assert response.status_code == 202
+    job_id = response.headers['X-Export-Job']
+    assert response.json['data']['id'] == job_id
+
+    export_jobs.wait(job_id, timeout=5)
+    status = client.get(f'/exports/{job_id}', headers=admin)
+    assert status.json['data']['status'] == 'done'
+
+    download = client.get(f'/exports/{job_id}?download=true', headers=admin)
+    assert download.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(download.get_data(as_text=True))))
+    assert len(rows) == status.json['data']['rows'] > 0
+
+    # An export of another range on the same day is written to its own file
+    response = client.get('/rentals?start=2100-01-01&end=2100-01-31&export=true', headers=admin)
+    job = export_jobs.wait(response.headers['X-Export-Job'], timeout=5)
+    assert (job['status'], job['rows']) == ('done', 0)
+    assert job['file'] != status.json['data']['file']
+
+    assert client.get('/exports/unknown', headers=admin).status_code == 404
+
+
+@pytest.mark.parametrize('negotiation', [{'query': '&format=csv'}, {'headers': {'Accept': 'text/csv'}}])
+def test_csv_stream(sqlite_app, admin, negotiation):
+    client = sqlite_app.test_client()
+    headers = dict(admin, **negotiation.get('headers', {}))
+
+    response = client.get(f"/rentals?{PERIOD}{negotiation.get('query', '')}", headers=headers)
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert response.mimetype == 'text/csv'
+
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert len(rows) == len(client.get(f'/rentals?{PERIOD}', headers=admin).json['data'])
+
+    revenue = client.get(f"/revenue?{PERIOD}&group_by=month{negotiation.get('query', '')}", headers=headers)
+    assert revenue.get_data(as_text=True).splitlines()[0] == 'month,revenue,rentals'
+
+
+def test_columnar_partitioned_by_date(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.dataset as ds
+    from app.controllers.historyController import DATED_RENTAL_COLUMNS
+    from app.exports import arrow_schema, write_columnar
+
+    rows = [{'isbn': str(i), 'title': None, 'isAvailable': True, 'start_date': date(2023, 1, 1 + i % 3)}
+            for i in range(10)]
+    schema = arrow_schema([column for column in DATED_RENTAL_COLUMNS
+                           if column.key in ('isbn', 'title', 'isAvailable', 'start_date')])
+
+    path = str(tmp_path / 'Rentals.parquet')
+    assert write_columnar(sorted(rows, key=lambda row: row['start_date']), path, 'parquet', schema,
+                          partition_by='start_date', batch_rows=2) == 10
+    assert sorted(os.listdir(path)) == ['start_date=2023-01-01', 'start_date=2023-01-02', 'start_date=2023-01-03']
+
+    table = ds.dataset(path, format='parquet', partitioning='hive').to_table()
+    assert table.num_rows == 10
+    assert table.schema.field('title').type == pa.string()
+    assert table.schema.field('isAvailable').type == pa.bool_()
+
+    # Unordered rows get a part file per run, Arrow files are memory mapped
+    path = str(tmp_path / 'Rentals.arrow')
+    assert write_columnar(rows, path, 'arrow', schema, partition_by='start_date') == 10
+    assert len(os.listdir(os.path.join(path, 'start_date=2023-01-01'))) == 4
+    with pa.memory_map(os.path.join(path, 'start_date=2023-01-01', 'part-0.arrow')) as source:
+        assert pa.ipc.open_file(source).read_all().column('isbn').to_pylist() == ['0']
+
+
+def test_columnar_export_route(sqlite_app, admin):
+    pytest.importorskip('pyarrow')
+    client = sqlite_app.test_client()
+
+    response = client.get(f'/rentals?{PERIOD}&format=parquet', headers=admin)
+    assert response.status_code == 202
+    job = export_jobs.wait(response.headers['X-Export-Job'], timeout=5)
+    assert (job['status'], job['format']) == ('done', 'parquet')
+
+    files = client.get(f"/exports/{job['id']}", headers=admin).json['data']['files']
+    assert all(name.startswith('start_date=') for name in files)
+
+    download = client.get(f"/exports/{job['id']}?download=true&file={files[0]}", headers=admin)
+    assert download.status_code == 200
+    assert download.mimetype == 'application/vnd.apache.parquet'
+    assert client.get(f"/exports/{job['id']}?download=true&file=../x", headers=admin).status_code == 400
@@ -0,0 +1,41 @@
+from datetime import date, timedelta
+
+import pytest
+from app.fees import parse_tiers, rental_fee, batch_rental_fees, DEFAULT_TIERS
+
+
+def legacy_fee(days):
+    # The hardcoded rule of the original calculate_rental_fee
+    if days <= 3:
+        return days * 1
+    return 3 * 1 + (days - 3) * 0.5
+
+
+def test_rental_fee_matches_legacy_rule():
+    start = date(2023, 12, 1)
+    for days in range(0, 40):
+        assert rental_fee(start, start + timedelta(days=days)) == legacy_fee(days)
+
+    assert rental_fee('2023-12-18', '2023-12-21') == 3
+    assert rental_fee('2023-12-21', '2023-12-27') == 4.5
+
+
+def test_batch_rental_fees_matches_scalar():
+    starts = [date(2023, 1, 1) + timedelta(days=i % 17) for i in range(500)]
+    ends = [start + timedelta(days=i % 45) for i, start in enumerate(starts)]
+    tiers = parse_tiers('2:2.0, 7:1.0, *:0.25')
+
+    expected = [rental_fee(start, end, tiers) for start, end in zip(starts, ends)]
+    assert batch_rental_fees(starts, ends, tiers).tolist() == expected
+
+    # Strings are accepted as well
+    assert batch_rental_fees(['2023-12-21'], ['2023-12-27']).tolist() == [4.5]
+
+
+def test_parse_tiers():
+    assert parse_tiers('3:1.0, *:0.5') == DEFAULT_TIERS
+    assert parse_tiers('*:2') == ((None, 2.0),)
+
+    for value in ('3:1.0', '7:1.0, 3:0.5, *:0.1', '*:1.0, 3:0.5', 'abc'):
+        with pytest.raises(ValueError):
+            parse_tiers(value)
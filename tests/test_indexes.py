@@ -0,0 +1,86 @@
+from datetime import date
+from sqlalchemy import or_
+from app.models import db, Book, RentedHistory
+from app.controllers.bookController import AVAILABLE_BOOKS, books_query
+from app.migrations import add_book_copies, create_missing_indexes, drop_outdated_indexes
+
+
+def explain(query):
+    # Query plan of an ORM query or a select as one string, with the bound parameters inlined
+    statement = getattr(query, 'statement', query).compile(db.engine, compile_kwargs={'literal_binds': True})
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('SET LOCAL enable_seqscan = off'))
+        rows = db.session.execute(db.text(f'EXPLAIN {statement}')).all()
+        return '\n'.join(row[0] for row in rows)
+
+    rows = db.session.execute(db.text(f'EXPLAIN QUERY PLAN {statement}')).all()
+    return '\n'.join(row[-1] for row in rows)
+
+
+def test_open_rental_lookup_uses_partial_index(sqlite_app):
+    plan = explain(RentedHistory.query.filter(
+        RentedHistory.isbn == '042511774X',
+        RentedHistory.end_date.is_(None),
+    ))
+
+    assert 'ix_history_open_isbn' in plan
+
+
+def test_user_rentals_use_user_index(sqlite_app):
+    plan = explain(RentedHistory.query.filter_by(user=1, end_date=None))
+
+    assert 'ix_history_user_end_date' in plan
+
+
+def test_period_query_uses_start_date_index(sqlite_app):
+    start, end = date(2023, 12, 15), date(2023, 12, 31)
+
+    plan = explain(RentedHistory.query.filter(
+        RentedHistory.start_date >= start,
+        RentedHistory.start_date <= end,
+        or_(RentedHistory.end_date <= end, RentedHistory.end_date.is_(None)),
+    ))
+
+    assert 'ix_history_start_end_date' in plan
+
+
+def test_create_missing_indexes(sqlite_app):
+    db.session.execute(db.text('DROP INDEX ix_history_open_isbn'))
+    db.session.commit()
+
+    assert create_missing_indexes(db) == ['ix_history_open_isbn']
+    assert create_missing_indexes(db) == []
+
+
+def test_available_books_use_available_index(sqlite_app):
+    plan = explain(books_query(AVAILABLE_BOOKS, after='0', limit=500))
+
+    assert 'ix_books_available_isbn' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_outdated_index_is_replaced(sqlite_app):
+    # The available books index before it became partial
+    db.session.execute(db.text('DROP INDEX ix_books_available_isbn'))
+    db.session.execute(db.text('CREATE INDEX ix_books_available_isbn ON books ("isAvailable", isbn)'))
+    db.session.commit()
+
+    assert drop_outdated_indexes(db) == ['ix_books_available_isbn']
+    assert create_missing_indexes(db) == ['ix_books_available_isbn']
+    assert drop_outdated_indexes(db) == []
+
+
+def test_add_book_copies(sqlite_app):
+    db.session.execute(db.text('ALTER TABLE books DROP COLUMN available_copies'))
+    db.session.execute(db.text('ALTER TABLE books DROP COLUMN copies'))
+    db.session.execute(db.text(
+        "INSERT INTO books (isbn, \"isAvailable\") VALUES ('1', 1), ('2', 0)"
+    ))
+    db.session.commit()
+
+    assert add_book_copies(db) is True
+    assert add_book_copies(db) is False
+    assert [(book.isbn, book.copies, book.available_copies) for book in Book.query.order_by(Book.isbn)] == [
+        ('1', 1, 1), ('2', 1, 0),
+    ]
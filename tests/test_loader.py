@@ -0,0 +1,78 @@
+import os
+from app import loader
+from app.models import db, Book
+from app.loader import bulk_load_books, read_csv_chunks
+
+CATALOG = os.path.join(os.path.dirname(__file__), '..', 'data', 'Books.csv')
+
+
+def test_read_csv_chunks():
+    chunks = list(read_csv_chunks(CATALOG, chunk_size=100))
+
+    assert [len(chunk) for chunk in chunks] == [100, 100, 100, 100, 99]
+
+    book = chunks[0][0]
+    assert book['isbn'] == '074322678X'
+    assert book['year_of_publication'] == 2002
+    assert book['isAvailable'] is True
+
+
+def test_bulk_load_books(sqlite_app):
+    reports = []
+    stats = bulk_load_books(db, CATALOG, chunk_size=200, progress=reports.append)
+
+    assert stats['rows'] == 499
+    assert [report['rows'] for report in reports] == [200, 400, 499]
+    assert Book.query.count() == 499
+
+
+def test_bulk_load_books_upsert(sqlite_app):
+    bulk_load_books(db, CATALOG)
+
+    # A rented book keeps its availability when the catalog is reloaded
+    book = db.session.get(Book, '074322678X')
+    book.isAvailable = False
+    book.title = 'Outdated title'
+    db.session.commit()
+
+    bulk_load_books(db, CATALOG)
+    db.session.expire_all()
+
+    book = db.session.get(Book, '074322678X')
+    assert Book.query.count() == 499
+    assert book.title == "Where You'll Find Me: And Other Stories"
+    assert book.isAvailable is False
+
+
+def reload_keeps_rental_state():
+    # Reload the catalog over a rented book with two copies and an outdated title
+    bulk_load_books(db, CATALOG)
+
+    book = db.session.get(Book, '074322678X')
+    book.isAvailable = False
+    book.copies, book.available_copies = 2, 0
+    book.title = 'Outdated title'
+    db.session.delete(db.session.get(Book, '1552041778'))
+    db.session.commit()
+
+    bulk_load_books(db, CATALOG, chunk_size=100)
+    db.session.expire_all()
+
+    book = db.session.get(Book, '074322678X')
+    assert Book.query.count() == 499
+    assert book.title == "Where You'll Find Me: And Other Stories"
+    assert (book.isAvailable, book.copies, book.available_copies) == (False, 2, 0)
+    assert db.session.get(Book, '1552041778').isAvailable is True
+
+
+def test_bulk_load_books_without_upsert(sqlite_app, monkeypatch):
+    # Dialects without ON CONFLICT update the existing books and insert the new ones
+    monkeypatch.setattr(loader, '_upsert_statement', lambda dialect_name: None)
+
+    reload_keeps_rental_state()
+
+
+def test_bulk_load_books_with_copy(postgres_app):
+    assert db.engine.driver == 'psycopg2'
+
+    reload_keeps_rental_state()
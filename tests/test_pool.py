@@ -0,0 +1,79 @@
+import pytest
+from sqlalchemy import exc
+from app import create_app
+from app.engine import TimedQueuePool, engine_options, pool_stats, read_pool_settings
+from app.models import db
+
+
+@pytest.fixture
+def pooled_app(tmp_path):
+    config_file = tmp_path / 'config.ini'
+    config_file.write_text(
+        "[Database]\n"
+        "secret_key = test-secret-key-for-the-pooled-fixture\n"
+        "pool_size = 1\n"
+        "max_overflow = 1\n"
+        "pool_timeout = 1\n"
+        "pool_recycle = 1800\n"
+        "pool_pre_ping = true\n\n"
+        "[DatabaseURL]\n"
+        f"connection_db_string = sqlite:///{tmp_path / 'bookstore.db'}\n"
+    )
+
+    app = create_app(config_path=str(config_file))
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+def test_pool_settings_from_config(pooled_app):
+    pool = db.engine.pool
+
+    assert isinstance(pool, TimedQueuePool)
+    assert (pool.size(), pool._max_overflow, pool._timeout, pool._recycle, pool._pre_ping) == (1, 1, 1, 1800, True)
+
+
+def test_pool_metrics(pooled_app):
+    client = pooled_app.test_client()
+    client.get('/books')
+    # The request ran in the fixture's app context, release its session's connection
+    db.session.remove()
+
+    # Pool size plus overflow are in use, the next checkout times out
+    first, second = db.engine.connect(), db.engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        db.engine.connect()
+    first.close()
+    second.close()
+
+    stats = pool_stats(db.engine)
+    assert stats['checkouts'] >= 3
+    assert (stats['timeouts'], stats['max_overflow'], stats['checked_out']) == (1, 1, 0)
+    assert stats['wait_seconds'] >= 1
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert 'bookstore_db_pool_timeouts_total 1\n' in response.get_data(as_text=True)
+    assert '# TYPE bookstore_db_pool_checkouts_total counter' in response.get_data(as_text=True)
+
+
+def test_postgres_engine_options():
+    settings = read_pool_settings({'pool_size': '20', 'statement_timeout': '5000', 'pgbouncer': 'no'})
+    options = engine_options('postgresql+psycopg2://u:p@localhost/books', settings)
+    assert options['pool_size'] == 20
+    assert options['connect_args'] == {'options': '-c statement_timeout=5000'}
+
+    # Behind PgBouncer the timeout is set per transaction and asyncpg caches no prepared statements
+    settings['pgbouncer'] = True
+    assert 'connect_args' not in engine_options('postgresql+psycopg2://u:p@localhost/books', settings)
+    connect_args = engine_options('postgresql+asyncpg://u:p@localhost/books', settings, is_async=True)['connect_args']
+    assert (connect_args['statement_cache_size'], connect_args['prepared_statement_cache_size']) == (0, 0)
+    assert connect_args['prepared_statement_name_func']() != connect_args['prepared_statement_name_func']()
+
+
+def test_in_memory_sqlite_keeps_default_pool():
+    assert engine_options('sqlite://', {'pool_size': 5}) == {}
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+from app.controllers import bookController
+from app.controllers.userController import UserService
+from app.models import db
+from app.profiler import request_profiler
+from app.utilities import seed_database
+
+
+@pytest.fixture
+def admin(sqlite_app, tmp_path, monkeypatch):
+    seed_database(db)
+    monkeypatch.setattr(request_profiler, 'directory', str(tmp_path / 'profiles'))
+    monkeypatch.setattr(request_profiler.sampler, 'interval', 0.001)
+    yield {'x-access-token': UserService().generate_token(3, is_admin=True)}
+    request_profiler.configure(False)
+    request_profiler.clear()
+
+
+def test_profiler_is_admin_only(sqlite_app, admin):
+    client = sqlite_app.test_client()
+    user = {'x-access-token': UserService().generate_token(1, is_admin=False)}
+
+    assert client.get('/profiler').status_code == 401
+    assert client.put('/profiler', json={'enabled': True}, headers=user).status_code == 403
+    assert client.put('/profiler', json={'enabled': 'yes'}, headers=admin).status_code == 400
+    assert client.put('/profiler', json={'enabled': True, 'sample_rate': 2}, headers=admin).status_code == 400
+    assert client.put('/profiler', json={'enabled': True, 'routes': '/books'}, headers=admin).status_code == 400
+    assert request_profiler.enabled is False
+
+
+def test_profiled_routes(sqlite_app, admin, monkeypatch, tmp_path):
+    page = bookController.books_page
+
+    def slow_page(rows, limit):
+        time.sleep(0.03)
+        return page(rows, limit)
+
+    monkeypatch.setattr(bookController, 'books_page', slow_page)
+    monkeypatch.setattr(request_profiler, 'max_slowest', 1)
+    client = sqlite_app.test_client()
+
+    response = client.put('/profiler', json={'enabled': True, 'sample_rate': 1, 'routes': ['/books']}, headers=admin)
+    assert response.json['data']['enabled'] is True
+
+    client.get('/books?limit=1')
+    client.get('/books?limit=2')
+    client.get('/book/074322678X')
+
+    status = client.get('/profiler', headers=admin).json['data']
+    assert status['profiled'] == {'/books': 2}
+    assert status['samples']['/books'] > 0
+    # Only the slowest request is kept
+    assert [profile['route'] for profile in status['slowest']] == ['/books']
+
+    stacks = client.get('/profiler/stacks?route=/books', headers=admin).get_data(as_text=True)
+    assert 'routes.py:get_all_books;' in stacks and 'test_profiler.py:slow_page' in stacks
+    slowest = client.get(f"/profiler/stacks?id={status['slowest'][0]['id']}", headers=admin)
+    assert 'test_profiler.py:slow_page' in slowest.get_data(as_text=True)
+    assert client.get('/profiler/stacks?route=/book/<id>', headers=admin).status_code == 404
+
+    # Turning it off writes the flamegraph input of every route
+    files = client.put('/profiler', json={'enabled': False}, headers=admin).json['data']['files']
+    assert [path.rsplit('/', 1)[-1] for path in files] == ['books.collapsed']
+    assert (tmp_path / 'profiles' / 'books.collapsed').read_text() == stacks
+
+
+def test_failed_request_stops_sampling(sqlite_app, admin, monkeypatch):
+    def broken_page(rows, limit):
+        raise RuntimeError('serializer bug')
+
+    monkeypatch.setattr(bookController, 'books_page', broken_page)
+    # The exception propagates to the client, Flask runs no after_request hook
+    monkeypatch.setattr(sqlite_app, 'testing', True)
+    client = sqlite_app.test_client()
+    client.put('/profiler', json={'enabled': True, 'sample_rate': 1, 'routes': ['/books']}, headers=admin)
+
+    with pytest.raises(RuntimeError):
+        client.get('/books?limit=1')
+
+    # The thread is no longer sampled, the request is profiled as a server error
+    assert request_profiler.sampler.threads == {}
+    assert [profile['status'] for profile in request_profiler.status()['slowest']] == [500]
@@ -0,0 +1,35 @@
+import pytest
+from app.models import db
+from app.utilities import seed_database
+from app.instrumentation import QueryCounter
+from app.controllers.userController import UserService
+
+
+@pytest.fixture
+def seeded_client(sqlite_app):
+    seed_database(db)
+    return sqlite_app.test_client()
+
+
+@pytest.fixture
+def admin_headers(sqlite_app):
+    return {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+
+def test_rentals_single_query(seeded_client, admin_headers):
+    with QueryCounter(db.engine) as queries:
+        response = seeded_client.get('/rentals?start=2023-12-01&end=2023-12-31', headers=admin_headers)
+
+    assert response.status_code == 200
+    assert len(response.get_json()['data']) == 4
+    assert queries.count <= 1
+
+
+def test_user_profile_without_lazy_loads(seeded_client, admin_headers):
+    with QueryCounter(db.engine) as queries:
+        response = seeded_client.get('/users/1', headers=admin_headers)
+
+    data = response.get_json()['data']
+    assert response.status_code == 200
+    assert [book['isbn'] for book in data['rented_books']] == ['1853262404']
+    assert queries.count <= 2
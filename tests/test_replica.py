@@ -0,0 +1,99 @@
+import time
+from datetime import date
+
+import pytest
+from sqlalchemy import insert, select, update
+from app import create_app
+from app.models import db, Book, DailyRevenue, RentedHistory
+from app.controllers.historyController import HistoryService
+from app.controllers.userController import UserService
+from app.replica import REPLICA_BIND, read_replica
+from app.response_cache import response_cache
+
+STICKINESS = 0.5
+
+BOOK = {'isbn': '074322678X', 'title': "Where You'll Find Me", 'author': 'Ann Beattie', 'year_of_publication': 2002,
+        'publisher': 'Scribner', 'image_url_s': '', 'image_url_m': '', 'image_url_l': '', 'isRented': False,
+        'rating': 0, 'isAvailable': True, 'copies': 1, 'available_copies': 1}
+
+
+@pytest.fixture
+def replica_app(tmp_path):
+    # Two SQLite databases standing in for the primary and its replica
+    config_file = tmp_path / 'config.ini'
+    config_file.write_text(
+        "[Database]\n"
+        "secret_key = test-secret-key-for-the-replica-fixture\n"
+        f"replica_stickiness = {STICKINESS}\n\n"
+        "[DatabaseURL]\n"
+        f"connection_db_string = sqlite:///{tmp_path / 'primary.db'}\n"
+        f"replica_db_string = sqlite:///{tmp_path / 'replica.db'}\n"
+    )
+
+    app = create_app(config_path=str(config_file))
+    response_cache.clear()
+    read_replica.writers.clear()
+
+    # Requests push their own app context, so the requesting user does not leak between them
+    with app.app_context():
+        for engine in (db.engines[None], db.engines[REPLICA_BIND]):
+            db.metadata.create_all(engine)
+            with engine.begin() as connection:
+                connection.execute(insert(Book), [BOOK])
+
+        # The replica has its own copy of the title, to tell the two databases apart
+        with db.engines[REPLICA_BIND].begin() as connection:
+            connection.execute(update(Book).values(title='Replica'))
+
+    yield app
+
+    with app.app_context():
+        for engine in (db.engines[None], db.engines[REPLICA_BIND]):
+            db.metadata.drop_all(engine)
+
+    # init_app registered an (empty) metadata for the bind on the shared db, later apps have no such bind
+    db.metadatas.pop(REPLICA_BIND)
+
+
+def test_read_your_writes(replica_app):
+    client = replica_app.test_client()
+    with replica_app.app_context():
+        user = {'x-access-token': UserService().generate_token(1, is_admin=False)}
+
+    assert client.get('/book/074322678X', headers=user).get_json()['data']['title'] == 'Replica'
+    assert client.get('/books').get_json()['data'][0]['title'] == 'Replica'
+
+    # Writes go to the primary, the replica has not caught up yet
+    assert client.post('/rent/074322678X', headers=user).status_code == 200
+    with replica_app.app_context():
+        assert db.session.get(Book, '074322678X').available_copies == 0
+        with db.engines[REPLICA_BIND].connect() as connection:
+            assert connection.execute(select(Book.available_copies)).scalar() == 1
+
+    # The user who wrote reads from the primary, others from the replica
+    own = client.get('/book/074322678X', headers=user)
+    assert own.get_json()['data']['title'] == "Where You'll Find Me"
+    assert own.get_json()['data']['isAvailable'] is False
+    assert client.get('/book/074322678X').get_json()['data']['isAvailable'] is True
+
+    time.sleep(STICKINESS)
+
+    # After the stickiness window the user reads from the replica again, the stale cached response expired
+    response = client.get('/book/074322678X', headers=user)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['data']['title'] == 'Replica'
+
+
+def test_reports_read_from_replica(replica_app):
+    with replica_app.app_context():
+        with db.engines[REPLICA_BIND].begin() as connection:
+            connection.execute(insert(RentedHistory), [{'isbn': BOOK['isbn'], 'user': 1, 'total_cost': 4.5,
+                                                        'start_date': date(2023, 1, 2), 'end_date': date(2023, 1, 5)}])
+            connection.execute(insert(DailyRevenue), [{'day': date(2023, 1, 5), 'revenue': 4.5, 'rentals': 1}])
+
+        assert HistoryService().calculate_total_rental_fee('2023-01-01', '2023-01-31') == 4.5
+        assert len(HistoryService().get_all_rented_books_for_period('2023-01-01', '2023-01-31', 'list')) == 1
+        assert len(list(HistoryService().stream_rented_books('2023-01-01', '2023-01-31'))) == 1
+
+        # Without the decorator queries go to the primary
+        assert RentedHistory.query.count() == 0
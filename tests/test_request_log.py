@@ -0,0 +1,88 @@
+import json
+import logging
+import queue
+
+import pytest
+from app import create_app
+from app.controllers.userController import UserService
+from app.models import db
+from app.request_log import DroppingQueueHandler, configure_logging, request_log
+from app.utilities import seed_database
+
+
+def make_app(tmp_path, logging_settings: str):
+    config_file = tmp_path / 'config.ini'
+    config_file.write_text(
+        "[Database]\n"
+        "secret_key = test-secret-key-for-the-logging-fixture\n\n"
+        "[DatabaseURL]\n"
+        f"connection_db_string = sqlite:///{tmp_path / 'bookstore.db'}\n\n"
+        f"[Logging]\nfile = {tmp_path / 'requests.log'}\n{logging_settings}"
+    )
+    return create_app(config_path=str(config_file))
+
+
+def records(tmp_path):
+    # Wait until the listener thread wrote every queued record
+    request_log.handler.queue.join()
+    lines = (tmp_path / 'requests.log').read_text().splitlines()
+    return [record for record in map(json.loads, lines) if record['logger'] == 'bookstore.requests']
+
+
+@pytest.fixture
+def logged_app(tmp_path):
+    app = make_app(tmp_path, "")
+    with app.app_context():
+        db.create_all()
+        seed_database(db)
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def test_request_records(logged_app, tmp_path):
+    client = logged_app.test_client()
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+    client.get('/books?limit=1')
+    client.get('/rentals?start=2023-01-01&end=2023-12-31', headers=admin)
+
+    books, rentals = records(tmp_path)
+    assert (books['method'], books['route'], books['status'], books['user_id']) == ('GET', '/books', 200, None)
+    assert books['path'] == '/books?limit=1'
+    assert books['latency_ms'] >= 0
+    assert (rentals['route'], rentals['user_id']) == ('/rentals', 3)
+
+
+def test_successful_get_requests_are_sampled(tmp_path):
+    app = make_app(tmp_path, "sample_rate = 0\n")
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+
+        client.get('/books')
+        client.get('/rentals')
+        client.post('/login', json={})
+
+        assert [(record['route'], record['status']) for record in records(tmp_path)] == [
+            ('/rentals', 401), ('/login', 401)]
+        db.drop_all()
+
+
+def test_full_queue_drops_records():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'message', None, None)
+
+    for _ in range(3):
+        handler.emit(record)
+    assert handler.dropped == 2
+
+
+def test_size_rotation(tmp_path):
+    handler = configure_logging({'LOG_FILE': str(tmp_path / 'app.log'), 'LOG_MAX_BYTES': 200, 'LOG_BACKUPS': 2})
+    for number in range(20):
+        logging.getLogger('test').info('record %s', number)
+    handler.queue.join()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['app.log', 'app.log.1', 'app.log.2']
+    assert json.loads((tmp_path / 'app.log').read_text().splitlines()[-1])['message'] == 'record 19'
@@ -0,0 +1,53 @@
+from app.controllers.userController import UserService
+from app.metrics import Histogram, request_metrics
+from app.models import db
+from app.utilities import seed_database
+
+PERIOD = 'start=2000-01-01&end=2100-01-01'
+
+
+def test_histogram_buckets():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.samples({'route': '/books'}) == [
+        ('_bucket', {'route': '/books', 'le': 0.1}, 2),
+        ('_bucket', {'route': '/books', 'le': 1.0}, 3),
+        ('_bucket', {'route': '/books', 'le': '+Inf'}, 4),
+        ('_sum', {'route': '/books'}, 5.65),
+        ('_count', {'route': '/books'}, 4),
+    ]
+
+
+def test_route_metrics(sqlite_app):
+    seed_database(db)
+    request_metrics.clear()
+    client = sqlite_app.test_client()
+    admin = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+    for _ in range(2):
+        assert client.get(f'/rentals?{PERIOD}', headers=admin).status_code == 200
+    client.get('/book/074322678X')
+    client.get('/rentals')
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'bookstore_http_request_duration_seconds_count{route="/rentals",method="GET"} 3\n' in text
+    assert 'bookstore_http_request_duration_seconds_bucket{route="/rentals",method="GET",le="+Inf"} 3\n' in text
+    assert 'bookstore_http_requests_total{route="/rentals",method="GET",status="401"} 1\n' in text
+    assert 'bookstore_http_requests_total{route="/book/<id>",method="GET",status="200"} 1\n' in text
+
+    samples = dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+    assert int(samples['bookstore_db_statements_total{route="/rentals",method="GET"}']) >= 2
+    assert float(samples['bookstore_db_seconds_total{route="/rentals",method="GET"}']) > 0
+    assert float(samples['bookstore_serialization_seconds_total{route="/rentals",method="GET"}']) > 0
+
+
+def test_server_timing_header(sqlite_app):
+    client = sqlite_app.test_client()
+    assert 'Server-Timing' not in client.get('/books').headers
+
+    sqlite_app.config['SERVER_TIMING'] = True
+    timing = client.get('/books').headers['Server-Timing']
+    assert timing.startswith('db;dur=') and 'desc="1 queries"' in timing
+    assert 'serialize;dur=' in timing and 'total;dur=' in timing
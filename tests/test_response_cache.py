@@ -0,0 +1,112 @@
+import fnmatch
+import os
+import pytest
+from app.models import db, Book
+from app.response_cache import response_cache, RedisCacheBackend, LocalCacheBackend
+from app.utilities import seed_database
+from app.controllers.userController import UserService
+
+CATALOG = os.path.join(os.path.dirname(__file__), '..', 'data', 'Books.csv')
+
+
+class FakeRedis:
+    # Local stand-in for redis.Redis - the subset used by RedisCacheBackend, without expiry
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, pattern)]
+
+
+@pytest.fixture(params=['local', 'redis'])
+def client(sqlite_app, request):
+    seed_database(db)
+    previous = response_cache.backend
+    response_cache.backend = LocalCacheBackend() if request.param == 'local' else RedisCacheBackend(FakeRedis())
+    yield sqlite_app.test_client()
+    response_cache.backend = previous
+
+
+def test_cache_hit_and_etag(client):
+    first = client.get('/book/074322678X')
+    second = client.get('/book/074322678X')
+
+    assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+    assert first.get_json() == second.get_json()
+    assert first.headers['ETag'] == second.headers['ETag']
+
+    not_modified = client.get('/book/074322678X', headers={'If-None-Match': first.headers['ETag']})
+    assert not_modified.status_code == 304
+    assert response_cache.stats()['hits'] == 2
+
+
+def test_rent_and_return_invalidate(client):
+    book = db.session.get(Book, '074322678X')
+    author_route = f'/author/{book.author}'
+
+    assert client.get('/book/074322678X').get_json()['data']['isAvailable'] is True
+    client.get(author_route)
+
+    user_token = UserService().generate_token(1, is_admin=False)
+    assert client.post('/rent/074322678X', headers={'x-access-token': user_token}).status_code == 200
+
+    response = client.get('/book/074322678X')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['data']['isAvailable'] is False
+    assert client.get(author_route).headers['X-Cache'] == 'MISS'
+
+    admin_token = UserService().generate_token(3, is_admin=True)
+    assert client.put('/return/074322678X', headers={'x-access-token': admin_token}).status_code == 200
+    assert client.get('/book/074322678X').get_json()['data']['isAvailable'] is True
+
+
+def test_cache_key_includes_accept(client):
+    book = db.session.get(Book, '074322678X')
+    route = f'/author/{book.author}'
+
+    assert client.get(route).headers['X-Cache'] == 'MISS'
+    # A JSON response is not served to a client asking for the ndjson stream
+    streamed = client.get(route, headers={'Accept': 'application/x-ndjson'})
+    assert streamed.mimetype == 'application/x-ndjson' and 'X-Cache' not in streamed.headers
+    cached = client.get(route)
+    assert cached.headers['X-Cache'] == 'HIT' and 'Accept' in cached.headers['Vary']
+
+
+def test_catalog_load_invalidates(client):
+    from app.loader import load_book_chunks, read_csv_chunks
+
+    client.get('/book/074322678X')
+    book = next(read_csv_chunks(CATALOG, chunk_size=1))[0]
+    load_book_chunks(db, [[dict(book, title='New title')]])
+    response = client.get('/book/074322678X')
+
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['data']['title'] == 'New title'
+
+
+def test_local_generations_are_pruned():
+    now = [0.0]
+    backend = LocalCacheBackend(clock=lambda: now[0])
+    backend.set('key', 'value', ttl=10)
+
+    backend.incr('book:1')
+    now[0] = 5
+    backend.incr('book:2')
+    assert (backend.generation('book:1'), backend.generation('book:2')) == (1, 1)
+
+    # Tags not bumped for longer than twice the longest TTL restart from 0
+    now[0] = 24
+    backend.incr('book:3')
+    assert set(backend.generations) == {'book:2', 'book:3'}
@@ -0,0 +1,84 @@
+from datetime import date
+from app.models import db, Book, DailyRevenue, RentedHistory
+from app.controllers.historyController import HistoryService
+from app.migrations import rebuild_daily_revenue
+from app.utilities import seed_database
+
+
+def test_total_revenue_is_summed_in_sql(sqlite_app):
+    seed_database(db)
+    history = HistoryService()
+
+    assert history.calculate_total_rental_fee('2023-12-15', '2023-12-31') == 7.5
+    assert history.calculate_total_rental_fee('2023-01-01', '2023-02-31') == 0
+
+
+def test_revenue_breakdown(sqlite_app):
+    seed_database(db)
+    history = HistoryService()
+
+    assert history.calculate_revenue_breakdown('2023-12-01', '2023-12-31', 'day') == [
+        {'day': '2023-12-21', 'revenue': 3.0, 'rentals': 1},
+        {'day': '2023-12-27', 'revenue': 4.5, 'rentals': 1},
+    ]
+    assert history.calculate_revenue_breakdown('2023-12-01', '2023-12-31', 'week') == [
+        {'week': '2023-12-18', 'revenue': 3.0, 'rentals': 1},
+        {'week': '2023-12-25', 'revenue': 4.5, 'rentals': 1},
+    ]
+    assert history.calculate_revenue_breakdown('2023-01-01', '2024-12-31', 'month') == [
+        {'month': '2023-12-01', 'revenue': 7.5, 'rentals': 2},
+    ]
+
+    # Every breakdown adds up to the total, open rentals have no fee yet
+    total = history.calculate_total_rental_fee('2023-12-01', '2023-12-31')
+    for group_by in ('day', 'week', 'month', 'author', 'publisher'):
+        rows = history.calculate_revenue_breakdown('2023-12-01', '2023-12-31', group_by)
+        assert sum(row['revenue'] for row in rows) == total == 7.5
+        assert sum(row['rentals'] for row in rows) == 2
+
+
+def test_revenue_counts_on_the_return_day(sqlite_app):
+    seed_database(db)
+    history = HistoryService()
+    # Rented in November, returned in December
+    db.session.add(RentedHistory(6.0, date(2023, 11, 28), date(2023, 12, 5), '074322678X', 1))
+    db.session.commit()
+    rebuild_daily_revenue(db)
+
+    assert history.calculate_total_rental_fee('2023-11-01', '2023-11-30') == 0
+    assert history.calculate_total_rental_fee('2023-12-01', '2023-12-31') == 13.5
+    by_publisher = history.calculate_revenue_breakdown('2023-12-01', '2023-12-31', 'publisher')
+    assert sum(row['revenue'] for row in by_publisher) == 13.5
+
+
+def test_return_book_updates_rollup(sqlite_app):
+    seed_database(db)
+    book = db.session.get(Book, '074322678X')
+    db.session.add(RentedHistory(0, date(2020, 1, 1), None, book.isbn, 1))
+    db.session.commit()
+
+    response = HistoryService().return_book(db, book.isbn)
+    fee = response.get_json()['total revenue']
+
+    rollup = db.session.get(DailyRevenue, date.today())
+    assert (rollup.revenue, rollup.rentals) == (fee, 1)
+
+    # The incremental rollup matches a full rebuild
+    rebuild_daily_revenue(db)
+    db.session.expire_all()
+    assert db.session.get(DailyRevenue, date.today()).revenue == fee
+
+
+def test_revenue_route_group_by(sqlite_app):
+    from app.controllers.userController import UserService
+
+    seed_database(db)
+    client = sqlite_app.test_client()
+    headers = {'x-access-token': UserService().generate_token(3, is_admin=True)}
+
+    response = client.get('/revenue?start=2023-12-01&end=2023-12-31&group_by=month', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['data'] == [{'month': '2023-12-01', 'revenue': 7.5, 'rentals': 2}]
+
+    response = client.get('/revenue?start=2023-12-01&end=2023-12-31&group_by=isbn', headers=headers)
+    assert response.status_code == 400
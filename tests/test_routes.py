@@ -1,26 +1,16 @@
+import json
 import pytest
-from flask import Flask
+from app import create_app
 from app.models import db
-from app.routes import main_app
-from app.utilities import import_data
+from app.utilities import seed_database
 from app.controllers.userController import UserService
 from app.controllers.historyController import HistoryService
-from config.Config import AppConfig
 
-app = Flask(__name__)
+app = create_app(config_path='../config/config.ini')
 
-config = AppConfig(path = '../config/config.ini')
-config.configure_app(app, db)
-
-app.register_blueprint(main_app)
-
-# Create the database tables
+# Create the database tables and sample data - a no-op once the database is seeded
 with app.app_context():
-    try:
-        db.create_all()
-        import_data(db)
-    except Exception as e:
-        print('Loading Database and Tables...')
+    seed_database(db)
 
 
 @pytest.fixture
@@ -191,3 +181,34 @@ def test_get_total_revenue_invalid_dates(client):
         assert 'total revenue' in data and data['total revenue'] == 0
         assert 'status' in data and data['status'] == 'success'
         assert 'status code' in data and data['status code'] == 200
+
+
+def test_get_all_books_paginated(client):
+    # Walk the listing page by page with the 'next' cursor
+    isbns = []
+    route = '/books?limit=100'
+    while route:
+        data = client.get(route).get_json()
+        assert len(data['data']) <= 100
+        isbns.extend(book['isbn'] for book in data['data'])
+        route = f"/books?limit=100&cursor={data['next']}" if 'next' in data else None
+
+    assert isbns == sorted(isbns)
+    assert len(isbns) == len(set(isbns)) > 480
+
+
+def test_get_books_invalid_page_args(get_response):
+    get_response('/books?limit=0', expected_status_code=400)
+    get_response('/books?limit=abc', expected_status_code=400)
+    get_response('/books?cursor=not-a-cursor', expected_status_code=400)
+
+
+def test_get_books_by_author_ndjson(client):
+    response = client.get('/author/Amy Tan?format=ndjson')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    books = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(books) > 0
+    assert all(book['author'] == 'Amy Tan' for book in books)
@@ -0,0 +1,175 @@
+from app.models import db, Book
+from app.controllers.searchController import InMemorySearchEngine, SearchService
+from app.utilities import encode_cursor, seed_database
+from sqlalchemy.dialects import postgresql
+import pytest
+import threading
+
+BOOKS = [
+    {'isbn': '1', 'title': 'The Kitchen God\'s Wife', 'author': 'Amy Tan', 'publisher': 'Ivy Books',
+     'year_of_publication': 1992, 'isAvailable': True},
+    {'isbn': '2', 'title': 'The Joy Luck Club', 'author': 'Amy Tan', 'publisher': 'Ivy Books',
+     'year_of_publication': 1990, 'isAvailable': False},
+    {'isbn': '3', 'title': 'Kitchen Confidential', 'author': 'Anthony Bourdain', 'publisher': 'Ecco',
+     'year_of_publication': 2000, 'isAvailable': True},
+]
+
+
+def test_in_memory_engine_ranks_matches():
+    engine = InMemorySearchEngine(BOOKS)
+
+    # Every word must match; the rarer word 'tan' ranks above the common 'the'
+    assert [book['isbn'] for book in engine.search('kitchen tan', {}, 0, 10)] == ['1']
+    assert [book['isbn'] for book in engine.search('kitchen', {}, 0, 10)] == ['1', '3']
+    assert engine.search('kitchen', {'author': 'Anthony Bourdain'}, 0, 10)[0]['isbn'] == '3'
+    assert engine.search('tan', {'isAvailable': False}, 0, 10)[0]['isbn'] == '2'
+
+
+def test_in_memory_engine_tolerates_typos():
+    engine = InMemorySearchEngine(BOOKS)
+
+    assert [book['isbn'] for book in engine.search('Bourdian', {}, 0, 10)] == ['3']
+    assert engine.search('zzzz', {}, 0, 10) == []
+
+    engine.remove('3')
+    assert engine.search('Bourdain', {}, 0, 10) == []
+
+
+class Rows(list):
+    # Empty result of the statements run by PostgresSearchEngine, scalar() answers the exact match check
+    def __init__(self, exact_matches: bool):
+        super().__init__()
+        self.exact_matches = exact_matches
+
+    def scalar(self):
+        return self.exact_matches
+
+
+def search_statements(monkeypatch, exact_matches: bool, offset: int):
+    # The SQL of the statements PostgresSearchEngine runs for a page past the results
+    from app.controllers.searchController import PostgresSearchEngine
+
+    statements = []
+    monkeypatch.setattr(db.session, 'execute', lambda statement: statements.append(statement) or Rows(exact_matches))
+    PostgresSearchEngine().search('amy tan', {}, offset, 10)
+    return [str(statement.compile(dialect=postgresql.dialect())) for statement in statements]
+
+
+def test_postgres_query_uses_search_document(monkeypatch):
+    from app.controllers.searchController import BOOK_SEARCH_DOCUMENT
+
+    # The query matches with the expression of the ix_books_search GIN index, so PostgreSQL can use it
+    sql = search_statements(monkeypatch, exact_matches=True, offset=20)
+    document = str(BOOK_SEARCH_DOCUMENT.compile(dialect=postgresql.dialect()))
+    assert f'{document} @@ websearch_to_tsquery' in sql[0] and f'ts_rank({document}' in sql[0]
+
+    # Past the last exact match there is no fallback, without any exact match later pages are fallback pages
+    assert len(sql) == 2 and 'EXISTS' in sql[1]
+    sql = search_statements(monkeypatch, exact_matches=False, offset=20)
+    assert len(sql) == 3 and 'word_similarity' in sql[2] and 'OFFSET' in sql[2]
+
+
+def test_in_memory_engine_pages_through_typo_matches():
+    books = [{'isbn': str(number), 'title': f'Harry Potter {number}', 'author': 'J. K. Rowling',
+              'publisher': 'Scholastic', 'year_of_publication': 2000, 'isAvailable': True} for number in range(10)]
+    engine = InMemorySearchEngine(books)
+
+    everything = engine.search('hary', {}, 0, 100)
+    pages = [engine.search('hary', {}, offset, 4) for offset in range(0, 12, 4)]
+    assert [len(page) for page in pages] == [4, 4, 2]
+    assert [book['isbn'] for page in pages for book in page] == [book['isbn'] for book in everything]
+
+
+def test_in_memory_engine_is_thread_safe():
+    engine = InMemorySearchEngine(BOOKS)
+    stop = threading.Event()
+
+    def reindex():
+        number = 0
+        while not stop.is_set():
+            number += 1
+            engine.add({'isbn': str(100 + number % 50), 'title': f'Kitchen book {number}', 'author': 'Amy Tan'})
+            engine.remove(str(100 + (number + 25) % 50))
+
+    writer = threading.Thread(target=reindex)
+    writer.start()
+    try:
+        for _ in range(300):
+            engine.search('kitchen', {}, 0, 10)
+            engine.search('kitchn', {}, 0, 10)
+    finally:
+        stop.set()
+        writer.join()
+
+
+def test_search_route(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+
+    response = client.get('/search?q=amy tan')
+    assert response.status_code == 200
+    assert response.json['data'][0]['author'] == 'Amy Tan'
+
+    response = client.get('/search?q=amy tna')
+    assert response.json['data'][0]['author'] == 'Amy Tan'
+
+    assert client.get('/search').status_code == 400
+    assert client.get('/search?q=tan&year=abc').status_code == 400
+    assert client.get('/search?q=tan&cursor=nonsense').status_code == 400
+    # Forged offsets are rejected before they reach the query
+    for offset in (-1, 'abc', 1.5, True):
+        assert client.get(f"/search?q=tan&cursor={encode_cursor(offset, 'offset')}").status_code == 400
+
+
+def test_search_pagination(sqlite_app):
+    seed_database(db)
+    client = sqlite_app.test_client()
+
+    everything = client.get('/search?q=the&limit=1000').json['data']
+    assert len(everything) > 3
+
+    isbns = []
+    response = client.get('/search?q=the&limit=2').json
+    while True:
+        isbns.extend(book['isbn'] for book in response['data'])
+        if 'next' not in response:
+            break
+        response = client.get(f"/search?q=the&limit=2&cursor={response['next']}").json
+
+    assert isbns == [book['isbn'] for book in everything]
+
+
+def test_index_follows_availability(sqlite_app):
+    seed_database(db)
+    service = SearchService()
+
+    books, _ = service.search('kitchen god', {'available': 'true'}, 0, 10)
+    isbn = books[0]['isbn']
+
+    from app.controllers.bookController import BookService
+    BookService().rent_book(db, 1, isbn)
+
+    assert service.search('kitchen god', {'available': 'true'}, 0, 10)[0] == []
+    assert service.search('kitchen god', {'available': 'false'}, 0, 10)[0][0]['isbn'] == isbn
+
+    with pytest.raises(ValueError):
+        service.search('kitchen', {'available': 'maybe'}, 0, 10)
+
+
+def test_index_follows_catalog_changes(sqlite_app):
+    seed_database(db)
+    service = SearchService()
+    isbn = service.search('kitchen god', {}, 0, 10)[0][0]['isbn']
+
+    book = db.session.get(Book, isbn)
+    book.title = 'The Quokka Almanac'
+    db.session.flush()
+    db.session.rollback()
+    # Rolled back changes are not indexed
+    assert service.search('quokka', {}, 0, 10)[0] == []
+
+    book = db.session.get(Book, isbn)
+    book.title = 'The Quokka Almanac'
+    db.session.commit()
+    assert [result['isbn'] for result in service.search('quokka almanac', {}, 0, 10)[0]] == [isbn]
+    assert isbn not in [result['isbn'] for result in service.search('kitchen god', {}, 0, 10)[0]]
@@ -0,0 +1,59 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+from app import serialization
+from app.controllers.bookController import BOOK_FIELDS
+from app.models import db, Book, RentedHistory, User
+from app.serialization import dumps, model_serializer, rows_to_dicts, stream_dicts
+from app.utilities import seed_database, to_dict
+
+VALUE = {'title': 'Ελληνικά', 'day': date(2023, 1, 2), 'at': datetime(2023, 1, 2, 3, 4, 5), 'fee': Decimal('4.5'),
+         'count': 3, 'none': None, 'flag': True}
+
+
+@pytest.mark.parametrize('encoder', ['orjson', 'json'])
+def test_dumps_is_the_same_with_and_without_orjson(monkeypatch, encoder):
+    if encoder == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(serialization, 'orjson', None)
+
+    assert dumps(VALUE) == ('{"title":"Ελληνικά","day":"2023-01-02","at":"2023-01-02T03:04:05","fee":4.5,'
+                            '"count":3,"none":null,"flag":true}').encode()
+    assert serialization.loads(dumps(VALUE))['fee'] == 4.5
+
+
+def test_model_serializer(sqlite_app):
+    seed_database(db)
+
+    user = db.session.get(User, 1)
+    assert set(to_dict(user)) == {'id', 'username', 'email'}
+    assert model_serializer(User) is model_serializer(User)
+
+    rental = db.session.execute(select(RentedHistory).limit(1)).scalar()
+    assert isinstance(to_dict(rental)['start_date'], str)
+
+    book = db.session.get(Book, '074322678X')
+    row = db.session.execute(select(*BOOK_FIELDS).where(Book.isbn == book.isbn)).one()
+    assert to_dict(book) == rows_to_dicts([row])[0] == dict(row._mapping)
+
+
+def test_row_serializers(sqlite_app):
+    seed_database(db)
+
+    rows = rows_to_dicts(db.session.execute(select(*BOOK_FIELDS).order_by(Book.isbn)))
+    assert rows == [dict(row) for row in db.session.execute(select(*BOOK_FIELDS).order_by(Book.isbn)).mappings()]
+    assert list(stream_dicts(db.session.execute(select(*BOOK_FIELDS).order_by(Book.isbn)))) == rows
+    assert rows_to_dicts(db.session.execute(select(*BOOK_FIELDS).where(Book.isbn == 'missing'))) == []
+
+
+def test_responses_use_the_json_provider(sqlite_app):
+    seed_database(db)
+    response = sqlite_app.test_client().get('/books?limit=2')
+
+    assert isinstance(sqlite_app.json, serialization.JSONProvider)
+    assert response.mimetype == 'application/json'
+    # Compact, in the order of the envelope and the columns
+    assert response.get_data().startswith(b'{"status":"success","status code":200,"data":[{"isbn":')
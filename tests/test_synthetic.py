@@ -0,0 +1,83 @@
+from collections import Counter
+from itertools import islice
+
+from sqlalchemy import func
+from werkzeug.security import check_password_hash
+
+from app.controllers.searchController import SearchService
+from app.loader import bulk_load_books
+from app.models import db, Book, DailyRevenue, RentedHistory, User
+from app.fees import rental_fee
+from app.synthetic import (ZipfSampler, book_isbn, generate_books, generate_rentals, generate_users, load_dataset,
+                           popular_isbn, write_dataset)
+
+
+def test_generators_are_deterministic():
+    assert list(generate_books(50, seed=7)) == list(generate_books(50, seed=7))
+    assert list(generate_books(50, seed=7)) != list(generate_books(50, seed=8))
+    assert list(generate_rentals(100, 50, 10, seed=7)) == list(generate_rentals(100, 50, 10, seed=7))
+    # Password hashes too, and they are valid werkzeug hashes
+    users = list(generate_users(3, seed=7))
+    assert users == list(generate_users(3, seed=7))
+    assert check_password_hash(users[0]['password'], 'synthetic')
+
+
+def test_rental_fees_use_the_pricing_tiers():
+    tiers = ((3, 2.0), (None, 5.0))
+    rentals = list(generate_rentals(200, 50, 10, seed=7, tiers=tiers))
+
+    assert [rental['total_cost'] for rental in rentals] == \
+        [rental_fee(rental['start_date'], rental['end_date'], tiers) for rental in rentals]
+    assert rentals != list(generate_rentals(200, 50, 10, seed=7))
+
+
+def test_popularity_is_zipfian():
+    rentals = list(generate_rentals(20000, 1000, 100, seed=1))
+    books = Counter(rental['isbn'] for rental in rentals)
+    users = Counter(rental['user'] for rental in rentals)
+
+    # The best seller is the rank 0 book, and the top 1% of the books gets a large share of the rentals
+    assert books.most_common(1)[0][0] == popular_isbn(0, 1000)
+    assert sum(count for _, count in books.most_common(10)) > 0.3 * len(rentals)
+    assert set(users) <= set(range(1, 101))
+    assert all(rental['start_date'] < rental['end_date'] for rental in rentals)
+
+    sampler = ZipfSampler(10 ** 7)
+    assert sampler.rank(0) == 0 and sampler.rank(0.999999) < 10 ** 7
+
+
+def test_book_isbn_check_digit():
+    # 0-306-40615-2 is the ISBN-10 example of the standard
+    assert book_isbn(30640615) == '0306406152'
+    assert len({book_isbn(index) for index in range(1000)}) == 1000
+
+
+def test_csv_dataset_is_read_by_the_loader(sqlite_app, tmp_path):
+    written = write_dataset(str(tmp_path / 'data'), books=300, users=20, rentals=500, seed=3)
+
+    assert {name: file['rows'] for name, file in written.items()} == {'books': 300, 'users': 20, 'rentals': 500}
+    stats = bulk_load_books(db, written['books']['path'], chunk_size=100)
+
+    assert stats['rows'] == 300
+    book = db.session.get(Book, book_isbn(42))
+    assert book.title == next(islice(generate_books(300, seed=3), 42, None))['title']
+
+
+def test_load_dataset(sqlite_app):
+    loaded = load_dataset(db, books=500, users=30, rentals=2000, seed=5, chunk_size=300)
+
+    assert (loaded['books'], loaded['users'], loaded['rentals']) == (500, 30, 2000)
+    assert Book.query.count() == 500 and RentedHistory.query.count() == 2000
+    assert db.session.get(User, 1).isAdmin is True
+    # Popular books have more copies
+    assert db.session.get(Book, popular_isbn(0, 500)).copies == 3
+
+    # The revenue rollup matches the rental history
+    revenue = db.session.query(func.sum(DailyRevenue.revenue), func.sum(DailyRevenue.rentals)).one()
+    assert revenue[1] == 2000
+    assert round(revenue[0], 2) == round(db.session.query(func.sum(RentedHistory.total_cost)).scalar(), 2)
+
+    # Generated titles and authors are searchable
+    book = db.session.get(Book, book_isbn(7))
+    results, _ = SearchService().search(f'{book.title} {book.author}', {}, 0, 50)
+    assert book.isbn in [result['isbn'] for result in results]
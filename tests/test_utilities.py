@@ -1,5 +1,9 @@
-
+import jwt
+import pytest
+from app.controllers.userController import UserService
+from app.models import db, SeedVersion, User, Book
 from app.utilities import is_date_args_valid as checkArgs
+from app.utilities import authenticate, seed_database, token_cache, SEED_VERSION
 
 
 def test_valid_dates():
@@ -73,3 +77,43 @@ def test_user_invalid_data():
     data = {'username': 'john_doe', 'email': 'john@example.com', 'password': 'password123', 'extra': 'value'}
     result = user_data_is_valid(data)
     assert result is True
+
+
+def test_seed_database_is_idempotent(sqlite_app):
+    assert seed_database(db) is True
+    assert seed_database(db) is False
+
+    assert db.session.get(SeedVersion, SEED_VERSION) is not None
+    assert User.query.count() == 4
+    assert Book.query.count() == 499
+
+
+def test_authenticate_uses_role_claim(sqlite_app):
+    token = UserService().generate_token(42, is_admin=True)
+
+    # No user 42 in the database - the role comes from the token claim
+    assert authenticate(token) == {'id': 42, 'isAdmin': True}
+    assert token_cache.get(token)['user_id'] == 42
+
+def test_authenticate_invalidated_on_user_change(sqlite_app):
+    user = User('jane', 'jane@example.com', 'secret')
+    db.session.add(user)
+    db.session.commit()
+
+    token = UserService().generate_token(user.id, is_admin=False)
+    assert authenticate(token)['isAdmin'] is False
+
+    # A rolled back change keeps the role
+    user.isAdmin = True
+    db.session.flush()
+    db.session.rollback()
+    assert authenticate(token)['isAdmin'] is False
+
+    user.isAdmin = True
+    db.session.commit()
+    assert authenticate(token)['isAdmin'] is True
+
+    db.session.delete(user)
+    db.session.commit()
+    with pytest.raises(jwt.InvalidTokenError):
+        authenticate(token)